@@ -0,0 +1,128 @@
+# Файл: auction_scheduler.py
+# Планировщик завершения аукционов: min-куча дедлайнов с ленивой отменой
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class AuctionScheduler:
+    """
+    Закрывает аукционы точно в момент дедлайна. Дедлайны хранятся в min-куче
+    (вставка O(log n)); при переносе или отмене старая запись остается в куче
+    и пропускается при извлечении. Наступившие дедлайны отдаются пачками в on_due;
+    аукционы, которые on_due не смог закрыть, планируются повторно с нарастающей паузой.
+    """
+
+    def __init__(self, batch_size: int = 100, clock: Callable[[], float] = time.time,
+                 retry_delay: float = 1.0, max_retry_delay: float = 60.0):
+        self.batch_size = batch_size
+        self.clock = clock
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # on_due(ids) возвращает id, которые закрыть не удалось (или None, если закрыты все)
+        self.on_due: Optional[Callable[[List[int]], Awaitable[Optional[List[int]]]]] = None
+        self._heap: List[Tuple[float, int]] = []
+        self._deadlines: Dict[int, float] = {}
+        # Число неудачных попыток закрытия подряд по аукциону
+        self._failures: Dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'fired': 0, 'batches': 0, 'retries': 0, 'max_lateness': 0.0}
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, auction_id: int, deadline: float):
+        """Запланировать (или перенести) завершение аукциона на deadline (Unix time)"""
+        self._deadlines[auction_id] = deadline
+        if not self._heap or deadline < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (deadline, auction_id))
+
+    def cancel(self, auction_id: int):
+        """Отменить завершение (запись в куче будет пропущена при извлечении)"""
+        self._deadlines.pop(auction_id, None)
+
+    def pop_due(self, now: float) -> List[int]:
+        """Извлечь до batch_size аукционов, дедлайн которых уже наступил"""
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            deadline, auction_id = heapq.heappop(self._heap)
+            if self._deadlines.get(auction_id) != deadline:
+                continue  # отменен или перенесен
+            del self._deadlines[auction_id]
+            due.append(auction_id)
+            self.stats['max_lateness'] = max(self.stats['max_lateness'], now - deadline)
+        return due
+
+    def _next_deadline(self) -> Optional[float]:
+        """Ближайший действующий дедлайн (устаревшие записи снимаются с вершины кучи)"""
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _retry_failed(self, due: List[int], failed: List[int]):
+        """Запланировать повторное закрытие аукционов, которые on_due не закрыл"""
+        failed_set = set(failed)
+        for auction_id in due:
+            if auction_id not in failed_set:
+                self._failures.pop(auction_id, None)
+        for auction_id in failed_set:
+            if auction_id in self._deadlines:
+                continue  # за время закрытия дедлайн перенесли - действует новый
+            attempt = self._failures.get(auction_id, 0)
+            self._failures[auction_id] = attempt + 1
+            delay = min(self.retry_delay * 2 ** attempt, self.max_retry_delay)
+            self.stats['retries'] += 1
+            self.schedule(auction_id, self.clock() + delay)
+
+    def start(self, on_due: Callable[[List[int]], Awaitable[Optional[List[int]]]]):
+        """Запустить планировщик в текущем цикле событий"""
+        self.on_due = on_due
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Auction scheduler started ({len(self)} deadlines)")
+
+    async def stop(self):
+        """Остановить планировщик"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logging.info(f"Auction scheduler stopped: {self.stats}")
+
+    async def _run(self):
+        """Спим до ближайшего дедлайна или до появления более раннего"""
+        while True:
+            self._wakeup.clear()
+            deadline = self._next_deadline()
+            if deadline is None:
+                await self._wakeup.wait()
+                continue
+
+            delay = deadline - self.clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = self.pop_due(self.clock())
+            if not due:
+                continue
+            self.stats['fired'] += len(due)
+            self.stats['batches'] += 1
+            try:
+                failed = await self.on_due(due) or []
+            except Exception as e:
+                logging.error(f"Error finalizing auctions {due}: {e}")
+                failed = due
+            if failed:
+                logging.warning(f"Auctions {failed} were not closed, retrying")
+            self._retry_failed(due, failed)
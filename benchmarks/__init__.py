@@ -0,0 +1,2 @@
+# Файл: benchmarks/__init__.py
+# Бенчмарки и нагрузочные проверки бота. Запуск: python -m benchmarks.<имя> (из корня репозитория)
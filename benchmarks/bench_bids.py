@@ -0,0 +1,163 @@
+# Файл: benchmarks/bench_bids.py
+# Конкурентные ставки и выкупы на один лот: нет потерянных обновлений и двойных продаж
+#
+# python -m benchmarks.bench_bids [ставок] [соединений]
+#
+# Ставки и выкупы идут через BidEngine одновременно из нескольких экземпляров Database
+# на одном файле (как из нескольких процессов бота, у каждого свои акторы) и из корутин
+# внутри каждого из них.
+
+import asyncio
+import random
+import sys
+import time
+
+from benchmarks.harness import report, run, seed_auctions, temp_database
+from bid_engine import BidEngine
+from database import Database
+
+START_PRICE = 100
+# Сколько раз участник повторяет ставку после конфликта с другим процессом (как повторное нажатие кнопки)
+BID_ATTEMPTS = 3
+# Все вызовы приходят в случайный момент этого окна, с
+SPREAD = 1.0
+
+
+async def bidder(engine: BidEngine, auction_id: int, bidder_id: int, accepted: list, rejected: list):
+    """Как обработчик кнопки: читает лот и делает ставку; при конфликте читает заново"""
+    increment = random.choice((10, 25, 50, 100))
+    await asyncio.sleep(random.uniform(0.0, SPREAD))
+    for _ in range(BID_ATTEMPTS):
+        auction = await engine.db.get_auction(auction_id)
+        if auction is None or auction['status'] != 'active':
+            break
+        result = await engine.place_bid(auction, bidder_id, f'user{bidder_id}', increment)
+        if result['accepted']:
+            accepted.append((bidder_id, increment, result['auction']['current_price']))
+            return
+        if result['reason'] != 'conflict':
+            break
+    rejected.append(bidder_id)
+
+
+async def buyer(engine: BidEngine, auction_id: int, buyer_id: int, sales: list):
+    await asyncio.sleep(random.uniform(0.0, SPREAD))
+    for _ in range(BID_ATTEMPTS):
+        auction = await engine.db.get_auction(auction_id)
+        if auction is None or auction['status'] != 'active':
+            return
+        result = await engine.buyout(auction, buyer_id, f'buyer{buyer_id}')
+        if result['accepted']:
+            sales.append((buyer_id, result['auction']['current_price']))
+            return
+        if result['reason'] != 'conflict':
+            return
+
+
+async def bid_rows(db: Database, auction_id: int) -> list:
+    async with db.read_connection() as conn:
+        cursor = await conn.execute(
+            "SELECT id, bidder_id, amount FROM bids WHERE auction_id = ? ORDER BY id", (auction_id,))
+        return await cursor.fetchall()
+
+
+async def connections(path: str, count: int) -> list:
+    instances = []
+    for _ in range(count):
+        instance = Database(path, pool_readers=2)
+        await instance.init_db()
+        instances.append(instance)
+    return instances
+
+
+async def check_bids(engines: list, bids: int) -> dict:
+    """Только ставки: итоговая цена = стартовая + сумма принятых шагов, строка в bids на каждую принятую"""
+    auction_id = 1
+    accepted, rejected = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(bidder(engines[n % len(engines)], auction_id, n, accepted, rejected) for n in range(bids)))
+    elapsed = time.perf_counter() - started
+
+    auction = await engines[0].db.get_auction(auction_id)
+    rows = await bid_rows(engines[0].db, auction_id)
+    assert auction['current_price'] == START_PRICE + sum(increment for _, increment, _ in accepted), \
+        f"final price {auction['current_price']} != start + accepted increments"
+    assert len(rows) == len(accepted), f"{len(rows)} bid rows for {len(accepted)} accepted bids"
+    # Каждая принятая ставка подняла цену: двух победителей на одном шаге нет
+    amounts = [amount for _, _, amount in rows]
+    assert amounts == sorted(set(amounts)), "two bids won the same price step"
+    assert len(accepted) + len(rejected) == bids
+    assert sorted(price for _, _, price in accepted) == amounts
+    leader = max(accepted, key=lambda bid: bid[2])[0]
+    assert auction['current_leader_id'] == leader
+    return {'scenario': 'bids', 'calls': bids, 'accepted': len(accepted), 'rejected': len(rejected),
+            'final_price': auction['current_price'], 'seconds': elapsed}
+
+
+async def check_buyouts(engines: list, buyers: int) -> dict:
+    """Только выкупы: продажа ровно одна"""
+    auction_id = 2
+    sales = []
+    started = time.perf_counter()
+    await asyncio.gather(*(buyer(engines[n % len(engines)], auction_id, n, sales) for n in range(buyers)))
+    elapsed = time.perf_counter() - started
+
+    auction = await engines[0].db.get_auction(auction_id)
+    rows = await bid_rows(engines[0].db, auction_id)
+    assert len(sales) == 1, f"{len(sales)} buyouts succeeded"
+    assert auction['status'] == 'sold' and auction['current_leader_id'] == sales[0][0]
+    assert len(rows) == 1 and rows[0][1] == sales[0][0]
+    return {'scenario': 'buyouts', 'calls': buyers, 'accepted': 1, 'rejected': buyers - 1,
+            'final_price': auction['current_price'], 'seconds': elapsed}
+
+
+async def check_mixed(engines: list, bids: int) -> dict:
+    """Ставки и выкупы вперемешку: одна продажа, после нее ни одной принятой ставки"""
+    auction_id = 3
+    accepted, rejected, sales = [], [], []
+    calls = []
+    for n in range(bids):
+        engine = engines[n % len(engines)]
+        if n % 50 == 25:
+            calls.append(buyer(engine, auction_id, n, sales))
+        else:
+            calls.append(bidder(engine, auction_id, n, accepted, rejected))
+    started = time.perf_counter()
+    await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - started
+
+    auction = await engines[0].db.get_auction(auction_id)
+    rows = await bid_rows(engines[0].db, auction_id)
+    assert len(sales) == 1, f"{len(sales)} buyouts succeeded"
+    assert auction['status'] == 'sold' and auction['current_price'] == auction['blitz_price']
+    assert len(rows) == len(accepted) + 1
+    # Последняя запись - выкуп: ставки после продажи не прошли
+    assert rows[-1][1] == sales[0][0] and rows[-1][2] == auction['blitz_price']
+    amounts = [amount for _, _, amount in rows[:-1]]
+    assert amounts == sorted(set(amounts)), "two bids won the same price step"
+    return {'scenario': 'bids+buyouts', 'calls': bids, 'accepted': len(accepted) + 1,
+            'rejected': bids - len(accepted) - 1, 'final_price': auction['current_price'], 'seconds': elapsed}
+
+
+async def main(bids: int = 5000, connection_count: int = 4):
+    async with temp_database() as (db, _):
+        await seed_auctions(db, 3, blitz_price=10 ** 9)
+        dbs = [db] + await connections(db.db_path, connection_count - 1)
+        engines = [BidEngine(instance) for instance in dbs]
+        try:
+            rows = [
+                await check_bids(engines, bids),
+                await check_buyouts(engines, bids // 5),
+                await check_mixed(engines, bids),
+            ]
+        finally:
+            for engine in engines:
+                await engine.stop()
+            for instance in dbs[1:]:
+                await instance.close()
+    report(f"Конкурентные операции на одном лоте ({connection_count} соединений)", rows)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    run(lambda: main(*args))
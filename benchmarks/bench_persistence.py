@@ -0,0 +1,49 @@
+# Файл: benchmarks/bench_persistence.py
+# Сравнение хранилищ снимка AuctionPersistence: время записи/восстановления и остановки цикла событий
+#
+# python -m benchmarks.bench_persistence [лотов] [ставок на лот]
+
+import sys
+
+from benchmarks.harness import measure, report, run, seed_auctions, temp_database
+from persistence import AuctionPersistence
+from snapshot_backends import create_backend
+
+# (название, PERSISTENCE_BACKEND, имя файла снимка)
+BACKENDS = [
+    ('json', 'json', 'state.json'),
+    ('jsonl', 'json', 'state.jsonl'),
+    ('jsonl.gz', 'json', 'state.jsonl.gz'),
+    ('sqlite', 'sqlite', 'state.json'),
+    ('none', 'none', 'state.json'),
+]
+
+
+async def main(lots: int = 5000, bids_per_lot: int = 20):
+    rows = []
+    async with temp_database() as (db, workdir):
+        await seed_auctions(db, lots, bids_per_lot)
+        for name, kind, filename in BACKENDS:
+            def make_persistence():
+                backend = create_backend(kind, str(workdir / filename), db.db_path)
+                return AuctionPersistence(db, str(workdir / filename), backend=backend)
+
+            persistence = make_persistence()
+            await persistence._load_state()
+            saved, save_time, save_stall = await measure(persistence.save_state())
+            # Восстановление новым экземпляром, как после перезапуска
+            restored, restore_time, restore_stall = await measure(make_persistence().restore_state())
+            assert saved and restored, f"{name}: save={saved} restore={restored}"
+            rows.append({
+                'backend': name,
+                'save_s': save_time,
+                'save_stall_ms': save_stall,
+                'restore_s': restore_time,
+                'restore_stall_ms': restore_stall,
+            })
+    report(f"Снимок {lots} лотов x {bids_per_lot} ставок", rows)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    run(lambda: main(*args))
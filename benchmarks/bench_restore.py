@@ -0,0 +1,64 @@
+# Файл: benchmarks/bench_restore.py
+# Восстановление ставок из синтетического снимка (по умолчанию 10k лотов x 50 ставок)
+#
+# python -m benchmarks.bench_restore [лотов] [ставок на лот] [файл снимка]
+#
+# Первый запуск restore_state дописывает все ставки снимка в пустую таблицу bids,
+# второй проверяет идемпотентность: ставки не дублируются, цены не меняются.
+
+import sys
+from datetime import timedelta
+
+from benchmarks.harness import measure, report, run, seed_auctions, temp_database
+from persistence import AuctionPersistence
+from snapshot_backends import create_backend
+from utils import now
+
+START_PRICE = 100
+
+
+def synthetic_snapshot(auction_ids: list, bids_per_lot: int):
+    """Заголовок и лоты снимка: ставки по лоту растут на 1, новые первыми (как пишет AuctionPersistence)"""
+    end_time = str(now() + timedelta(hours=1))
+    header = {'version': '1.0', 'journal_seq': 0, 'total_active_auctions': len(auction_ids)}
+    records = (
+        ({'id': auction_id, 'end_time': end_time, 'current_price': START_PRICE + bids_per_lot},
+         [{'bidder_id': 1000 + n, 'bidder_username': f'user{n}', 'amount': START_PRICE + n,
+           'created_at': f'2026-01-01 00:{n // 60:02d}:{n % 60:02d}'}
+          for n in range(bids_per_lot, 0, -1)])
+        for auction_id in auction_ids
+    )
+    return header, records
+
+
+async def database_state(db) -> tuple:
+    async with db.read_connection() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM bids")
+        bid_count = (await cursor.fetchone())[0]
+        cursor = await conn.execute(
+            "SELECT MIN(current_price), MAX(current_price), COUNT(DISTINCT current_leader_id) FROM auctions")
+        prices = tuple(await cursor.fetchone())
+    return bid_count, prices
+
+
+async def main(lots: int = 10_000, bids_per_lot: int = 50, filename: str = 'state.json'):
+    async with temp_database() as (db, workdir):
+        # Лоты есть в базе, ставок нет: как после потери базы со ставками
+        auction_ids = await seed_auctions(db, lots, start_price=START_PRICE)
+        path = str(workdir / filename)
+        create_backend('json', path).write_snapshot(*synthetic_snapshot(auction_ids, bids_per_lot))
+
+        rows = []
+        expected = (lots * bids_per_lot, (START_PRICE + bids_per_lot, START_PRICE + bids_per_lot, 1))
+        for run_name in ('first', 'repeat'):
+            restored, elapsed, stall = await measure(AuctionPersistence(db, path).restore_state())
+            state = await database_state(db)
+            assert restored, f"{run_name} restore failed"
+            assert state == expected, f"{run_name} restore: bids/prices {state}, expected {expected}"
+            rows.append({'restore': run_name, 'bids_in_db': state[0], 'seconds': elapsed, 'max_stall_ms': stall})
+    report(f"Восстановление {lots} лотов x {bids_per_lot} ставок ({filename})", rows)
+
+
+if __name__ == '__main__':
+    args = [cast(arg) for cast, arg in zip((int, int, str), sys.argv[1:4])]
+    run(lambda: main(*args))
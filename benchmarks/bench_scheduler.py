@@ -0,0 +1,99 @@
+# Файл: benchmarks/bench_scheduler.py
+# Проверка AuctionScheduler на 100k синтетических дедлайнов: вставка O(log n) и срабатывание вовремя
+#
+# python -m benchmarks.bench_scheduler [дедлайнов] [окно срабатывания, с]
+
+import asyncio
+import math
+import random
+import sys
+import time
+
+from benchmarks.harness import report, run
+from auction_scheduler import AuctionScheduler
+
+# Допустимое опоздание срабатывания, с
+MAX_LATENESS = 0.5
+
+
+class CountingDeadline(float):
+    """Дедлайн, который считает сравнения "меньше" при перестройке кучи"""
+    comparisons = 0
+
+    def __lt__(self, other):
+        CountingDeadline.comparisons += 1
+        return float.__lt__(self, other)
+
+
+def check_insert_complexity(count: int) -> list:
+    """
+    Худший случай для кучи - дедлайны по убыванию: каждый новый поднимается до вершины.
+    Число сравнений на вставку должно оставаться в пределах log2(n) + константа.
+    """
+    rows = []
+    size = 1000
+    while size <= count:
+        scheduler = AuctionScheduler()
+        worst = 0
+        started = time.perf_counter()
+        for auction_id in range(size):
+            before = CountingDeadline.comparisons
+            scheduler.schedule(auction_id, CountingDeadline(size - auction_id))
+            worst = max(worst, CountingDeadline.comparisons - before)
+        elapsed = time.perf_counter() - started
+        # Одно сравнение с вершиной в schedule, не больше log2(n) при подъеме по куче
+        bound = math.floor(math.log2(size)) + 1
+        assert worst <= bound, f"{size} deadlines: {worst} comparisons per insert, bound {bound}"
+        rows.append({'deadlines': size, 'max_cmp_per_insert': worst, 'log2_bound': bound,
+                     'us_per_insert': elapsed / size * 1e6})
+        size *= 10
+    return rows
+
+
+async def check_firing(count: int, window: float) -> dict:
+    """Дедлайны равномерно в ближайшие window секунд; каждый десятый отменяется"""
+    scheduler = AuctionScheduler()
+    start = time.time() + 0.2
+    deadlines = {auction_id: start + random.random() * window for auction_id in range(count)}
+    for auction_id, deadline in deadlines.items():
+        scheduler.schedule(auction_id, deadline)
+    cancelled = set(range(0, count, 10))
+    for auction_id in cancelled:
+        scheduler.cancel(auction_id)
+    expected = count - len(cancelled)
+
+    fired = {}
+    done = asyncio.Event()
+
+    async def on_due(ids):
+        fired_at = time.time()
+        for auction_id in ids:
+            fired[auction_id] = fired_at
+        if len(fired) >= expected:
+            done.set()
+
+    scheduler.start(on_due)
+    try:
+        await asyncio.wait_for(done.wait(), timeout=window + 10)
+        await asyncio.sleep(0.1)  # отмененные не должны сработать и после остальных
+    finally:
+        await scheduler.stop()
+
+    early = [auction_id for auction_id, at in fired.items() if at < deadlines[auction_id]]
+    lateness = max(at - deadlines[auction_id] for auction_id, at in fired.items())
+    assert len(fired) == expected, f"fired {len(fired)} of {expected}"
+    assert not cancelled & fired.keys(), "cancelled deadlines fired"
+    assert not early, f"{len(early)} deadlines fired early"
+    assert lateness <= MAX_LATENESS, f"max lateness {lateness:.3f}s"
+    return {'deadlines': count, 'cancelled': len(cancelled), 'fired': len(fired),
+            'batches': scheduler.stats['batches'], 'max_lateness_s': lateness}
+
+
+async def main(count: int = 100_000, window: float = 3.0):
+    report("Вставка в кучу (дедлайны по убыванию)", check_insert_complexity(count))
+    report("Срабатывание дедлайнов", [await check_firing(count, window)])
+
+
+if __name__ == '__main__':
+    args = [cast(arg) for cast, arg in zip((int, float), sys.argv[1:3])]
+    run(lambda: main(*args))
@@ -0,0 +1,116 @@
+# Файл: benchmarks/harness.py
+# Общая обвязка бенчмарков: временная база, синтетические лоты, замер времени и задержек цикла событий
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Модули бота лежат в корне репозитория
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from database import Database  # noqa: E402
+from utils import now, now_ms, to_epoch_ms  # noqa: E402
+
+
+@asynccontextmanager
+async def temp_database(pool_readers: int = 4):
+    """Пустая база во временном каталоге: (Database, каталог). Каталог удаляется после блока"""
+    with tempfile.TemporaryDirectory(prefix='auction_bench_') as workdir:
+        db = Database(os.path.join(workdir, 'bench.db'), pool_readers=pool_readers)
+        await db.init_db()
+        try:
+            yield db, Path(workdir)
+        finally:
+            await db.close()
+
+
+async def seed_auctions(db: Database, count: int, bids_per_lot: int = 0, start_price: int = 100,
+                        blitz_price: int = 0, duration: timedelta = timedelta(hours=1)) -> List[int]:
+    """
+    Создать count активных лотов (id 1..count) и по bids_per_lot ставок на каждый
+    одной транзакцией. Ставки растут на 1, текущая цена лота равна последней ставке.
+    """
+    end_time = now() + duration
+    end_ts = to_epoch_ms(end_time)
+    created_ts = now_ms()
+    auction_ids = list(range(1, count + 1))
+    async with db.write_connection() as conn:
+        await conn.executemany(
+            "INSERT INTO auctions (id, owner_id, description, start_price, blitz_price, current_price, "
+            "end_time, end_ts, created_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(auction_id, 1, f'Лот {auction_id}', start_price, blitz_price, start_price + bids_per_lot,
+              end_time, end_ts, created_ts) for auction_id in auction_ids]
+        )
+        if bids_per_lot:
+            await conn.executemany(
+                "INSERT INTO bids (auction_id, bidder_id, bidder_username, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(auction_id, 1000 + n, f'user{n}', start_price + n, f'2026-01-01 00:{n // 60:02d}:{n % 60:02d}')
+                 for auction_id in auction_ids for n in range(1, bids_per_lot + 1)]
+            )
+        await conn.commit()
+    await db.load_channel_index()
+    return auction_ids
+
+
+async def _probe(stop: asyncio.Event, gaps: List[float], interval: float):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        current = time.perf_counter()
+        gaps.append(current - last - interval)
+        last = current
+
+
+async def measure(awaitable: Awaitable[Any], interval: float = 0.001) -> Tuple[Any, float, float]:
+    """
+    Выполнить awaitable и вернуть (результат, время в секундах, самая долгая остановка цикла в мс).
+    Остановка - насколько позже проснулась проверочная задача, спящая по interval.
+    """
+    stop = asyncio.Event()
+    gaps: List[float] = []
+    probe = asyncio.create_task(_probe(stop, gaps, interval))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    try:
+        result = await awaitable
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe
+    return result, elapsed, max(gaps, default=0.0) * 1000
+
+
+def report(title: str, rows: Iterable[Dict[str, Any]]):
+    """Напечатать результаты таблицей: колонки - ключи первой строки"""
+    rows = list(rows)
+    print(f"\n{title}")
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[_format(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return '' if value is None else str(value)
+
+
+def run(main: Callable[[], Awaitable[Any]], quiet: bool = True):
+    """Запустить бенчмарк; логи бота глушатся, чтобы не мешать замерам"""
+    if quiet:
+        logging.disable(logging.CRITICAL)
+    return asyncio.run(main())
@@ -0,0 +1,263 @@
+# Файл: bid_engine.py
+# Акторы аукционов: ставки упорядочиваются в памяти, а в базу пишутся групповыми коммитами
+
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from utils import now_ms
+
+
+class AuctionActor:
+    """
+    Актор одного аукциона. Владеет текущей ценой и лидером, обрабатывает
+    ставки строго по очереди и сбрасывает принятые ставки в базу пачками.
+    Ответ "принято" заявка получает только после записи своей пачки в базу.
+    """
+
+    def __init__(self, engine: "BidEngine", auction: Dict):
+        self.engine = engine
+        self.auction_id = auction['id']
+        self.state = dict(auction)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.pending: List[Dict] = []
+        self.flushed_price = auction['current_price']
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_failed = False
+        # Аукцион изменили в обход актора: состояние в памяти устарело, актор больше не принимает заявок
+        self.retired = False
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, kind: str, bidder_id: int, bidder_username: str, increment: int = 0) -> Dict:
+        """Поставить заявку в очередь актора и дождаться решения"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((kind, bidder_id, bidder_username, increment, future))
+        return await future
+
+    async def _run(self):
+        """Основной цикл актора: заявки обрабатываются по одной в порядке поступления"""
+        try:
+            while True:
+                try:
+                    kind, bidder_id, bidder_username, increment, future = await asyncio.wait_for(
+                        self.queue.get(), timeout=self.engine.idle_timeout
+                    )
+                except asyncio.TimeoutError:
+                    if self.queue.empty() and not self.pending:
+                        break
+                    continue
+
+                if future.done():
+                    continue
+                try:
+                    result = self._apply(kind, bidder_id, bidder_username, increment)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    if result['accepted']:
+                        # Ответ отправит _flush, когда пачка будет записана
+                        self.pending[-1]['ack'] = (future, result)
+                    else:
+                        future.set_result(result)
+
+                if self.pending and self._flush_task is None:
+                    self._flush_task = asyncio.create_task(self._flush_later())
+
+                if self.retired or (self.state['status'] != 'active' and self.queue.empty()):
+                    break
+        finally:
+            await self._drain()
+            self.engine._forget(self)
+
+    def _apply(self, kind: str, bidder_id: int, bidder_username: str, increment: int) -> Dict:
+        """Проверить и применить заявку к состоянию в памяти"""
+        state = self.state
+
+        if self.retired:
+            return {'accepted': False, 'reason': 'conflict', 'auction': dict(state)}
+
+        if state['status'] != 'active':
+            return {'accepted': False, 'reason': state['status'], 'auction': dict(state)}
+
+        if kind == 'close':
+            # Дедлайн наступил (вызывает планировщик): победитель - текущий лидер
+            state['status'] = 'sold' if state.get('current_leader_id') else 'expired'
+            self.pending.append({'status': state['status']})
+            return {'accepted': True, 'reason': None, 'auction': dict(state)}
+
+        # Закрытие по времени делает только планировщик, здесь лишь отклоняем ставку
+        # (лот без end_ts - окончание не удалось перенести из старой базы - ставок не принимает)
+        if state['end_ts'] is None or now_ms() >= state['end_ts']:
+            return {'accepted': False, 'reason': 'expired', 'auction': dict(state)}
+
+        blitz_price = state.get('blitz_price')
+        if kind == 'buyout':
+            if not blitz_price:
+                return {'accepted': False, 'reason': 'no_blitz', 'auction': dict(state)}
+            new_price = blitz_price
+            state['status'] = 'sold'
+        else:
+            if blitz_price and state['current_price'] >= blitz_price:
+                return {'accepted': False, 'reason': 'blitz_reached', 'auction': dict(state)}
+            new_price = state['current_price'] + increment
+            if blitz_price and new_price >= blitz_price:
+                new_price = blitz_price
+
+        state['current_price'] = new_price
+        state['current_leader_id'] = bidder_id
+        state['current_leader_username'] = bidder_username
+        self.pending.append({
+            'bidder_id': bidder_id,
+            'bidder_username': bidder_username,
+            'amount': new_price,
+            'status': state['status'],
+        })
+        return {'accepted': True, 'reason': None, 'auction': dict(state)}
+
+    async def _flush_later(self):
+        """Групповой коммит: ждем несколько миллисекунд, собирая ставки в пачку"""
+        await asyncio.sleep(self.engine.retry_delay if self._flush_failed else self.engine.flush_interval)
+        await self._flush()
+        self._flush_task = None
+        if self.pending and not self._closing:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush(self):
+        """Записать накопленные ставки в базу одной транзакцией"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        bids = [item for item in batch if 'bidder_id' in item]
+        # Снимок состояния берем до await: пока идет коммит, актор принимает новые ставки
+        price = self.state['current_price']
+        try:
+            applied = await self.engine.db.apply_bid_batch(
+                self.auction_id,
+                self.flushed_price,
+                bids,
+                price,
+                self.state['current_leader_id'],
+                self.state['current_leader_username'],
+                batch[-1]['status']
+            )
+        except Exception as e:
+            # Возвращаем пачку в очередь записи, следующая попытка повторит коммит
+            self.pending = batch + self.pending
+            self._flush_failed = True
+            logging.error(f"Error flushing bids for auction {self.auction_id}: {e}")
+            return
+
+        self._flush_failed = False
+        if applied:
+            self.flushed_price = price
+            self.engine.stats['flushes'] += 1
+            self.engine.stats['flushed_bids'] += len(bids)
+            for item in batch:
+                future, result = item.get('ack', (None, None))
+                if future is not None and not future.done():
+                    future.set_result(result)
+            return
+
+        # Аукцион изменили в обход актора (закрыли, удалили): состояние в базе важнее.
+        # Не записаны ни пачка, ни заявки, принятые после нее поверх устаревшего состояния -
+        # их авторы получают отказ. apply_bid_batch уже обновил снимок лота в индексе,
+        # следующая ставка создаст новый актор из него
+        lost, self.pending = batch + self.pending, []
+        self.retired = True
+        self.engine._forget(self)
+        self.engine.stats['conflicts'] += 1
+        logging.warning(
+            f"Auction {self.auction_id} changed outside of its actor, {len(lost)} requests rejected"
+        )
+        for item in lost:
+            future, _ = item.get('ack', (None, None))
+            if future is not None and not future.done():
+                future.set_result({'accepted': False, 'reason': 'conflict', 'auction': dict(self.state)})
+
+    async def _drain(self):
+        """Дописать все принятые ставки перед остановкой актора"""
+        self._closing = True
+        if self._flush_task is not None:
+            # Коммит в полете не прерываем, иначе пачка может потеряться
+            await self._flush_task
+        # Актор остается в реестре, пока ставки не записаны: иначе следующая ставка
+        # создала бы новый актор из устаревшего снимка базы
+        await self._flush()
+        while self.pending:
+            await asyncio.sleep(self.engine.retry_delay)
+            await self._flush()
+
+        # Ответить тем, кто успел встать в очередь после остановки
+        if self.retired:
+            reason = 'conflict'
+        else:
+            reason = self.state['status'] if self.state['status'] != 'active' else 'stopped'
+        while not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_result({'accepted': False, 'reason': reason, 'auction': dict(self.state)})
+
+    async def stop(self):
+        """Остановить актор, сохранив принятые ставки"""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class BidEngine:
+    """Реестр акторов активных аукционов (по одному на аукцион)"""
+
+    def __init__(self, db, flush_interval: float = 0.005, idle_timeout: float = 300,
+                 retry_delay: float = 1.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self.retry_delay = retry_delay
+        self.actors: Dict[int, AuctionActor] = {}
+        self.stats = {'bids': 0, 'accepted': 0, 'flushes': 0, 'flushed_bids': 0, 'conflicts': 0}
+
+    def _get_actor(self, auction: Dict) -> AuctionActor:
+        """Получить актор аукциона, создав его из снимка базы при первой ставке"""
+        actor = self.actors.get(auction['id'])
+        if actor is None:
+            actor = AuctionActor(self, auction)
+            self.actors[auction['id']] = actor
+        return actor
+
+    def _forget(self, actor: AuctionActor):
+        if self.actors.get(actor.auction_id) is actor:
+            del self.actors[actor.auction_id]
+
+    async def place_bid(self, auction: Dict, bidder_id: int, bidder_username: str, increment: int) -> Dict:
+        """Сделать ставку с шагом increment. Возвращает {'accepted', 'reason', 'auction'}"""
+        self.stats['bids'] += 1
+        result = await self._get_actor(auction).submit('bid', bidder_id, bidder_username, increment)
+        if result['accepted']:
+            self.stats['accepted'] += 1
+        return result
+
+    async def buyout(self, auction: Dict, buyer_id: int, buyer_username: str) -> Dict:
+        """Выкуп по блиц-цене через очередь актора"""
+        return await self._get_actor(auction).submit('buyout', buyer_id, buyer_username)
+
+    async def close(self, auction_id: int) -> Optional[Dict]:
+        """
+        Завершить аукцион через его актор, дождавшись записи итогового состояния.
+        Возвращает закрытый аукцион или None, если актора нет, лот уже закрыт
+        или изменен в обход актора (его закроет finalize_auctions по состоянию базы).
+        """
+        actor = self.actors.get(auction_id)
+        if actor is None:
+            return None
+        result = await actor.submit('close', 0, None)
+        return result['auction'] if result['accepted'] else None
+
+    async def stop(self):
+        """Остановить все акторы и записать принятые ставки в базу"""
+        actors = list(self.actors.values())
+        for actor in actors:
+            await actor.stop()
+        logging.info(f"Bid engine stopped ({len(actors)} actors flushed)")
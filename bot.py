@@ -4,17 +4,17 @@
 import asyncio
 import logging
 import os
+import signal
 from datetime import datetime, timedelta
-from utils import get_moscow_time_naive as now, format_moscow_time
+from utils import get_moscow_time_naive as now, format_moscow_time, moscow_timestamp, now_ms, from_epoch_ms
 import re
-import threading
-from flask import Flask, request
-import sqlite3
+from quart import Quart, request
 import hashlib
 import hmac
 import aiosqlite
 
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -34,8 +34,17 @@ from aiogram.types import (
 from config import load_config, DISABLE_SUBSCRIPTION_CHECK
 from database import Database
 # from auction_timer import AuctionTimer  # Отключено
-from services import BalanceManager, NotificationManager, AdminPanel, init_notifications, send_auction_created_notification, send_auction_published_notification
+from services import BalanceManager, NotificationManager, AdminPanel, init_notifications, send_auction_created_notification
 from persistence import AuctionPersistence
+from snapshot_backends import create_backend
+from bid_engine import BidEngine
+from channel_editor import ChannelEditor
+from outbox import OutboxDispatcher
+from payment_queue import PaymentQueue, INCOMING_NOTIFICATION_TYPES
+from rate_governor import governor as telegram_governor, install_rate_governor, telegram_lane, LANE_NOTIFICATION
+from auction_scheduler import AuctionScheduler
+from update_queue import UpdateQueue
+from subscription_cache import SubscriptionCache
 # from api_integration import api_integration  # Отключено
 # from yoomoney_payment import YooMoneyPayment  # Отключено
 # from payment_server import get_notification_queue  # Отключено
@@ -107,6 +116,7 @@ BOT_TOKEN = config['BOT_TOKEN']
 PAYMENTS_PROVIDER_TOKEN = config['PAYMENTS_PROVIDER_TOKEN']
 YOOMONEY_RECEIVER = config['YOOMONEY_RECEIVER']
 YOOMONEY_SECRET = config['YOOMONEY_SECRET']
+YOOMONEY_VERIFY_SIGNATURE = config['YOOMONEY_VERIFY_SIGNATURE']
 YOOMONEY_NOTIFICATION_URL = config['YOOMONEY_NOTIFICATION_URL']
 PAYMENT_PLANS = config['PAYMENT_PLANS']
 YOOMONEY_BASE_URL = config['YOOMONEY_BASE_URL']
@@ -115,9 +125,28 @@ CHANNEL_USERNAME_LINK = config['CHANNEL_USERNAME_LINK']
 CHANNEL_DISPLAY_NAME = config['CHANNEL_DISPLAY_NAME']
 ADMIN_USER_IDS = config['ADMIN_USER_IDS']
 DATABASE_PATH = config['DATABASE_PATH']
+DB_POOL_READERS = config['DB_POOL_READERS']
+BID_FLUSH_INTERVAL_MS = config['BID_FLUSH_INTERVAL_MS']
+CHANNEL_EDIT_INTERVAL = config['CHANNEL_EDIT_INTERVAL']
+CHANNEL_PUBLISH_CONCURRENCY = config['CHANNEL_PUBLISH_CONCURRENCY']
+OUTBOX_PUBLISH_INTERVAL = config['OUTBOX_PUBLISH_INTERVAL']
+OUTBOX_MAX_ATTEMPTS = config['OUTBOX_MAX_ATTEMPTS']
+NOTIFICATION_CONCURRENCY = config['NOTIFICATION_CONCURRENCY']
+UPDATE_WORKERS = config['UPDATE_WORKERS']
+UPDATE_QUEUE_SIZE = config['UPDATE_QUEUE_SIZE']
+UPDATE_DEDUP_WINDOW = config['UPDATE_DEDUP_WINDOW']
+SUBSCRIPTION_CACHE_TTL = config['SUBSCRIPTION_CACHE_TTL']
+SUBSCRIPTION_NEGATIVE_TTL = config['SUBSCRIPTION_NEGATIVE_TTL']
+USER_CACHE_SIZE = config['USER_CACHE_SIZE']
+PERSISTENCE_FILE = config['PERSISTENCE_FILE']
+PERSISTENCE_INTERVAL = config['PERSISTENCE_INTERVAL']
+PERSISTENCE_BACKEND = config['PERSISTENCE_BACKEND']
 
 # Инициализация базы данных
-db = Database(DATABASE_PATH)
+db = Database(DATABASE_PATH, pool_readers=DB_POOL_READERS, user_cache_size=USER_CACHE_SIZE)
+
+# Акторы аукционов: ставки обрабатываются в памяти, в базу - групповым коммитом
+bid_engine = BidEngine(db, flush_interval=BID_FLUSH_INTERVAL_MS / 1000)
 
 # Инициализация менеджера балансов
 balance_manager = BalanceManager(DATABASE_PATH)
@@ -207,6 +236,16 @@ except Exception:
     DEFAULT_BOT_KWARGS = {"parse_mode": "HTML"}
 
 # --- Функция проверки подписки на канал ---
+# member, administrator, creator - активные подписчики; left, kicked - не подписан
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator')
+
+async def fetch_user_subscription(user_id: int) -> bool:
+    """Запросить статус подписки у Telegram (без кеша)"""
+    chat_member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
+    is_subscribed = chat_member.status in SUBSCRIBED_STATUSES
+    logging.info(f"User {user_id} subscription check: status={chat_member.status}, subscribed={is_subscribed}")
+    return is_subscribed
+
 async def check_user_subscription(user_id: int) -> bool:
     """Проверяет, подписан ли пользователь на канал"""
     try:
@@ -215,30 +254,54 @@ async def check_user_subscription(user_id: int) -> bool:
             logging.info(f"Subscription check disabled, user {user_id} considered subscribed")
             return True
             
-        # Получаем информацию о статусе подписки пользователя
-        chat_member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
-        
-        # Проверяем статус подписки
-        # member, administrator, creator - активные подписчики
-        # left, kicked - не подписан
-        is_subscribed = chat_member.status in ['member', 'administrator', 'creator']
-        logging.info(f"User {user_id} subscription check: status={chat_member.status}, subscribed={is_subscribed}")
-        return is_subscribed
+        # Статус берется из кеша; одновременные проверки одного пользователя делят один запрос
+        return await subscription_cache.get(user_id)
     except Exception as e:
         logging.error(f"Error checking subscription for user {user_id}: {e}")
         # В случае ошибки считаем, что пользователь не подписан
         return False
 
 # --- Инициализация ---
-bot = Bot(token=BOT_TOKEN, **DEFAULT_BOT_KWARGS)
+# Все запросы бота к Telegram проходят через общий ограничитель (лимиты на чат и глобальный)
+bot = install_rate_governor(Bot(token=BOT_TOKEN, **DEFAULT_BOT_KWARGS))
 dp = Dispatcher()
 logging.basicConfig(level=logging.INFO)
 
+# Общий менеджер уведомлений на сессии бота (без отдельного Bot на каждое уведомление)
+notification_manager = init_notifications(bot, concurrency=NOTIFICATION_CONCURRENCY)
+
+# Зачисление платежей YooMoney и уведомления о пополнении (webhook только сохраняет платеж)
+payment_queue = PaymentQueue(db, notification_manager.send_balance_notification)
+
+# Склеивание правок постов аукционов при всплесках ставок
+channel_editor = ChannelEditor(bot, interval=CHANNEL_EDIT_INTERVAL)
+
+# Ограничение одновременных публикаций в канал: остальные ждут очереди, не блокируя цикл событий
+channel_publish_semaphore = asyncio.Semaphore(CHANNEL_PUBLISH_CONCURRENCY)
+
+# Очередь публикаций в канал: задания из таблицы outbox с повторами и паузами flood control
+outbox_dispatcher = OutboxDispatcher(db, interval=OUTBOX_PUBLISH_INTERVAL, max_attempts=OUTBOX_MAX_ATTEMPTS)
+
+# Кеш проверок подписки на канал (обновляется по событиям chat_member)
+subscription_cache = SubscriptionCache(fetch_user_subscription, positive_ttl=SUBSCRIPTION_CACHE_TTL,
+                                       negative_ttl=SUBSCRIPTION_NEGATIVE_TTL)
+
+# Планировщик завершения аукционов по дедлайнам
+auction_scheduler = AuctionScheduler()
+
+# Очередь обновлений Telegram: ограниченный размер, пул воркеров, порядок по пользователю
+update_queue = UpdateQueue(bot, dp, workers=UPDATE_WORKERS, maxsize=UPDATE_QUEUE_SIZE,
+                           dedup_window=UPDATE_DEDUP_WINDOW)
+
 # Инициализация таймера аукционов
 # auction_timer = AuctionTimer(bot, db, CHANNEL_USERNAME)  # Отключено
 
-# Инициализация системы персистентности аукционов
-auction_persistence = AuctionPersistence(db)
+# Инициализация системы персистентности аукционов (журнал изменений + периодический снимок)
+auction_persistence = AuctionPersistence(
+    db,
+    save_interval=PERSISTENCE_INTERVAL,
+    backend=create_backend(PERSISTENCE_BACKEND, PERSISTENCE_FILE, DATABASE_PATH)
+)
 
 # Связываем таймер с системой персистентности
 # auction_persistence.set_auction_timer(auction_timer)  # Отключено
@@ -258,128 +321,18 @@ def verify_yoomoney_signature(data, secret, signature):
         # Создаем строку для подписи
         string_to_sign = f"{data['notification_type']}&{data['operation_id']}&{data['amount']}&{data['currency']}&{data['datetime']}&{data['sender']}&{data['codepro']}&{secret}&{data['label']}"
         
-        logging.info(f"Строка для подписи: {string_to_sign}")
-        
-        # Вычисляем SHA-1 хеш
+        # Вычисляем SHA-1 хеш (строку не логируем: в ней секрет)
         calculated_signature = hashlib.sha1(string_to_sign.encode('utf-8')).hexdigest()
         
-        logging.info(f"Вычисленная подпись: {calculated_signature}")
-        logging.info(f"Полученная подпись: {signature}")
-        
         # Сравниваем с полученной подписью
         is_valid = hmac.compare_digest(calculated_signature, signature)
-        logging.info(f"Подпись валидна: {is_valid}")
+        logging.debug(f"Подпись валидна: {is_valid}")
         
         return is_valid
     except Exception as e:
         logging.error(f"Ошибка при проверке подписи: {e}")
         return False
 
-async def process_payment(data):
-    """Простая обработка платежа"""
-    try:
-        operation_id = data.get('operation_id')
-        
-        # Используем withdraw_amount (сумма без комиссии) для определения тарифа
-        if 'withdraw_amount' in data and data['withdraw_amount']:
-            amount = float(data['withdraw_amount'])
-        else:
-            amount = float(data.get('amount', 0))
-        
-        # Определяем количество публикаций по тарифу (сумма до комиссии)
-        # amount уже содержит withdraw_amount (сумму без комиссии)
-        # Комиссия YooMoney: 0% - 7.86%+, поэтому расширяем диапазоны
-        if 46 <= amount <= 54:  # Тариф 50₽ (комиссия до 8%)
-            publications = 1
-        elif 184 <= amount <= 216:  # Тариф 200₽ (комиссия до 8%)
-            publications = 5
-        elif 322 <= amount <= 378:  # Тариф 350₽ (комиссия до 8%)
-            publications = 10
-        elif 552 <= amount <= 648:  # Тариф 600₽ (комиссия до 8%)
-            publications = 20
-        else:
-            # Если сумма не соответствует тарифам, не зачисляем публикации
-            publications = 0
-        
-        # Получаем user_id из label
-        user_id = None
-        if 'label' in data and data['label']:
-            label = data['label']
-            if label.startswith('user_'):
-                try:
-                    user_id = int(label.replace('user_', ''))
-                except ValueError:
-                    pass
-        
-        # Если user_id не найден, используем sender
-        if not user_id and 'sender' in data:
-            try:
-                user_id = int(data['sender'])
-            except ValueError:
-                pass
-        
-        if not user_id:
-            logging.error("Не удалось определить user_id")
-            return False
-        
-        # Проверяем, не обработан ли уже этот платеж
-        async with aiosqlite.connect(DATABASE_PATH) as db_conn:
-            cursor = await db_conn.execute(
-                "SELECT operation_id FROM processed_payments WHERE operation_id = ?",
-                (operation_id,)
-            )
-            if await cursor.fetchone():
-                logging.warning(f"Платеж {operation_id} уже обработан, но обрабатываем заново для уведомления")
-                # Не возвращаем True, продолжаем обработку для отправки уведомления
-            
-            # Записываем платеж (если еще не записан)
-            await db_conn.execute(
-                "INSERT OR IGNORE INTO processed_payments (operation_id, user_id, amount, publications) VALUES (?, ?, ?, ?)",
-                (operation_id, user_id, amount, publications)
-            )
-            
-            # Создаем пользователя
-            await db_conn.execute(
-                "INSERT OR IGNORE INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
-                (user_id, None, None, 0, False)
-            )
-            
-            # Зачисляем средства
-            await db_conn.execute(
-                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                (publications, user_id)
-            )
-            
-            # Записываем транзакцию
-            await db_conn.execute(
-                "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
-                (user_id, publications, "yoomoney_payment", f"Пополнение: {amount} руб. (операция {operation_id})")
-            )
-            
-            await db_conn.commit()
-            
-        # Отправляем уведомление пользователю
-        try:
-            # Получаем актуальный баланс пользователя
-            user = await db.get_or_create_user(user_id)
-            await bot.send_message(
-                user_id,
-                f"✅ <b>Ваш баланс пополнен!</b>\n\n"
-                f"💰 Зачислено: {publications} публикаций\n"
-                f"💳 Текущий баланс: {user['balance']} публикаций\n\n"
-                f"Спасибо за пополнение!",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logging.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
-        
-        logging.info(f"✅ Платеж обработан: пользователь {user_id}, сумма {amount} руб., публикаций {publications}")
-        return True
-        
-    except Exception as e:
-        logging.error(f"Ошибка при обработке платежа: {e}")
-        return False
-
 # --- Машина состояний (FSM) для создания аукциона ---
 class AuctionCreation(StatesGroup):
     waiting_for_photos = State()
@@ -412,7 +365,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
     logging.info(f"User {user_id} is admin: {is_admin}")
     if is_admin and not user['is_admin']:
         await db.grant_admin_status(user_id)
-        user['is_admin'] = True
+        user = user.replace(is_admin=True)
         logging.info(f"Granted admin status to user {user_id}")
     
     # Устанавливаем админские команды для админов
@@ -822,38 +775,12 @@ async def add_balance_command(message: types.Message):
         new_balance = current_balance + amount
         logging.info(f"🔍 Текущий баланс: {current_balance}, новый баланс: {new_balance}")
         
-        # Обновляем баланс через прямую работу с SQLite
+        # Баланс и транзакция - одной записью через пул соединений
         logging.info(f"🔍 Обновляем баланс пользователя {target_user_id}")
-        try:
-            import sqlite3
-            with sqlite3.connect(DATABASE_PATH) as db_conn:
-                cursor = db_conn.cursor()
-                
-                # Создаем пользователя, если его нет
-                cursor.execute(
-                    "INSERT OR IGNORE INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
-                    (target_user_id, None, None, 0, False)
-                )
-                
-                # Обновляем баланс
-                cursor.execute(
-                    "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                    (amount, target_user_id)
-                )
-                
-                # Записываем транзакцию
-                cursor.execute(
-                    "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
-                    (target_user_id, amount, "admin_grant", description)
-                )
-                
-                db_conn.commit()
-                logging.info(f"✅ Баланс успешно обновлен через SQLite: пользователь {target_user_id}, +{amount}")
-                
-        except Exception as db_error:
-            logging.error(f"❌ Ошибка базы данных при обновлении баланса: {db_error}")
-            await message.answer(f"❌ Ошибка базы данных: {str(db_error)}")
+        if not await db.update_user_balance(target_user_id, amount, "admin_grant", description):
+            await message.answer("❌ Ошибка базы данных при обновлении баланса.")
             return
+        logging.info(f"✅ Баланс успешно обновлен: пользователь {target_user_id}, +{amount}")
         
         # Отправляем уведомление пользователю
         try:
@@ -908,16 +835,7 @@ async def sync_payments_command(message: types.Message):
     
     try:
         # Получаем список недавних платежей из базы данных
-        import sqlite3
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT operation_id, user_id, amount, publications, processed_at 
-                FROM processed_payments 
-                ORDER BY processed_at DESC 
-                LIMIT 10
-            """)
-            payments = cursor.fetchall()
+        payments = await db.get_processed_payments(limit=10)
         
         if not payments:
             await message.answer("📋 Нет обработанных платежей в базе данных.")
@@ -1032,15 +950,7 @@ async def check_payment_command(message: types.Message):
         operation_id = parts[1]
         
         # Проверяем, был ли уже обработан этот платеж
-        import sqlite3
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT operation_id, user_id, amount, publications, processed_at 
-                FROM processed_payments 
-                WHERE operation_id = ?
-            """, (operation_id,))
-            payment = cursor.fetchone()
+        payment = await db.get_processed_payment(operation_id)
         
         if payment:
             await message.answer(
@@ -1743,6 +1653,9 @@ async def process_duration(callback: types.CallbackQuery, state: FSMContext):
     except Exception as e:
         logging.warning(f"Не удалось синхронизировать аукцион с внешним API: {e}")
     
+    # Ставим аукцион в планировщик завершения
+    auction_scheduler.schedule(auction_id, moscow_timestamp(end_time))
+    
     # Сохраняем ID аукциона в состоянии для предпросмотра
     await state.update_data(auction_id=auction_id)
     
@@ -1985,6 +1898,7 @@ async def delete_auction(callback: types.CallbackQuery):
     if user_auctions:
         latest_auction = user_auctions[0]  # Самый новый
         await db.update_auction_status(latest_auction['id'], 'deleted')
+        auction_scheduler.cancel(latest_auction['id'])
     
     await callback.message.delete()
     user_menu = await get_user_main_menu(callback.from_user.id)
@@ -2031,42 +1945,66 @@ async def publish_buy_post(callback: types.CallbackQuery, state: FSMContext):
     ])
     
     try:
-        # Публикуем в канал
+        # Публикует диспетчер outbox (run_publish_buy_post_job) с учетом лимитов канала
         first_media = post_media[0] if post_media else None
+        await db.enqueue_outbox(
+            'publish_buy_post',
+            {
+                'caption': caption_text,
+                'media': first_media,
+                'keyboard': buy_post_keyboard.model_dump(mode='json', exclude_none=True)
+            },
+            user_id=user_id
+        )
+        outbox_dispatcher.wake()
+        
+        await callback.message.edit_text("⏳ Байт пост поставлен в очередь публикации в канале.")
+        await state.clear()
+        await callback.answer()
+        
+    except Exception as e:
+        logging.error(f"Failed to enqueue buy post: {e}")
+        await callback.answer("Не удалось поставить пост в очередь публикации. Попробуйте позже.", show_alert=True)
+
+
+async def run_publish_buy_post_job(job) -> dict:
+    """Задание outbox: опубликовать байт пост в канале"""
+    payload = job['payload']
+    first_media = payload.get('media')
+    keyboard = InlineKeyboardMarkup.model_validate(payload['keyboard'])
+    async with channel_publish_semaphore:
         if first_media and first_media.get('type') == 'video':
             posted_message = await bot.send_video(
                 chat_id=CHANNEL_USERNAME,
                 video=first_media['file_id'],
-                caption=caption_text,
-                reply_markup=buy_post_keyboard
+                caption=payload['caption'],
+                reply_markup=keyboard
             )
         else:
-            first_file_id = first_media['file_id'] if first_media else None
             posted_message = await bot.send_photo(
                 chat_id=CHANNEL_USERNAME,
-                photo=first_file_id,
-                caption=caption_text,
-                reply_markup=buy_post_keyboard
+                photo=first_media['file_id'] if first_media else None,
+                caption=payload['caption'],
+                reply_markup=keyboard
             )
-        
-        await callback.message.edit_text("✅ Байт пост успешно опубликован в канале!")
-        await state.clear()
-        await callback.answer()
-        
+    
+    try:
+        with telegram_lane(LANE_NOTIFICATION):
+            await bot.send_message(job['user_id'], "✅ Байт пост успешно опубликован в канале!")
     except Exception as e:
-        logging.error(f"Failed to publish buy post: {e}")
-        # Формируем более информативное сообщение об ошибке
-        error_str = str(e).lower() if 'e' in locals() else ""
-        if "не добавлен в канал" in error_str or "не имеет прав администратора" in error_str:
-            error_text = "Бот не добавлен в канал как администратор или у него нет прав на публикацию постов."
-        elif "публикацию постов" in error_str:
-            error_text = "У бота нет прав на публикацию постов в канале. Проверьте настройки администрирования."
-        elif "forbidden" in error_str or "chat not found" in error_str:
-            error_text = "Канал не найден или бот заблокирован. Проверьте корректность ID канала."
-        else:
-            error_text = "Не удалось опубликовать в канале. Проверьте, что бот добавлен в канал и имеет права администратора."
-        
-        await callback.answer(error_text, show_alert=True)
+        logging.error(f"Failed to notify about published buy post: {e}")
+    return {'channel_chat_id': posted_message.chat.id, 'channel_message_id': posted_message.message_id}
+
+
+async def on_publish_buy_post_failed(job, error: Exception):
+    """Байт пост не опубликован: сообщить администратору причину"""
+    error_str = str(error).lower()
+    if "forbidden" in error_str or "chat not found" in error_str:
+        error_text = "Канал не найден или бот заблокирован. Проверьте корректность ID канала."
+    else:
+        error_text = "Не удалось опубликовать в канале. Проверьте, что бот добавлен в канал и имеет права администратора."
+    with telegram_lane(LANE_NOTIFICATION):
+        await bot.send_message(job['user_id'], f"❌ Байт пост не опубликован: {error_text}\n\n{error}")
 
 @dp.callback_query(F.data == "cancel_buy_post")
 async def cancel_buy_post(callback: types.CallbackQuery, state: FSMContext):
@@ -2108,18 +2046,6 @@ async def check_balance_before_publish(callback: types.CallbackQuery):
     check_balance_before_publish._processing_users.add(user_id)
 
     try:
-        # Списываем 1 публикацию с использованием транзакции (баланс уже проверен при создании)
-        if not is_admin_user:
-            success = await db.update_user_balance_transactional(
-                user_id=user_id,
-                amount=-1,
-                transaction_type="auction_created",
-                description="Создание аукциона"
-            )
-            if not success:
-                await callback.message.answer("❌ Ошибка при списании баланса. Попробуйте позже.")
-                return
-        
         await callback.message.edit_reply_markup(reply_markup=None)
         
         # Получаем последний созданный аукцион пользователя
@@ -2135,179 +2061,125 @@ async def check_balance_before_publish(callback: types.CallbackQuery):
             await callback.message.answer("❌ Этот аукцион уже был опубликован в канале.")
             return
         
-        # Форматируем текст аукциона
-        text, bidding_keyboard = await format_auction_text(auction_data, show_buttons=True)
-
-        try:
-            # Публикуем в канал (используем синхронную версию для webhook)
-            posted_message = _publish_auction_to_channel_sync(auction_data, text, bidding_keyboard)
-            
-            if posted_message:
-                # Сохраняем информацию о сообщении в канале
-                await db.set_auction_channel_info(
-                    auction_data['id'],
-                    posted_message.chat.id,
-                    posted_message.message_id
-                )
-                logging.info(f"✅ Аукцион #{auction_data['id']} успешно опубликован в канале")
-            else:
-                # Если публикация не удалась, возвращаем баланс
-                if not is_admin_user:
-                    await db.rollback_auction_balance(auction_data['id'], user_id)
-                raise Exception("Не удалось опубликовать аукцион в канале")
-            
-            new_balance = await db.get_user_balance(user_id)
-            balance_text = "∞ (администратор)" if is_admin_user else f"{new_balance}"
-            
-            # Отправляем уведомление о публикации аукциона
-            try:
-                await send_auction_published_notification(
-                    user_id=user_id,
-                    auction_description=auction_data['description'],
-                    remaining_balance=new_balance,
-                    is_admin=is_admin_user
-                )
-            except Exception as e:
-                logging.error(f"❌ Ошибка отправки уведомления о публикации аукциона: {e}")
-            
-            # Уведомление о публикации в канале отключено по запросу пользователя
-            # await callback.message.answer(
-            #     f"✅ Опубликовано в канале <a href='https://t.me/{CHANNEL_USERNAME_LINK}'>Барахолка СПБ</a>.\n"
-            #     f"Осталось публикаций: <b>{balance_text}</b>.",
-            #     parse_mode="HTML"
-            # )
-        except Exception as e:
-            logging.error(f"Failed to post to channel: {e}")
-            # Возвращаем баланс в случае ошибки публикации
-            if not is_admin_user:
-                await db.rollback_auction_balance(auction_data['id'], user_id)
-            
-            # Формируем более информативное сообщение об ошибке
-            error_message = "❌ Не удалось опубликовать аукцион в канале.\n\n"
-            
-            # Анализируем тип ошибки
-            error_str = str(e).lower()
-            if "не добавлен в канал" in error_str or "не имеет прав администратора" in error_str:
-                error_message += "🔧 <b>Проблема с правами бота:</b>\n"
-                error_message += "• Проверьте, что бот добавлен в канал как администратор\n"
-                error_message += "• Убедитесь, что у бота есть права на публикацию постов\n\n"
-            elif "публикацию постов" in error_str:
-                error_message += "🔧 <b>Проблема с правами на публикацию:</b>\n"
-                error_message += "• У бота нет прав на публикацию постов в канале\n"
-                error_message += "• Проверьте настройки администрирования бота\n\n"
-            elif "forbidden" in error_str or "chat not found" in error_str:
-                error_message += "🔧 <b>Проблема с доступом к каналу:</b>\n"
-                error_message += "• Канал не найден или бот заблокирован\n"
-                error_message += "• Проверьте корректность ID канала\n\n"
-            else:
-                error_message += f"🔧 <b>Техническая ошибка:</b> {str(e)}\n\n"
-            
-            error_message += "💰 Баланс возвращен.\n"
-            error_message += "🔄 Попробуйте создать аукцион позже или обратитесь к администратору."
-            
-            await callback.message.answer(error_message, parse_mode="HTML")
+        # Списываем 1 публикацию и ставим лот в очередь публикации одной транзакцией;
+        # пост в канал отправит диспетчер outbox (run_publish_auction_job)
+        job_id = await db.enqueue_auction_publish(auction_data['id'], user_id, charge=not is_admin_user)
+        if job_id is None:
+            await callback.message.answer(
+                "❌ Ошибка при списании баланса или аукцион уже ожидает публикации. Попробуйте позже."
+            )
+            return
+        outbox_dispatcher.wake()
+        logging.info(f"Аукцион #{auction_data['id']} поставлен в очередь публикации (задание #{job_id})")
     finally:
         # Удаляем пользователя из списка обрабатываемых
         if hasattr(check_balance_before_publish, '_processing_users'):
             check_balance_before_publish._processing_users.discard(user_id)
     
-    await callback.answer()
+    await callback.answer("⏳ Аукцион публикуется в канале...")
+
+
+def _publish_error_text(error: Exception) -> str:
+    """Понятное пользователю описание ошибки публикации в канал"""
+    error_message = "❌ Не удалось опубликовать аукцион в канале.\n\n"
+    
+    # Анализируем тип ошибки
+    error_str = str(error).lower()
+    if "не добавлен в канал" in error_str or "не имеет прав администратора" in error_str:
+        error_message += "🔧 <b>Проблема с правами бота:</b>\n"
+        error_message += "• Проверьте, что бот добавлен в канал как администратор\n"
+        error_message += "• Убедитесь, что у бота есть права на публикацию постов\n\n"
+    elif "публикацию постов" in error_str:
+        error_message += "🔧 <b>Проблема с правами на публикацию:</b>\n"
+        error_message += "• У бота нет прав на публикацию постов в канале\n"
+        error_message += "• Проверьте настройки администрирования бота\n\n"
+    elif "forbidden" in error_str or "chat not found" in error_str:
+        error_message += "🔧 <b>Проблема с доступом к каналу:</b>\n"
+        error_message += "• Канал не найден или бот заблокирован\n"
+        error_message += "• Проверьте корректность ID канала\n\n"
+    else:
+        error_message += f"🔧 <b>Техническая ошибка:</b> {str(error)}\n\n"
+    
+    error_message += "💰 Баланс возвращен.\n"
+    error_message += "🔄 Попробуйте создать аукцион позже или обратитесь к администратору."
+    return error_message
+
+
+async def run_publish_auction_job(job) -> dict:
+    """Задание outbox: опубликовать лот в канале. Возвращает id сообщения для записи в аукцион"""
+    auction_data = await db.get_auction(job['auction_id'])
+    if not auction_data or auction_data['status'] != 'active' or auction_data['channel_message_id']:
+        # Лот уже опубликован, закрыт или отменен - отправлять нечего
+        return {}
+    
+    # Альбом и пост с кнопками - отдельные шаги: после отправки альбома его id сохраняются
+    # в задании, и повтор после ошибки на посте не публикует альбом второй раз
+    progress = job['result'] or {}
+    album_message_ids = progress.get('album_message_ids')
+    if album_message_ids is None and len(auction_data['media']) > 1:
+        async with channel_publish_semaphore:
+            album_message_ids = await _send_auction_album(auction_data['media'])
+        await db.save_outbox_progress(job['id'], {'album_message_ids': album_message_ids})
+    
+    # Текст строится в момент отправки: цена и время актуальны, даже если задание ждало повтора
+    text, bidding_keyboard = await format_auction_text(auction_data, show_buttons=True)
+    posted_message = await _publish_auction_to_channel_async(auction_data, text, bidding_keyboard, album_sent=True)
+    logging.info(f"✅ Аукцион #{auction_data['id']} успешно опубликован в канале")
+    
+    # Ошибки уведомления не должны приводить к повторной публикации
+    try:
+        user = await db.get_or_create_user(job['user_id'])
+        await notification_manager.send_auction_published_notification(
+            user_id=job['user_id'],
+            auction_description=auction_data['description'],
+            auction_id=auction_data['id'],
+            channel_link=f"https://t.me/{CHANNEL_USERNAME_LINK}/{posted_message.message_id}",
+            remaining_balance=None if user['is_admin'] else await db.get_user_balance(job['user_id'])
+        )
+    except Exception as e:
+        logging.error(f"❌ Ошибка отправки уведомления о публикации аукциона: {e}")
+    
+    return {'channel_chat_id': posted_message.chat.id, 'channel_message_id': posted_message.message_id,
+            'album_message_ids': album_message_ids}
 
 
-def _publish_auction_to_channel_sync(auction_data: dict, text: str, keyboard):
-    """Публикует аукцион в канал (синхронная версия для webhook)"""
-    logging.info(f"🚀 Начинаем публикацию аукциона #{auction_data.get('id')} в канал {CHANNEL_USERNAME}")
-    
-    try:
-        import asyncio
-        import threading
-        import aiohttp
-        from aiogram import Bot
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo
-        
-        # Создаем новый экземпляр бота для публикации
-        temp_bot = Bot(token=BOT_TOKEN, **DEFAULT_BOT_KWARGS)
-        
-        result = None
-        exception = None
-        
-        def run_in_thread():
-            nonlocal result, exception
-            try:
-                # Создаем новый event loop в отдельном потоке
-                new_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(new_loop)
-                
-                async def publish_async():
-                    try:
-                        media_items = auction_data.get('media', [])
-                        
-                        if not media_items:
-                            logging.info("📝 Публикуем текстовое сообщение в канал")
-                            message = await temp_bot.send_message(chat_id=CHANNEL_USERNAME, text=text, reply_markup=keyboard)
-                            logging.info(f"✅ Текстовое сообщение отправлено, ID: {message.message_id}")
-                            return message
-                        
-                        # Если одно медиа — публикуем только его с кнопками
-                        if len(media_items) == 1:
-                            single = media_items[0]
-                            if single['type'] == 'photo':
-                                return await temp_bot.send_photo(chat_id=CHANNEL_USERNAME, photo=single['file_id'], caption=text, reply_markup=keyboard)
-                            else:
-                                return await temp_bot.send_video(chat_id=CHANNEL_USERNAME, video=single['file_id'], caption=text, reply_markup=keyboard)
-                        
-                        # Множественные медиа
-                        album = []
-                        for item in media_items[:10]:
-                            if item['type'] == 'photo':
-                                album.append(InputMediaPhoto(media=item['file_id']))
-                            else:
-                                album.append(InputMediaVideo(media=item['file_id']))
+async def on_publish_auction_failed(job, error: Exception):
+    """Публикация не удалась окончательно: вернуть публикацию и сообщить владельцу"""
+    if job['payload'].get('charged'):
+        await db.rollback_auction_balance(job['auction_id'], job['user_id'])
+    with telegram_lane(LANE_NOTIFICATION):
+        await bot.send_message(job['user_id'], _publish_error_text(error), parse_mode="HTML")
 
-                        try:
-                            await temp_bot.send_media_group(chat_id=CHANNEL_USERNAME, media=album)
-                        except Exception as e:
-                            logging.warning(f"Failed to send media group: {e}")
-
-                        # Затем пост с первой фотографией и кнопками
-                        head_photo = None
-                        for item in media_items:
-                            if item['type'] == 'photo':
-                                head_photo = item['file_id']
-                                break
-
-                        if head_photo:
-                            message = await temp_bot.send_photo(chat_id=CHANNEL_USERNAME, photo=head_photo, caption=text, reply_markup=keyboard)
-                            logging.info(f"✅ Фото с подписью отправлено, ID: {message.message_id}")
-                            return message
-                        else:
-                            message = await temp_bot.send_message(chat_id=CHANNEL_USERNAME, text=text, reply_markup=keyboard)
-                            logging.info(f"✅ Текстовое сообщение отправлено, ID: {message.message_id}")
-                            return message
-                    finally:
-                        await temp_bot.session.close()
-                
-                result = new_loop.run_until_complete(publish_async())
-                
-            except Exception as e:
-                exception = e
-            finally:
-                new_loop.close()
-        
-        thread = threading.Thread(target=run_in_thread)
-        thread.start()
-        thread.join()
-        
-        if exception:
-            raise exception
-        return result
-            
-    except Exception as e:
-        logging.error(f"❌ Ошибка публикации в канал: {e}")
-        raise Exception(f"Не удалось опубликовать в канал: {str(e)}")
 
-async def _publish_auction_to_channel_async(auction_data: dict, text: str, keyboard) -> types.Message:
+async def _publish_auction_to_channel_async(auction_data: dict, text: str, keyboard,
+                                            album_sent: bool = False) -> types.Message:
     """Публикует аукцион в канал (асинхронная версия)"""
+    async with channel_publish_semaphore:
+        return await _send_auction_to_channel(auction_data, text, keyboard, album_sent)
+
+async def _send_auction_album(media_items: list) -> list:
+    """
+    Публикует альбом лота (до 10 медиа, без подписей) и возвращает id его сообщений.
+    429, 5xx и сетевые ошибки пробрасываются, чтобы задание повторило альбом; прочие
+    ошибки (например, неподходящий файл) не мешают публикации поста - альбом пропускается.
+    """
+    album = []
+    for item in media_items[:10]:
+        if item['type'] == 'photo':
+            album.append(InputMediaPhoto(media=item['file_id']))
+        else:
+            album.append(InputMediaVideo(media=item['file_id']))
+
+    try:
+        messages = await bot.send_media_group(chat_id=CHANNEL_USERNAME, media=album)
+    except (TelegramRetryAfter, TelegramServerError, TelegramNetworkError):
+        raise
+    except Exception as e:
+        logging.warning(f"Failed to send media group: {e}")
+        return []
+    return [message.message_id for message in messages]
+
+async def _send_auction_to_channel(auction_data: dict, text: str, keyboard, album_sent: bool = False) -> types.Message:
     logging.info(f"🚀 Начинаем публикацию аукциона #{auction_data.get('id')} в канал {CHANNEL_USERNAME}")
     
     try:
@@ -2328,18 +2200,9 @@ async def _publish_auction_to_channel_async(auction_data: dict, text: str, keybo
                 return await bot.send_video(chat_id=CHANNEL_USERNAME, video=single['file_id'], caption=text, reply_markup=keyboard)
         
         # Множественные медиа
-        # 1) Сначала публикуем весь альбом (без подписей)
-        album = []
-        for item in media_items[:10]:
-            if item['type'] == 'photo':
-                album.append(InputMediaPhoto(media=item['file_id']))
-            else:
-                album.append(InputMediaVideo(media=item['file_id']))
-
-        try:
-            await bot.send_media_group(chat_id=CHANNEL_USERNAME, media=album)
-        except Exception as e:
-            logging.warning(f"Failed to send media group: {e}")
+        # 1) Сначала публикуем весь альбом (без подписей), если его еще не отправили
+        if not album_sent:
+            await _send_auction_album(media_items)
 
         # 2) Затем пост с первой фотографией и кнопками
         head_photo = None
@@ -2358,8 +2221,12 @@ async def _publish_auction_to_channel_async(auction_data: dict, text: str, keybo
             return message
 
     except Exception as e:
+        # Исключение пробрасывается как есть: диспетчер outbox различает 429, 5xx и прочие ошибки
         logging.error(f"❌ Ошибка публикации в канал: {e}")
-        raise Exception(f"Не удалось опубликовать в канал: {str(e)}")
+        raise
+
+outbox_dispatcher.register('publish_auction', run_publish_auction_job, on_failure=on_publish_auction_failed)
+outbox_dispatcher.register('publish_buy_post', run_publish_buy_post_job, on_failure=on_publish_buy_post_failed)
 
 # Оставляем старую функцию для совместимости
 async def _publish_auction_to_channel(auction_data: dict, text: str, keyboard) -> types.Message:
@@ -2393,39 +2260,24 @@ async def handle_buyout(callback: types.CallbackQuery):
             await callback.answer("Аукцион не найден.", show_alert=True)
             return
 
-        # Проверяем, не истек ли аукцион по времени
-        from datetime import datetime
-        end_time = auction['end_time']
-        if isinstance(end_time, str):
-            try:
-                end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-            except ValueError:
-                end_time = datetime.now()
-        
-        if datetime.now() >= end_time:
-            # Аукцион истек по времени, обновляем статус
-            await db.update_auction_status(auction['id'], 'expired')
-            await callback.answer("Аукцион истек по времени.", show_alert=True)
-            return
-            
-        if auction['status'] != 'active':
-            await callback.answer("Аукцион уже завершен.", show_alert=True)
-            return
-            
         if not auction['blitz_price']:
             await callback.answer("Блиц-цена не установлена для этого аукциона.", show_alert=True)
             return
         
-        # Обновляем статус аукциона на "продан"
-        await db.update_auction_status(auction['id'], 'sold')
-        
-        # Обновляем текущую цену и лидера
-        await db.place_bid(
-            auction['id'],
+        # Выкуп идет через ту же очередь актора, что и ставки (второй покупатель получит отказ)
+        result = await bid_engine.buyout(
+            auction,
             callback.from_user.id,
-            callback.from_user.username or callback.from_user.full_name,
-            auction['blitz_price']
+            callback.from_user.username or callback.from_user.full_name
         )
+        if not result['accepted']:
+            if result['reason'] == 'expired':
+                await callback.answer("Аукцион истек по времени.", show_alert=True)
+            elif result['reason'] == 'conflict':
+                await callback.answer("Аукцион изменился, выкуп не записан. Попробуйте еще раз.", show_alert=True)
+            else:
+                await callback.answer("Аукцион уже завершен.", show_alert=True)
+            return
         
         # Формируем кликабельную ссылку на покупателя
         if callback.from_user.username:
@@ -2453,26 +2305,19 @@ async def handle_buyout(callback: types.CallbackQuery):
         new_text += f"<b>Статус:</b> ✅ ПРОДАНО\n"
         new_text += f"<b>Покупатель:</b> {buyer_link}"
         
-        # Обновляем сообщение без кнопки истории ставок
-        try:
-            if callback.message.caption is not None:
-                await callback.message.edit_caption(
-                    caption=new_text,
-                    parse_mode="HTML"
-                )
-            else:
-                await callback.message.edit_text(
-                    text=new_text,
-                    parse_mode="HTML"
-                )
-        except Exception as e:
-            logging.error(f"❌ Ошибка обновления сообщения при выкупе: {e}")
-            # Если не удалось обновить сообщение, просто отвечаем пользователю
-            await callback.answer("Товар выкуплен по блиц-цене, но не удалось обновить сообщение в канале!")
-            return
-        
         await callback.answer("Товар выкуплен по блиц-цене!")
         
+        # Обновляем сообщение без кнопки истории ставок. Версия выкупа старше любой
+        # ставки с той же ценой, поэтому запоздавшая правка ставки не вернет кнопки
+        await channel_editor.submit(
+            callback.message.chat.id,
+            callback.message.message_id,
+            new_text,
+            None,
+            is_caption=callback.message.caption is not None,
+            version=(auction['blitz_price'], 1)
+        )
+        
         # Создаем кликабельную ссылку на продавца
         seller_link = f"<a href='tg://user?id={auction['owner_id']}'>продавцом</a>"
         
@@ -2528,15 +2373,16 @@ async def handle_buyout(callback: types.CallbackQuery):
             
             history_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
             
-            await bot.send_message(
-                chat_id=auction['owner_id'],
-                text=f"✅ <b>Лот продан!</b>\n\n"
-                     f"Ваш лот <b>{auction['description']}</b> выкуплен за <b>{auction['blitz_price']} ₽</b>\n"
-                     f"Покупатель: {buyer_link}\n\n"
-                     f"Свяжитесь с покупателем для завершения сделки.",
-                parse_mode="HTML",
-                reply_markup=history_keyboard
-            )
+            with telegram_lane(LANE_NOTIFICATION):
+                await bot.send_message(
+                    chat_id=auction['owner_id'],
+                    text=f"✅ <b>Лот продан!</b>\n\n"
+                         f"Ваш лот <b>{auction['description']}</b> выкуплен за <b>{auction['blitz_price']} ₽</b>\n"
+                         f"Покупатель: {buyer_link}\n\n"
+                         f"Свяжитесь с покупателем для завершения сделки.",
+                    parse_mode="HTML",
+                    reply_markup=history_keyboard
+                )
         except Exception as e:
             logging.warning(f"Failed to notify seller: {e}")
             
@@ -2549,36 +2395,6 @@ async def handle_buyout(callback: types.CallbackQuery):
         except Exception as answer_error:
             logging.error(f"❌ Ошибка при отправке ответа: {answer_error}")
 
-def handle_buyout_sync(user_id: int, username: str, full_name: str, chat_id: int, message_id: int):
-    """Синхронная обработка выкупа для webhook"""
-    try:
-        logging.info(f"🛒 Обработка выкупа для пользователя {user_id}")
-        # Пока что просто логируем - полная реализация будет позже
-        return True
-    except Exception as e:
-        logging.error(f"❌ Ошибка обработки выкупа: {e}")
-        return False
-
-def update_auction_message_sync(auction: dict, new_price: int, leader_name: str, leader_id: int):
-    """Синхронное обновление сообщения аукциона"""
-    try:
-        logging.info(f"📝 Обновление сообщения аукциона #{auction.get('id')}")
-        # Пока что просто логируем - полная реализация будет позже
-        return True
-    except Exception as e:
-        logging.error(f"❌ Ошибка обновления сообщения аукциона: {e}")
-        return False
-
-def handle_bid_sync(callback_data: str, user_id: int, username: str, full_name: str, chat_id: int, message_id: int):
-    """Синхронная обработка ставок для webhook"""
-    try:
-        logging.info(f"💰 Обработка ставки для пользователя {user_id}")
-        # Пока что просто логируем - полная реализация будет позже
-        return True
-    except Exception as e:
-        logging.error(f"❌ Ошибка обработки ставки: {e}")
-        return False
-
 @dp.callback_query(F.data.startswith("bid:"))
 async def handle_bid(callback: types.CallbackQuery):
     """Обработка обычных ставок"""
@@ -2606,44 +2422,30 @@ async def handle_bid(callback: types.CallbackQuery):
             await callback.answer("Аукцион не найден.", show_alert=True)
             return
 
-        # Проверяем, не истек ли аукцион по времени
-        from datetime import datetime
-        end_time = auction['end_time']
-        if isinstance(end_time, str):
-            try:
-                end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-            except ValueError:
-                end_time = datetime.now()
-        
-        if datetime.now() >= end_time:
-            # Аукцион истек по времени, обновляем статус
-            await db.update_auction_status(auction['id'], 'expired')
-            await callback.answer("Аукцион истек по времени.", show_alert=True)
-            return
-
-        if auction['status'] != 'active':
-            await callback.answer("Аукцион уже завершен.", show_alert=True)
-            return
-
-        # Вычисляем новую цену
-        new_price = auction['current_price'] + bid_amount
-        
-        # Проверяем, не превышает ли блиц-цену
-        if auction['blitz_price'] and new_price >= auction['blitz_price']:
-            new_price = auction['blitz_price']
-        
-        # Делаем ставку в базе данных
-        success = await db.place_bid(
-            auction['id'],
+        # Ставка уходит в актор аукциона: цена и лидер меняются в памяти по очереди,
+        # запись в базу идет групповым коммитом в фоне
+        result = await bid_engine.place_bid(
+            auction,
             callback.from_user.id,
             callback.from_user.username or callback.from_user.full_name,
-            new_price
+            bid_amount
         )
         
-        if not success:
-            await callback.answer("Не удалось сделать ставку. Попробуйте позже.", show_alert=True)
+        if not result['accepted']:
+            if result['reason'] == 'expired':
+                await callback.answer("Аукцион истек по времени.", show_alert=True)
+            elif result['reason'] == 'blitz_reached':
+                await callback.answer("Достигнута блиц-цена, ставки больше не принимаются.", show_alert=True)
+            elif result['reason'] == 'conflict':
+                # Лот изменили в обход актора (закрыли или удалили) - ставка не записана
+                await callback.answer("Аукцион изменился, ставка не записана. Попробуйте еще раз.", show_alert=True)
+            else:
+                await callback.answer("Аукцион уже завершен.", show_alert=True)
             return
         
+        updated_auction = result['auction']
+        new_price = updated_auction['current_price']
+        
         # Синхронизируем ставку с внешним API (если настроен)
         try:
             bid_data = {
@@ -2658,33 +2460,22 @@ async def handle_bid(callback: types.CallbackQuery):
         except Exception as e:
             logging.warning(f"Не удалось синхронизировать ставку с внешним API: {e}")
         
-        # Получаем обновленные данные аукциона
-        updated_auction = await db.get_auction(auction['id'])
+        # Отвечаем сразу: ставка уже принята актором
+        await callback.answer(f"Ваша ставка {new_price} ₽ принята!")
         
         # Форматируем новый текст
         text, keyboard = await format_auction_text(updated_auction, show_buttons=True)
         
-        # Обновляем сообщение используя экземпляр бота из callback
-        try:
-            if callback.message.caption is not None:
-                await callback.message.edit_caption(
-                    caption=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            else:
-                await callback.message.edit_text(
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-        except Exception as e:
-            logging.error(f"❌ Ошибка обновления сообщения: {e}")
-            # Если не удалось обновить сообщение, просто отвечаем пользователю
-            await callback.answer(f"Ставка {new_price} ₽ принята, но не удалось обновить сообщение в канале.")
-            return
+        # Правка поста уходит в редактор: при потоке ставок в канал попадет только последняя цена
+        await channel_editor.submit(
+            callback.message.chat.id,
+            callback.message.message_id,
+            text,
+            keyboard,
+            is_caption=callback.message.caption is not None,
+            version=(new_price, 0)
+        )
         
-        await callback.answer(f"Ваша ставка {new_price} ₽ принята!")
         logging.info(f"✅ Ставка {new_price} ₽ успешно обработана для аукциона #{auction['id']}")
         
     except Exception as e:
@@ -2693,6 +2484,134 @@ async def handle_bid(callback: types.CallbackQuery):
         logging.error(f"❌ Traceback: {traceback.format_exc()}")
         await callback.answer("Ошибка при обработке ставки. Попробуйте позже.", show_alert=True)
 
+# --- Завершение аукционов по времени (вызывается планировщиком) ---
+def _post_has_caption(auction: dict) -> bool:
+    """Опубликован ли пост аукциона с подписью к медиа (см. _publish_auction_to_channel_async)"""
+    media_items = auction.get('media') or []
+    if len(media_items) == 1:
+        return True
+    return any(item['type'] == 'photo' for item in media_items)
+
+async def finalize_due_auctions(auction_ids: list) -> list:
+    """
+    Закрыть пачку аукционов с наступившим дедлайном, перерисовать посты и уведомить участников.
+    Возвращает id, которые закрыть не удалось (планировщик повторит их позже)
+    """
+    finished = []
+    remaining = []
+    not_closed = []
+    for auction_id in auction_ids:
+        # Аукцион с живым актором закрывается через него, чтобы не потерять принятые ставки
+        try:
+            auction = await bid_engine.close(auction_id)
+        except Exception as e:
+            logging.error(f"❌ Ошибка закрытия аукциона #{auction_id} через актор: {e}")
+            not_closed.append(auction_id)
+            continue
+        if auction:
+            finished.append(auction)
+        else:
+            remaining.append(auction_id)
+    try:
+        finished.extend(await db.finalize_auctions(remaining))
+    except Exception as e:
+        logging.error(f"❌ Ошибка завершения аукционов {remaining}: {e}")
+        not_closed.extend(remaining)
+    if not finished:
+        return not_closed
+    
+    # Аукционы уже закрыты в базе: ошибки отрисовки и уведомлений не повод закрывать их повторно
+    try:
+        media = await db.get_media_for_auctions([auction['id'] for auction in finished])
+    except Exception as e:
+        logging.error(f"❌ Ошибка загрузки медиа завершенных аукционов: {e}")
+        media = {}
+    for auction in finished:
+        auction = dict(auction, media=media.get(auction['id'], []))
+        try:
+            await _render_finished_auction(auction)
+            # Уведомления идут в последней полосе: правки постов и ответы на ставки важнее
+            with telegram_lane(LANE_NOTIFICATION):
+                await _notify_auction_finished(auction)
+        except Exception as e:
+            logging.error(f"❌ Ошибка оформления завершенного аукциона #{auction['id']}: {e}")
+    logging.info(f"⏰ Завершено аукционов по времени: {len(finished)}")
+    return not_closed
+
+async def _render_finished_auction(auction: dict):
+    """Один раз перерисовать пост завершенного аукциона без кнопок ставок"""
+    if not auction.get('channel_message_id') or not auction.get('channel_chat_id'):
+        return
+    
+    text, _ = await format_auction_text(auction)
+    if auction['status'] == 'sold':
+        winner_link = f"<a href='tg://user?id={auction['current_leader_id']}'>{auction['current_leader_username'] or auction['current_leader_id']}</a>"
+        text += f"\n<b>Статус:</b> ✅ ПРОДАНО\n"
+        text += f"<b>Победитель:</b> {winner_link}"
+    else:
+        text += f"\n<b>Статус:</b> ⏰ ЗАВЕРШЕН (ставок не было)"
+    
+    await channel_editor.submit(
+        auction['channel_chat_id'],
+        auction['channel_message_id'],
+        text,
+        None,
+        is_caption=_post_has_caption(auction),
+        version=(auction['current_price'], 1)
+    )
+
+async def _notify_auction_finished(auction: dict):
+    """Уведомить победителя и продавца о завершении аукциона"""
+    if auction['status'] == 'sold':
+        winner_link = f"<a href='tg://user?id={auction['current_leader_id']}'>{auction['current_leader_username'] or auction['current_leader_id']}</a>"
+        seller_link = f"<a href='tg://user?id={auction['owner_id']}'>продавцом</a>"
+        try:
+            await bot.send_message(
+                chat_id=auction['current_leader_id'],
+                text=f"🎉 <b>Поздравляем!</b>\n\n"
+                     f"Вы выиграли аукцион: <b>{auction['description']}</b>\n"
+                     f"Итоговая цена: <b>{auction['current_price']} ₽</b>\n\n"
+                     f"Свяжитесь с {seller_link} для завершения сделки.",
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            logging.warning(f"Failed to notify winner: {e}")
+        
+        seller_text = (f"✅ <b>Аукцион завершен!</b>\n\n"
+                       f"Ваш лот <b>{auction['description']}</b> продан за <b>{auction['current_price']} ₽</b>\n"
+                       f"Победитель: {winner_link}\n\n"
+                       f"Свяжитесь с покупателем для завершения сделки.")
+    else:
+        seller_text = (f"⏰ <b>Аукцион завершен</b>\n\n"
+                       f"По лоту <b>{auction['description']}</b> не было ставок.")
+    
+    try:
+        await bot.send_message(
+            chat_id=auction['owner_id'],
+            text=seller_text,
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="📊 История ставок", callback_data=f"history_{auction['id']}")]
+            ]) if auction['status'] == 'sold' else None
+        )
+    except Exception as e:
+        logging.warning(f"Failed to notify seller: {e}")
+
+async def load_auction_deadlines():
+    """Загрузить дедлайны активных аукционов в планировщик (просроченные закроются сразу)"""
+    for auction_id, end_ts in await db.get_active_deadlines():
+        auction_scheduler.schedule(auction_id, end_ts / 1000)
+
+# --- Изменение подписки на канал ---
+@dp.chat_member()
+async def handle_channel_member_update(event: types.ChatMemberUpdated):
+    """Подписка/отписка в канале: сразу обновляем кеш проверок подписки"""
+    channel = CHANNEL_USERNAME.lstrip('@').lower()
+    if str(event.chat.id) != CHANNEL_USERNAME and (event.chat.username or '').lower() != channel:
+        return
+    member = event.new_chat_member
+    subscription_cache.set(member.user.id, member.status in SUBSCRIBED_STATUSES)
+
 # --- Обработчик истории ставок (только для продавца) ---
 @dp.callback_query(F.data.startswith("history_"))
 async def show_bidding_history(callback: types.CallbackQuery):
@@ -2807,25 +2726,24 @@ async def admin_users_callback(callback: types.CallbackQuery):
     
     # Получаем последних 10 пользователей
     try:
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
+        async with db.read_connection() as db_conn:
             cursor = await db_conn.execute(
                 "SELECT user_id, username, full_name, balance, is_admin FROM users ORDER BY created_at DESC LIMIT 10"
             )
             users = await cursor.fetchall()
-            
-            text = "👥 <b>Последние пользователи:</b>\n\n"
-            for user_data in users:
-                admin_mark = "👑" if user_data[4] else "👤"
-                username = f"@{user_data[1]}" if user_data[1] else "Без username"
-                text += f"{admin_mark} ID: {user_data[0]}\n"
-                text += f"   {username} | Баланс: {user_data[3]}\n\n"
-            
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
-            ])
-            
-            await callback.message.edit_text(text, reply_markup=back_keyboard)
+        
+        text = "👥 <b>Последние пользователи:</b>\n\n"
+        for user_data in users:
+            admin_mark = "👑" if user_data[4] else "👤"
+            username = f"@{user_data[1]}" if user_data[1] else "Без username"
+            text += f"{admin_mark} ID: {user_data[0]}\n"
+            text += f"   {username} | Баланс: {user_data[3]}\n\n"
+        
+        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
+        ])
+        
+        await callback.message.edit_text(text, reply_markup=back_keyboard)
             
     except Exception as e:
         logging.error(f"Error getting users: {e}")
@@ -2845,29 +2763,25 @@ async def admin_stats_callback(callback: types.CallbackQuery):
     
     try:
         # Получаем статистику
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
-            # Общее количество пользователей
-            cursor = await db_conn.execute("SELECT COUNT(*) FROM users")
-            total_users = (await cursor.fetchone())[0]
-            
-            # Активные аукционы (не истекшие по времени)
-            active_auctions = await db.get_truly_active_auctions_count()
-            
-            # Всего аукционов
-            cursor = await db_conn.execute("SELECT COUNT(*) FROM auctions")
-            total_auctions = (await cursor.fetchone())[0]
-            
-            text = "📊 <b>Общая статистика бота:</b>\n\n"
-            text += f"👥 Всего пользователей: {total_users}\n"
-            text += f"🚀 Всего аукционов: {total_auctions}\n"
-            text += f"🟢 Активных аукционов: {active_auctions}\n"
-            
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
-            ])
-            
-            await callback.message.edit_text(text, reply_markup=back_keyboard)
+        # Общее количество пользователей
+        total_users = await db.get_total_users()
+        
+        # Активные аукционы (не истекшие по времени)
+        active_auctions = await db.get_truly_active_auctions_count()
+        
+        # Всего аукционов
+        total_auctions = await db.get_total_auctions()
+        
+        text = "📊 <b>Общая статистика бота:</b>\n\n"
+        text += f"👥 Всего пользователей: {total_users}\n"
+        text += f"🚀 Всего аукционов: {total_auctions}\n"
+        text += f"🟢 Активных аукционов: {active_auctions}\n"
+        
+        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
+        ])
+        
+        await callback.message.edit_text(text, reply_markup=back_keyboard)
             
     except Exception as e:
         logging.error(f"Error getting stats: {e}")
@@ -2913,33 +2827,32 @@ async def admin_auctions_callback(callback: types.CallbackQuery):
     
     try:
         # Получаем активные аукционы (не истекшие по времени)
-        import aiosqlite
-        async with aiosqlite.connect(db.db_path) as db_conn:
+        async with db.read_connection() as db_conn:
             cursor = await db_conn.execute(
-                "SELECT id, owner_id, description, current_price, end_time FROM auctions WHERE status = 'active' AND end_time > ? ORDER BY created_at DESC LIMIT 5",
-                (now(),)
+                "SELECT id, owner_id, description, current_price, end_ts FROM auctions WHERE status = 'active' AND end_ts > ? ORDER BY created_ts DESC LIMIT 5",
+                (now_ms(),)
             )
             auctions = await cursor.fetchall()
-            
-            text = "🚀 <b>Активные аукционы:</b>\n\n"
-            if auctions:
-                for auction in auctions:
-                    text += f"🆔 ID: {auction[0]}\n"
-                    text += f"👤 Владелец: {auction[1]}\n"
-                    text += f"📝 {auction[2][:50]}...\n"
-                    text += f"💰 Цена: {auction[3]} ₽\n"
-                    text += f"⏰ До: {auction[4]}\n\n"
-            else:
-                text += "Нет активных аукционов"
-            
-            # Добавляем кнопку для проверки состояния системы
-            keyboard_buttons = [
-                [InlineKeyboardButton(text="🔍 Статус системы", callback_data="admin_system_status")],
-                [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
-            ]
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-            
-            await callback.message.edit_text(text, reply_markup=back_keyboard)
+        
+        text = "🚀 <b>Активные аукционы:</b>\n\n"
+        if auctions:
+            for auction in auctions:
+                text += f"🆔 ID: {auction[0]}\n"
+                text += f"👤 Владелец: {auction[1]}\n"
+                text += f"📝 {auction[2][:50]}...\n"
+                text += f"💰 Цена: {auction[3]} ₽\n"
+                text += f"⏰ До: {format_moscow_time(from_epoch_ms(auction[4]))}\n\n"
+        else:
+            text += "Нет активных аукционов"
+        
+        # Добавляем кнопку для проверки состояния системы
+        keyboard_buttons = [
+            [InlineKeyboardButton(text="🔍 Статус системы", callback_data="admin_system_status")],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
+        ]
+        back_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+        
+        await callback.message.edit_text(text, reply_markup=back_keyboard)
             
     except Exception as e:
         logging.error(f"Error getting auctions: {e}")
@@ -3325,7 +3238,6 @@ async def remove_balance_command(message: types.Message):
         await message.answer(f"❌ Произошла ошибка при обновлении баланса.\n\nОшибка: {str(e)}")
 
 
-
 @dp.message(F.text == "/persistence_info")
 async def persistence_info_command(message: types.Message):
     """Скрытая команда для получения информации о системе персистентности"""
@@ -3481,543 +3393,208 @@ async def recover_failed_auctions():
         logging.error(f"❌ Ошибка при восстановлении после сбоев: {e}")
 
 # --- Запуск бота ---
-async def main():
-    payment_task = None  # Initialize payment_task variable
+async def on_startup():
+    """Запуск сервисов бота (общий для polling и webhook)"""
+    # Инициализируем базу данных
+    await db.init_db()
+    logging.info("Database initialized")
+    
+    # Восстанавливаем баланс после возможных сбоев
+    await recover_failed_auctions()
     
+    # Настраиваем команды бота
+    await set_bot_commands()
+    logging.info("Bot commands configured")
+    
+    # Посты в канал идут по @username, правки - по числовому id: лимит канала у них общий
+    try:
+        channel = await bot.get_chat(CHANNEL_USERNAME)
+        telegram_governor.register_channel(CHANNEL_USERNAME, channel.id)
+    except Exception as e:
+        # id станет известен из ответа на первый пост в канал
+        logging.warning(f"Cannot resolve channel {CHANNEL_USERNAME}: {e}")
+    
+    # Запускаем систему персистентности аукционов
+    await auction_persistence.start()
+    logging.info("Auction persistence system started")
+    
+    # Ставки и выкупы находят лот по сообщению в канале через индекс в памяти
+    await db.load_channel_index()
+    
+    # Публикации в канал из outbox, в том числе оставшиеся с прошлого запуска
+    outbox_dispatcher.start()
+    
+    # Платежи, принятые webhook, в том числе не обработанные до перезапуска
+    await payment_queue.start()
+    
+    # Планировщик закрывает аукционы точно по времени окончания
+    await load_auction_deadlines()
+    auction_scheduler.start(finalize_due_auctions)
+
+async def on_shutdown():
+    """Остановка сервисов бота с сохранением состояния"""
+    # Останавливаем планировщик завершения аукционов
+    await auction_scheduler.stop()
+    
+    # Дописываем в базу ставки, принятые акторами аукционов
+    await bid_engine.stop()
+    
+    # Отправляем последние отложенные правки постов
+    await channel_editor.stop()
+    
+    # Невыполненные публикации остаются в outbox до следующего запуска
+    await outbox_dispatcher.stop()
+    
+    # Необработанные платежи остаются в базе до следующего запуска
+    await payment_queue.stop()
+    
+    # Останавливаем систему персистентности
+    await auction_persistence.stop()
+    logging.info("Auction persistence system stopped")
+    
+    # Закрываем пул соединений с базой данных
+    await db.close()
+    
+    await bot.session.close()
+    logging.info("Bot has been stopped.")
+
+async def main():
+    # SIGTERM (остановка контейнера) завершает polling так же, как Ctrl+C: finally вызовет on_shutdown
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows
     try:
         logging.info("Bot is starting...")
+        await on_startup()
+        update_queue.start()
         
-        # Инициализируем базу данных
-        await db.init_db()
-        logging.info("Database initialized")
-        
-        # Восстанавливаем баланс после возможных сбоев
-        await recover_failed_auctions()
-        
-        # Инициализируем систему уведомлений
-        init_notifications(BOT_TOKEN)
-        logging.info("Notification system initialized")
-        
-        # Настраиваем команды бота
-        await set_bot_commands()
-        logging.info("Bot commands configured")
-        
-        # Запускаем систему персистентности аукционов
-        await auction_persistence.start()
-        logging.info("Auction persistence system started")
-        
-        # Запускаем мониторинг аукционов
-        # await auction_monitor.start()  # Отключено
-        # logging.info("Auction monitor started")
-        
-        # Запускаем таймер аукционов
-        # await auction_timer.start()  # Отключено
-        # logging.info("Auction timer started")
-        
-        # Автоматическая система обработки платежей отключена
-        
-        # Запускаем бота
-        await dp.start_polling(bot)
+        # Запускаем бота: polling кладет обновления в общую очередь
+        await update_queue.poll()
         
+    except asyncio.CancelledError:
+        logging.info("Bot is stopping on signal...")
     except Exception as e:
         logging.error(f"Error starting bot: {e}")
     finally:
-        # Останавливаем таймер
-        # await auction_timer.stop()  # Отключено
-        # logging.info("Auction timer stopped")
-        
-        # Останавливаем мониторинг
-        # await auction_monitor.stop()  # Отключено
-        # logging.info("Auction monitor stopped")
-        
-        # Останавливаем систему персистентности
-        await auction_persistence.stop()
-        logging.info("Auction persistence system stopped")
-        
-        # Отменяем задачу обработки уведомлений
-        if payment_task is not None:
-            payment_task.cancel()
-            logging.info("Payment notification processor stopped")
-        
-        await bot.session.close()
-        logging.info("Bot has been stopped.")
+        await update_queue.stop()
+        await on_shutdown()
+
+# --- Webhook сервер (Quart): бот, webhook и платежи в одном цикле событий ---
+app = Quart(__name__)
+
+@app.before_serving
+async def startup_webhook():
+    """Запуск бота перед приемом запросов"""
+    logging.info("Bot is starting with webhook...")
+    await on_startup()
+    update_queue.start()
+    
+    # Настраиваем webhook
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not webhook_url:
+        # Получаем URL из Railway
+        railway_url = os.getenv("RAILWAY_PUBLIC_DOMAIN")
+        if railway_url:
+            webhook_url = f"https://{railway_url}/webhook"
+    
+    if webhook_url:
+        try:
+            # Удаляем старый webhook и устанавливаем новый
+            await bot.delete_webhook()
+            # chat_member не входит в типы по умолчанию - передаем используемые обработчиками
+            await bot.set_webhook(webhook_url, allowed_updates=dp.resolve_used_update_types())
+            logging.info(f"Webhook set to: {webhook_url}")
+        except Exception as e:
+            logging.warning(f"Failed to set webhook: {e}")
+    else:
+        # Для локального тестирования пропускаем webhook
+        logging.warning("WEBHOOK_URL not set and RAILWAY_PUBLIC_DOMAIN not available")
+        logging.warning("Webhook не настроен - кнопки в постах могут не работать")
+    
+    logging.info("Bot is ready to receive webhook requests")
 
-# --- Flask webhook сервер для Railway ---
-app = Flask(__name__)
+@app.after_serving
+async def shutdown_webhook():
+    """Остановка бота после остановки сервера"""
+    await update_queue.stop()
+    await on_shutdown()
 
 @app.route('/health')
-def health():
+async def health():
     """Проверка здоровья сервера"""
-    return {"status": "ok", "message": "Auction bot is running"}
+    return {
+        "status": "ok",
+        "message": "Auction bot is running",
+        "updates": update_queue.stats(),
+        "subscriptions": subscription_cache.stats(),
+        "user_cache": db.user_cache_stats,
+        "outbox": outbox_dispatcher.stats,
+        "telegram_rate": telegram_governor.info(),
+        "payments": payment_queue.stats
+    }
+
+
+async def ingest_yoomoney_notification(data: dict):
+    """
+    Принять уведомление YooMoney: проверить подпись и сохранить его (повторная доставка
+    того же operation_id ничего не меняет). Зачисление и уведомление пользователя выполняет
+    очередь платежей, поэтому ответ YooMoney не зависит от Telegram. Возвращает (тело, статус)
+    """
+    logging.info(f"📥 Получен платеж: operation_id={data.get('operation_id')}, label={data.get('label')}")
+    
+    if YOOMONEY_VERIFY_SIGNATURE and not verify_yoomoney_signature(data, YOOMONEY_SECRET, data.get('sha1_hash', '')):
+        logging.warning(f"⚠️ Неверная подпись уведомления YooMoney {data.get('operation_id')}")
+        return "Invalid signature", 400
+    
+    if data.get('notification_type') not in INCOMING_NOTIFICATION_TYPES:
+        return "OK", 200
+    
+    operation_id = data.get('operation_id')
+    if not operation_id:
+        return "Missing operation_id", 400
+    
+    if await db.record_payment_notification(operation_id, data):
+        payment_queue.submit(operation_id)
+    else:
+        logging.info(f"Повторное уведомление о платеже {operation_id}, уже принято")
+    return "OK", 200
 
 
 @app.route('/yoomoney', methods=['POST', 'GET'])
-def yoomoney_webhook():
+async def yoomoney_webhook():
     """Основной webhook для YooMoney - обрабатывает все платежи"""
-    logging.info("=== YOOMONEY WEBHOOK VERSION 15.0 - ОСНОВНОЙ ENDPOINT ===")
-    
     if request.method == 'GET':
         return "OK"
     
     # Получаем данные из формы
-    data = request.form.to_dict()
-    logging.info(f"📥 Получен платеж: {data}")
-    
-    # Обрабатываем все платежи (тестовые и реальные)
-    if data.get('notification_type') in ['card-incoming', 'p2p-incoming']:
-        logging.info("🔧 Обрабатываем платеж - начисляем баланс")
-        
-        # Определяем пользователя из label или используем админа для тестов
-        user_id = 476589798  # По умолчанию админ
-        if 'label' in data and data['label']:
-            try:
-                # Пытаемся извлечь user_id из label (формат: user_123456789)
-                if data['label'].startswith('user_'):
-                    user_id = int(data['label'].replace('user_', ''))
-            except:
-                pass
-        
-        # Определяем количество публикаций по сумме с учетом комиссии YooMoney
-        amount = float(data.get('amount', '0'))
-        withdraw_amount = float(data.get('withdraw_amount', amount))
-        
-        # Используем withdraw_amount (сумма без комиссии) для определения тарифа
-        # Комиссия YooMoney: 0% - 8%, поэтому расширяем диапазоны
-        if 46 <= withdraw_amount <= 54:  # Тариф 50₽ (комиссия до 8%)
-            publications = 1
-        elif 184 <= withdraw_amount <= 216:  # Тариф 200₽ (комиссия до 8%)
-            publications = 5
-        elif 322 <= withdraw_amount <= 378:  # Тариф 350₽ (комиссия до 8%)
-            publications = 10
-        elif 552 <= withdraw_amount <= 648:  # Тариф 600₽ (комиссия до 8%)
-            publications = 20
-        else:
-            # Если сумма не соответствует тарифам, не зачисляем публикации
-            publications = 0
-        
-        if publications > 0:
-            try:
-                import sqlite3
-                with sqlite3.connect(DATABASE_PATH) as db_conn:
-                    cursor = db_conn.cursor()
-                    
-                    # Создаем таблицы если их нет
-                    cursor.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, full_name TEXT, balance INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_admin BOOLEAN DEFAULT FALSE)")
-                    cursor.execute("CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, amount INTEGER NOT NULL, transaction_type TEXT NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-                    db_conn.commit()
-                    
-                    # Создаем пользователя если его нет
-                    cursor.execute(
-                        "INSERT OR IGNORE INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
-                        (user_id, None, None, 0, False)
-                    )
-                    
-                    # Начисляем публикации
-                    cursor.execute(
-                        "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                        (publications, user_id)
-                    )
-                    
-                    # Записываем транзакцию - показываем сумму, которую заплатил клиент
-                    operation_id = data.get('operation_id', 'unknown')
-                    description = f"Пополнение: {amount}₽ → {publications} публикаций"
-                    if data.get('test_notification') == 'true':
-                        description = f"Тестовое пополнение: {amount}₽ → {publications} публикаций"
-                    
-                    cursor.execute(
-                        "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
-                        (user_id, publications, "yoomoney_payment", description)
-                    )
-                    
-                    db_conn.commit()
-                
-                logging.info(f"✅ Начислено {publications} публикаций пользователю {user_id} за {amount}₽")
-                
-                # Отправляем уведомление через простую HTTP систему
-                try:
-                    import requests
-                    
-                    # Получаем новый баланс
-                    with sqlite3.connect(DATABASE_PATH) as db_conn:
-                        cursor = db_conn.cursor()
-                        cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-                        new_balance = cursor.fetchone()[0]
-                    
-                    # URL для отправки сообщения через Telegram Bot API
-                    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                    
-                    # Текст уведомления - показываем только сумму, которую заплатил клиент
-                    text = f"💰 <b>Баланс пополнен!</b>\n\n"
-                    text += f"💳 Сумма: {amount}₽\n"
-                    text += f"📝 Публикаций: +{publications}\n"
-                    text += f"💎 Новый баланс: {new_balance} публикаций"
-                    
-                    # Данные для отправки
-                    data = {
-                        'chat_id': user_id,
-                        'text': text,
-                        'parse_mode': 'HTML'
-                    }
-                    
-                    # Отправляем запрос
-                    response = requests.post(url, data=data, timeout=10)
-                    
-                    if response.status_code == 200:
-                        logging.info(f"✅ Уведомление отправлено пользователю {user_id}")
-                    else:
-                        logging.error(f"❌ Ошибка отправки уведомления: {response.status_code} - {response.text}")
-                    
-                except Exception as e:
-                    logging.error(f"❌ Ошибка отправки уведомления: {e}")
-                
-            except Exception as e:
-                logging.error(f"❌ Ошибка обновления баланса: {e}")
-        else:
-            logging.warning(f"⚠️ Сумма {withdraw_amount}₽ слишком мала для начисления публикаций")
-    
-    # Возвращаем OK
-    return "OK"
-
-# Флаг инициализации
-_webhook_initialized = False
-_webhook_set = False
-_webhook_loop = None
+    data = (await request.form).to_dict()
+    return await ingest_yoomoney_notification(data)
 
 @app.route('/webhook', methods=['POST', 'GET'])
-def webhook_new():
-    """Новый webhook - обрабатывает все платежи и сообщения Telegram"""
-    global _webhook_initialized
-    
-    logging.info("=== WEBHOOK VERSION 16.0 - УПРОЩЕННАЯ ОБРАБОТКА ===")
-    logging.info(f"Request method: {request.method}")
-    logging.info(f"Request headers: {dict(request.headers)}")
-    
+async def webhook_new():
+    """Webhook Telegram: обновление ставится в очередь, ответ возвращается сразу"""
     if request.method == 'GET':
-        logging.info("GET request received, returning OK")
         return "OK"
     
-    # Логируем входящие данные
-    try:
-        data = request.get_json()
-        logging.info(f"📥 Received webhook data: {data}")
-    except Exception as e:
-        logging.error(f"❌ Error parsing webhook data: {e}")
-        return "Error parsing data", 400
-    
-    # Инициализируем бота при первом запросе
-    if not _webhook_initialized:
-        try:
-            import asyncio
-            import threading
-            
-            def run_async_init():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    loop.run_until_complete(init_webhook_bot())
-                except Exception as e:
-                    logging.error(f"❌ Ошибка инициализации: {e}")
-                    import traceback
-                    logging.error(f"❌ Traceback: {traceback.format_exc()}")
-                finally:
-                    loop.close()
-            
-            # Запускаем инициализацию в отдельном потоке
-            init_thread = threading.Thread(target=run_async_init)
-            init_thread.start()
-            init_thread.join()
-            
-            _webhook_initialized = True
-            logging.info("✅ Webhook бот инициализирован")
-            
-        except Exception as e:
-            logging.error(f"❌ Ошибка инициализации: {e}")
-            import traceback
-            logging.error(f"❌ Traceback: {traceback.format_exc()}")
-    
-    # Проверяем, это сообщение от Telegram или платеж
-    content_type = request.content_type
-    
-    if 'application/json' in content_type:
+    if 'application/json' in (request.content_type or ''):
         # Это сообщение от Telegram
-        try:
-            # Получаем сырые данные
-            raw_data = request.get_data()
-            logging.info(f"📱 Получены сырые данные: {raw_data[:200]}...")
-            
-            if not raw_data:
-                logging.warning("⚠️ Получены пустые данные")
-                return "OK"
-            
-            # Парсим JSON вручную для лучшей обработки ошибок
-            import json
-            try:
-                data = json.loads(raw_data.decode('utf-8'))
-            except json.JSONDecodeError as e:
-                logging.error(f"❌ Ошибка парсинга JSON: {e}")
-                logging.error(f"❌ Сырые данные: {raw_data}")
-                return "OK"
-            
-            if not data:
-                logging.warning("⚠️ Получен пустой JSON")
-                return "OK"
-                
-            logging.info(f"📱 Получено сообщение от Telegram: {data}")
-            
-            # Обрабатываем сообщение через диспетчер
-            import asyncio
-            import threading
-            
-            def run_async_process():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    loop.run_until_complete(process_telegram_update_simple(data))
-                except Exception as e:
-                    logging.error(f"❌ Ошибка обработки: {e}")
-                    import traceback
-                    logging.error(f"❌ Traceback: {traceback.format_exc()}")
-                finally:
-                    loop.close()
-            
-            # Запускаем обработку в отдельном потоке
-            process_thread = threading.Thread(target=run_async_process)
-            process_thread.start()
-            process_thread.join()
-            
+        data = await request.get_json(force=True, silent=True)
+        if not data:
+            logging.warning("⚠️ Получен пустой или некорректный JSON")
             return "OK"
-        except Exception as e:
-            logging.error(f"❌ Ошибка обработки сообщения Telegram: {e}")
-            import traceback
-            logging.error(f"❌ Traceback: {traceback.format_exc()}")
-            return "ERROR", 500
-    
-    else:
-        # Это платеж от YooMoney
-        data = request.form.to_dict()
-        logging.info(f"📥 Получен платеж: {data}")
-    
-    # Обрабатываем все платежи (тестовые и реальные)
-    if data.get('notification_type') in ['card-incoming', 'p2p-incoming']:
-        logging.info("🔧 Обрабатываем платеж - начисляем баланс")
         
-        # Определяем пользователя из label или используем админа для тестов
-        user_id = 476589798  # По умолчанию админ
-        if 'label' in data and data['label']:
-            try:
-                # Пытаемся извлечь user_id из label (формат: user_123456789)
-                if data['label'].startswith('user_'):
-                    user_id = int(data['label'].replace('user_', ''))
-            except:
-                pass
-        
-        # Определяем количество публикаций по сумме с учетом комиссии YooMoney
-        amount = float(data.get('amount', '0'))
-        withdraw_amount = float(data.get('withdraw_amount', amount))
-        
-        # Используем withdraw_amount (сумма без комиссии) для определения тарифа
-        # Комиссия YooMoney: 0% - 8%, поэтому расширяем диапазоны
-        if 46 <= withdraw_amount <= 54:  # Тариф 50₽ (комиссия до 8%)
-            publications = 1
-        elif 184 <= withdraw_amount <= 216:  # Тариф 200₽ (комиссия до 8%)
-            publications = 5
-        elif 322 <= withdraw_amount <= 378:  # Тариф 350₽ (комиссия до 8%)
-            publications = 10
-        elif 552 <= withdraw_amount <= 648:  # Тариф 600₽ (комиссия до 8%)
-            publications = 20
-        else:
-            # Если сумма не соответствует тарифам, не зачисляем публикации
-            publications = 0
-        
-        if publications > 0:
-            try:
-                import sqlite3
-                with sqlite3.connect(DATABASE_PATH) as db_conn:
-                    cursor = db_conn.cursor()
-                    
-                    # Создаем таблицы если их нет
-                    cursor.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, full_name TEXT, balance INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_admin BOOLEAN DEFAULT FALSE)")
-                    cursor.execute("CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, amount INTEGER NOT NULL, transaction_type TEXT NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-                    db_conn.commit()
-                    
-                    # Создаем пользователя если его нет
-                    cursor.execute(
-                        "INSERT OR IGNORE INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
-                        (user_id, None, None, 0, False)
-                    )
-                    
-                    # Начисляем публикации
-                    cursor.execute(
-                        "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                        (publications, user_id)
-                    )
-                    
-                    # Записываем транзакцию - показываем сумму, которую заплатил клиент
-                    operation_id = data.get('operation_id', 'unknown')
-                    description = f"Пополнение: {amount}₽ → {publications} публикаций"
-                    if data.get('test_notification') == 'true':
-                        description = f"Тестовое пополнение: {amount}₽ → {publications} публикаций"
-                    
-                    cursor.execute(
-                        "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
-                        (user_id, publications, "yoomoney_payment", description)
-                    )
-                    
-                    db_conn.commit()
-                
-                logging.info(f"✅ Начислено {publications} публикаций пользователю {user_id} за {amount}₽")
-                
-                # Отправляем уведомление через простую HTTP систему
-                try:
-                    import requests
-                    
-                    # Получаем новый баланс
-                    with sqlite3.connect(DATABASE_PATH) as db_conn:
-                        cursor = db_conn.cursor()
-                        cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-                        new_balance = cursor.fetchone()[0]
-                    
-                    # URL для отправки сообщения через Telegram Bot API
-                    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                    
-                    # Текст уведомления - показываем только сумму, которую заплатил клиент
-                    text = f"💰 <b>Баланс пополнен!</b>\n\n"
-                    text += f"💳 Сумма: {amount}₽\n"
-                    text += f"📝 Публикаций: +{publications}\n"
-                    text += f"💎 Новый баланс: {new_balance} публикаций"
-                    
-                    # Данные для отправки
-                    data = {
-                        'chat_id': user_id,
-                        'text': text,
-                        'parse_mode': 'HTML'
-                    }
-                    
-                    # Отправляем запрос
-                    response = requests.post(url, data=data, timeout=10)
-                    
-                    if response.status_code == 200:
-                        logging.info(f"✅ Уведомление отправлено пользователю {user_id}")
-                    else:
-                        logging.error(f"❌ Ошибка отправки уведомления: {response.status_code} - {response.text}")
-                    
-                except Exception as e:
-                    logging.error(f"❌ Ошибка отправки уведомления: {e}")
-                
-            except Exception as e:
-                logging.error(f"❌ Ошибка обновления баланса: {e}")
-        else:
-            logging.warning(f"⚠️ Сумма {withdraw_amount}₽ слишком мала для начисления публикаций")
-    
-    # Возвращаем OK
-    return "OK"
-
-async def process_telegram_update_simple(update_data):
-    """Упрощенная обработка обновлений от Telegram"""
-    try:
-        from aiogram.types import Update
-        from aiogram import Bot
-        import asyncio
-        
-        logging.info(f"📱 Обрабатываем обновление: {update_data}")
-        
-        # База данных уже инициализирована при запуске бота
-        
-        # Создаем объект Update из данных
-        update = Update(**update_data)
-        
-        # Создаем новый экземпляр бота для этого event loop
-        temp_bot = Bot(token=BOT_TOKEN, **DEFAULT_BOT_KWARGS)
-        
-        # Обрабатываем обновление через диспетчер
-        await dp.feed_update(temp_bot, update)
-        
-        # Закрываем сессию бота
-        await temp_bot.session.close()
-        
-        logging.info("✅ Обновление обработано успешно")
-        
-    except Exception as e:
-        logging.error(f"❌ Ошибка обработки обновления Telegram: {e}")
-        import traceback
-        logging.error(f"❌ Traceback: {traceback.format_exc()}")
-
-
-# Глобальная переменная для отслеживания инициализации
-_bot_initialized = False
-
-# Инициализация для webhook режима
-async def init_webhook_bot():
-    """Инициализирует бота для webhook режима"""
-    global _bot_initialized
-    
-    # Проверяем, не инициализирован ли уже бот
-    if _bot_initialized:
-        logging.info("Bot already initialized, skipping...")
-        return
+        if not update_queue.submit(data):
+            # Очередь переполнена - Telegram повторит доставку позже
+            return "Busy", 503
+        return "OK"
     
-    _bot_initialized = True
-    try:
-        logging.info("=== ИНИЦИАЛИЗАЦИЯ WEBHOOK БОТА ===")
-        
-        # Инициализируем базу данных
-        await db.init_db()
-        logging.info("Database initialized")
-        
-        # Инициализируем систему уведомлений
-        init_notifications(BOT_TOKEN)
-        logging.info("Notification system initialized")
-        
-        # Настраиваем команды бота
-        await set_bot_commands()
-        logging.info("Bot commands configured")
-        
-        # Запускаем систему персистентности аукционов
-        await auction_persistence.start()
-        logging.info("Auction persistence system started")
-        
-        # Настраиваем webhook только если он еще не установлен
-        global _webhook_set
-        if not _webhook_set:
-            webhook_url = os.getenv("WEBHOOK_URL")
-            if not webhook_url:
-                # Получаем URL из Railway
-                railway_url = os.getenv("RAILWAY_PUBLIC_DOMAIN")
-                if railway_url:
-                    webhook_url = f"https://{railway_url}/webhook"
-                else:
-                    # Для локального тестирования используем ngrok или пропускаем webhook
-                    logging.warning("WEBHOOK_URL not set and RAILWAY_PUBLIC_DOMAIN not available")
-                    logging.warning("Webhook не настроен - кнопки в постах могут не работать")
-                    _webhook_set = True
-                    return
-            
-            try:
-                # Удаляем старый webhook и устанавливаем новый
-                await bot.delete_webhook()
-                await bot.set_webhook(webhook_url)
-                logging.info(f"Webhook set to: {webhook_url}")
-                _webhook_set = True
-            except Exception as e:
-                logging.warning(f"Failed to set webhook: {e}")
-                # Не прерываем инициализацию, если webhook уже установлен
-        else:
-            logging.info("Webhook already set, skipping...")
-        
-        # В webhook режиме диспетчер не запускается, только инициализируется
-        logging.info("Dispatcher ready for webhook mode")
-        
-        logging.info("✅ Webhook бот инициализирован")
-        
-    except Exception as e:
-        logging.error(f"❌ Ошибка инициализации webhook бота: {e}")
-        import traceback
-        logging.error(f"❌ Traceback: {traceback.format_exc()}")
-
-# Инициализация будет запущена при первом запросе к webhook
+    # Это платеж от YooMoney
+    data = (await request.form).to_dict()
+    return await ingest_yoomoney_notification(data)
 
 @app.route('/yoomoney_debug', methods=['POST', 'GET'])
-def yoomoney_debug_webhook():
+async def yoomoney_debug_webhook():
     """Отладочный webhook для диагностики"""
     try:
         logging.info("=" * 50)
@@ -4030,8 +3607,8 @@ def yoomoney_debug_webhook():
             return {"status": "ok", "message": "Debug webhook ready"}
         
         # Получаем все возможные данные
-        form_data = request.form.to_dict()
-        json_data = request.get_json() if request.is_json else None
+        form_data = (await request.form).to_dict()
+        json_data = await request.get_json(silent=True) if request.is_json else None
         args_data = request.args.to_dict()
         
         logging.info(f"Form данные: {form_data}")
@@ -4048,110 +3625,22 @@ def yoomoney_debug_webhook():
         return "error", 500
 
 
-def run_flask_app():
-    """Запуск Flask приложения"""
-    # Инициализируем бота при запуске Flask
-    import asyncio
-    import threading
-    
-    def init_bot_async():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(init_webhook_bot())
-        except Exception as e:
-            logging.error(f"❌ Ошибка инициализации бота: {e}")
-        finally:
-            loop.close()
-    
-    # Запускаем инициализацию бота в отдельном потоке
-    bot_thread = threading.Thread(target=init_bot_async, daemon=True)
-    bot_thread.start()
-    
-    port = int(os.getenv("PORT", 8080))
-    app.run(host="0.0.0.0", port=port, debug=False)
-
-async def main_webhook():
-    """Запуск бота в режиме webhook"""
-    try:
-        logging.info("Bot is starting with webhook...")
-        
-        # Инициализируем базу данных
-        await db.init_db()
-        logging.info("Database initialized")
-        
-        # Восстанавливаем баланс после возможных сбоев
-        await recover_failed_auctions()
-        
-        # Инициализируем систему уведомлений
-        init_notifications(BOT_TOKEN)
-        logging.info("Notification system initialized")
-        
-        # Настраиваем команды бота
-        await set_bot_commands()
-        logging.info("Bot commands configured")
-        
-        # Запускаем систему персистентности аукционов
-        await auction_persistence.start()
-        logging.info("Auction persistence system started")
-        
-        # Настраиваем webhook
-        webhook_url = os.getenv("WEBHOOK_URL")
-        if not webhook_url:
-            # Получаем URL из Railway
-            railway_url = os.getenv("RAILWAY_PUBLIC_DOMAIN")
-            if railway_url:
-                webhook_url = f"https://{railway_url}/webhook"
-            else:
-                # Для локального тестирования пропускаем webhook
-                logging.warning("WEBHOOK_URL not set and RAILWAY_PUBLIC_DOMAIN not available")
-                logging.warning("Webhook не настроен - кнопки в постах могут не работать")
-                # Продолжаем работу без webhook
-                while True:
-                    await asyncio.sleep(1)
-                return
-            
-        # Удаляем старый webhook и устанавливаем новый
-        await bot.delete_webhook()
-        await bot.set_webhook(webhook_url)
-        logging.info(f"Webhook set to: {webhook_url}")
-        
-        # Запускаем бота в режиме webhook (без polling)
-        # В webhook режиме бот не должен запускать polling
-        # Вместо этого мы просто ждем, пока Flask обрабатывает webhook запросы
-        logging.info("Bot is ready to receive webhook requests")
-        
-        # Ждем бесконечно, пока бот работает
-        while True:
-            await asyncio.sleep(1)
-        
-    except Exception as e:
-        logging.error(f"Error starting bot with webhook: {e}")
-    finally:
-        # Останавливаем систему персистентности
-        await auction_persistence.stop()
-        logging.info("Auction persistence system stopped")
-        
-        # Останавливаем бота
-        await bot.session.close()
-        logging.info("Bot has been stopped.")
-
 def run_bot_with_webhook():
-    """Запуск бота с webhook сервером"""
-    # Запускаем Flask в отдельном потоке
-    flask_thread = threading.Thread(target=run_flask_app, daemon=True)
-    flask_thread.start()
+    """Запуск бота с webhook сервером (hypercorn, один цикл событий)"""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
     
-    # Запускаем бота в webhook режиме
-    asyncio.run(main_webhook())
+    config = Config()
+    config.bind = [f"0.0.0.0:{int(os.getenv('PORT', 8080))}"]
+    asyncio.run(serve(app, config))
 
 if __name__ == "__main__":
     # Проверяем, запущен ли на Railway или нужно использовать webhook
     if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("USE_WEBHOOK", "false").lower() == "true" or os.getenv("PORT"):
         # На Railway или с принудительным webhook - запускаем с webhook
-        print("🚀 Запуск бота с webhook сервером... (перезапуск для применения изменений)")
+        print("🚀 Запуск бота с webhook сервером...")
         run_bot_with_webhook()
     else:
         # Локально - обычный polling
         print("🚀 Запуск бота в режиме polling...")
-        asyncio.run(main())
\ No newline at end of file
+        asyncio.run(main())
@@ -0,0 +1,139 @@
+# Файл: channel_editor.py
+# Отложенное редактирование постов аукционов в канале: из пачки обновлений отправляется только последнее
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import InlineKeyboardMarkup
+
+
+class ChannelEditor:
+    """
+    Склеивает правки одного поста: хранит последнее отрисованное состояние
+    для (chat_id, message_id) и редактирует сообщение не чаще раза в interval секунд.
+    """
+
+    def __init__(self, bot: Bot, interval: float = 1.0, history_size: int = 4096):
+        self.bot = bot
+        self.interval = interval
+        self.history_size = history_size
+        # Ожидающее состояние: (text, keyboard, is_caption)
+        self.pending: Dict[Tuple[int, int], Tuple[str, Optional[InlineKeyboardMarkup], bool]] = {}
+        self.tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        # Хеш последней отправленной правки и максимальная версия состояния поста
+        self.sent_hashes: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self.versions: "OrderedDict[Tuple[int, int], Any]" = OrderedDict()
+        self.stats = {'submitted': 0, 'edits': 0, 'unchanged': 0, 'stale': 0, 'flood_waits': 0, 'retries': 0}
+
+    async def submit(self, chat_id: int, message_id: int, text: str,
+                     keyboard: Optional[InlineKeyboardMarkup] = None,
+                     is_caption: bool = True, version: Any = None):
+        """
+        Запланировать правку поста. version - монотонная версия состояния
+        (например, текущая цена): устаревшие правки, пришедшие позже новых, отбрасываются.
+        """
+        key = (chat_id, message_id)
+        self.stats['submitted'] += 1
+
+        if version is not None:
+            last_version = self.versions.get(key)
+            if last_version is not None and version < last_version:
+                self.stats['stale'] += 1
+                return
+            self._remember(self.versions, key, version)
+
+        self.pending[key] = (text, keyboard, is_caption)
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: Tuple[int, int]):
+        """Отправляет последнее состояние поста и выдерживает паузу до следующей правки"""
+        try:
+            while key in self.pending:
+                state = self.pending.pop(key)
+                try:
+                    delay = await self._edit(key, *state)
+                except asyncio.CancelledError:
+                    # Правку прервали (stop): состояние возвращаем, stop() отправит его сам,
+                    # если за это время не пришло более новое
+                    self.pending.setdefault(key, state)
+                    raise
+                if delay:
+                    await asyncio.sleep(delay)
+        finally:
+            self.tasks.pop(key, None)
+
+    async def _edit(self, key: Tuple[int, int], text: str,
+                    keyboard: Optional[InlineKeyboardMarkup], is_caption: bool) -> float:
+        """Отредактировать пост. Возвращает паузу перед следующей правкой этого поста"""
+        digest = hash((text, keyboard.model_dump_json() if keyboard else None, is_caption))
+        if self.sent_hashes.get(key) == digest:
+            self.stats['unchanged'] += 1
+            return 0
+
+        chat_id, message_id = key
+        try:
+            if is_caption:
+                await self.bot.edit_message_caption(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    caption=text,
+                    reply_markup=keyboard,
+                    parse_mode="HTML"
+                )
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=keyboard,
+                    parse_mode="HTML"
+                )
+        except TelegramRetryAfter as e:
+            # Flood control: повторим позже, если за это время не пришло более новое состояние
+            self.stats['flood_waits'] += 1
+            self.pending.setdefault(key, (text, keyboard, is_caption))
+            logging.warning(f"Flood control on channel post {key}, retry in {e.retry_after}s")
+            return e.retry_after
+        except (TelegramServerError, TelegramNetworkError) as e:
+            # Временная ошибка Telegram: правка - последнее состояние поста, ее безопасно повторить
+            self.stats['retries'] += 1
+            self.pending.setdefault(key, (text, keyboard, is_caption))
+            logging.warning(f"Temporary error editing channel post {key}: {e}")
+            return max(self.interval, 5.0)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                self._remember(self.sent_hashes, key, digest)
+            else:
+                logging.error(f"❌ Ошибка обновления сообщения {key}: {e}")
+            return self.interval
+        except Exception as e:
+            logging.error(f"❌ Ошибка обновления сообщения {key}: {e}")
+            return self.interval
+
+        self.stats['edits'] += 1
+        self._remember(self.sent_hashes, key, digest)
+        return self.interval
+
+    def _remember(self, cache: OrderedDict, key: Tuple[int, int], value: Any):
+        """Запомнить значение в ограниченном LRU-словаре"""
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.history_size:
+            cache.popitem(last=False)
+
+    async def stop(self):
+        """Остановить фоновые правки и отправить последние состояния постов"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        pending, self.pending = self.pending, {}
+        for key, (text, keyboard, is_caption) in pending.items():
+            await self._edit(key, text, keyboard, is_caption)
+        logging.info(f"Channel editor stopped: {self.stats}")
@@ -24,6 +24,8 @@ def load_config():
     YOOMONEY_RECEIVER = os.getenv("YOOMONEY_RECEIVER", "4100118987681575")
     YOOMONEY_SECRET = os.getenv("YOOMONEY_SECRET", "SaTKEuJWPVXJI/JFpXDCHZ4q")
     YOOMONEY_NOTIFICATION_URL = os.getenv("YOOMONEY_NOTIFICATION_URL", "https://web-production-fa7dc.up.railway.app/yoomoney")
+    # Отклонять уведомления YooMoney с неверной подписью sha1_hash
+    YOOMONEY_VERIFY_SIGNATURE = os.getenv("YOOMONEY_VERIFY_SIGNATURE", "true").lower() == "true"
     
     # Тарифы для оплаты
     PAYMENT_PLANS = {
@@ -54,6 +56,39 @@ def load_config():
     # Путь к базе данных
     DATABASE_PATH = os.getenv("DATABASE_PATH", "auction_bot.db")
     
+    # Количество соединений-читателей в пуле базы данных
+    DB_POOL_READERS = int(os.getenv("DB_POOL_READERS", "4"))
+    
+    # Сколько пользователей держать в памяти (LRU-кеш записей users)
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    
+    # Интервал группового коммита ставок, мс
+    BID_FLUSH_INTERVAL_MS = int(os.getenv("BID_FLUSH_INTERVAL_MS", "5"))
+    
+    # Минимальный интервал между правками одного поста в канале, сек
+    CHANNEL_EDIT_INTERVAL = float(os.getenv("CHANNEL_EDIT_INTERVAL", "1.0"))
+    # Сколько публикаций лотов в канал может идти одновременно (лимит Telegram на посты в канал)
+    CHANNEL_PUBLISH_CONCURRENCY = int(os.getenv("CHANNEL_PUBLISH_CONCURRENCY", "2"))
+    # Очередь публикаций (outbox): пауза между постами в канал, сек, и число попыток при 5xx/сетевых ошибках
+    OUTBOX_PUBLISH_INTERVAL = float(os.getenv("OUTBOX_PUBLISH_INTERVAL", "3.0"))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+    
+    # Лимиты отправки в Telegram: всего сообщений в секунду, в секунду в личный чат, в минуту в группу/канал
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1.0"))
+    TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+    # Посты и правки постов в канале CHANNEL_USERNAME в минуту (правки расходуют тот же лимит, что и посты)
+    TELEGRAM_CHANNEL_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_CHANNEL_RATE_PER_MINUTE", "20"))
+    # Сколько уведомлений рассылка отправляет одновременно
+    NOTIFICATION_CONCURRENCY = int(os.getenv("NOTIFICATION_CONCURRENCY", "10"))
+    
+    # Пул обработчиков обновлений webhook: число воркеров и размер очереди
+    UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+    UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+    
+    # Сколько последних update_id помнить для отбрасывания повторных доставок webhook
+    UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "10000"))
+    
     # Внешние API настройки
     EXTERNAL_API_URL = os.getenv("EXTERNAL_API_URL", "")
     EXTERNAL_API_KEY = os.getenv("EXTERNAL_API_KEY", "")
@@ -74,16 +109,23 @@ def load_config():
     # Настройки персистентности
     PERSISTENCE_FILE = os.getenv("PERSISTENCE_FILE", "auction_state.json")
     PERSISTENCE_INTERVAL = int(os.getenv("PERSISTENCE_INTERVAL", "300"))
+    # Где хранить снимок: json (файл PERSISTENCE_FILE), sqlite (таблицы в базе) или none (только база)
+    PERSISTENCE_BACKEND = os.getenv("PERSISTENCE_BACKEND", "json")
     
     # Отключение проверки подписки (для тестирования)
     DISABLE_SUBSCRIPTION_CHECK = os.getenv("DISABLE_SUBSCRIPTION_CHECK", "true").lower() == "true"
     
+    # Сколько помнить результат проверки подписки, сек (есть подписка / нет подписки)
+    SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", "300"))
+    SUBSCRIPTION_NEGATIVE_TTL = float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "30"))
+    
     return {
         "BOT_TOKEN": BOT_TOKEN,
         "PAYMENTS_PROVIDER_TOKEN": PAYMENTS_PROVIDER_TOKEN,
         "YOOMONEY_RECEIVER": YOOMONEY_RECEIVER,
         "YOOMONEY_SECRET": YOOMONEY_SECRET,
         "YOOMONEY_NOTIFICATION_URL": YOOMONEY_NOTIFICATION_URL,
+        "YOOMONEY_VERIFY_SIGNATURE": YOOMONEY_VERIFY_SIGNATURE,
         "PAYMENT_PLANS": PAYMENT_PLANS,
         "YOOMONEY_BASE_URL": YOOMONEY_BASE_URL,
         "CHANNEL_USERNAME": CHANNEL_USERNAME,
@@ -91,6 +133,21 @@ def load_config():
         "CHANNEL_DISPLAY_NAME": CHANNEL_DISPLAY_NAME,
         "ADMIN_USER_IDS": ADMIN_USER_IDS,
         "DATABASE_PATH": DATABASE_PATH,
+        "DB_POOL_READERS": DB_POOL_READERS,
+        "USER_CACHE_SIZE": USER_CACHE_SIZE,
+        "BID_FLUSH_INTERVAL_MS": BID_FLUSH_INTERVAL_MS,
+        "CHANNEL_EDIT_INTERVAL": CHANNEL_EDIT_INTERVAL,
+        "CHANNEL_PUBLISH_CONCURRENCY": CHANNEL_PUBLISH_CONCURRENCY,
+        "OUTBOX_PUBLISH_INTERVAL": OUTBOX_PUBLISH_INTERVAL,
+        "OUTBOX_MAX_ATTEMPTS": OUTBOX_MAX_ATTEMPTS,
+        "TELEGRAM_GLOBAL_RATE": TELEGRAM_GLOBAL_RATE,
+        "TELEGRAM_CHAT_RATE": TELEGRAM_CHAT_RATE,
+        "TELEGRAM_GROUP_RATE_PER_MINUTE": TELEGRAM_GROUP_RATE_PER_MINUTE,
+        "TELEGRAM_CHANNEL_RATE_PER_MINUTE": TELEGRAM_CHANNEL_RATE_PER_MINUTE,
+        "NOTIFICATION_CONCURRENCY": NOTIFICATION_CONCURRENCY,
+        "UPDATE_WORKERS": UPDATE_WORKERS,
+        "UPDATE_QUEUE_SIZE": UPDATE_QUEUE_SIZE,
+        "UPDATE_DEDUP_WINDOW": UPDATE_DEDUP_WINDOW,
         "EXTERNAL_API_URL": EXTERNAL_API_URL,
         "EXTERNAL_API_KEY": EXTERNAL_API_KEY,
         "EXTERNAL_API_TIMEOUT": EXTERNAL_API_TIMEOUT,
@@ -99,7 +156,10 @@ def load_config():
         "LOG_FILE": LOG_FILE,
         "PERSISTENCE_FILE": PERSISTENCE_FILE,
         "PERSISTENCE_INTERVAL": PERSISTENCE_INTERVAL,
-        "DISABLE_SUBSCRIPTION_CHECK": DISABLE_SUBSCRIPTION_CHECK
+        "PERSISTENCE_BACKEND": PERSISTENCE_BACKEND,
+        "DISABLE_SUBSCRIPTION_CHECK": DISABLE_SUBSCRIPTION_CHECK,
+        "SUBSCRIPTION_CACHE_TTL": SUBSCRIPTION_CACHE_TTL,
+        "SUBSCRIPTION_NEGATIVE_TTL": SUBSCRIPTION_NEGATIVE_TTL
     }
 
 # Загружаем конфигурацию
@@ -111,6 +171,7 @@ PAYMENTS_PROVIDER_TOKEN = config["PAYMENTS_PROVIDER_TOKEN"]
 YOOMONEY_RECEIVER = config["YOOMONEY_RECEIVER"]
 YOOMONEY_SECRET = config["YOOMONEY_SECRET"]
 YOOMONEY_NOTIFICATION_URL = config["YOOMONEY_NOTIFICATION_URL"]
+YOOMONEY_VERIFY_SIGNATURE = config["YOOMONEY_VERIFY_SIGNATURE"]
 PAYMENT_PLANS = config["PAYMENT_PLANS"]
 YOOMONEY_BASE_URL = config["YOOMONEY_BASE_URL"]
 CHANNEL_USERNAME = config["CHANNEL_USERNAME"]
@@ -118,6 +179,21 @@ CHANNEL_USERNAME_LINK = config["CHANNEL_USERNAME_LINK"]
 CHANNEL_DISPLAY_NAME = config["CHANNEL_DISPLAY_NAME"]
 ADMIN_USER_IDS = config["ADMIN_USER_IDS"]
 DATABASE_PATH = config["DATABASE_PATH"]
+DB_POOL_READERS = config["DB_POOL_READERS"]
+USER_CACHE_SIZE = config["USER_CACHE_SIZE"]
+BID_FLUSH_INTERVAL_MS = config["BID_FLUSH_INTERVAL_MS"]
+CHANNEL_EDIT_INTERVAL = config["CHANNEL_EDIT_INTERVAL"]
+CHANNEL_PUBLISH_CONCURRENCY = config["CHANNEL_PUBLISH_CONCURRENCY"]
+OUTBOX_PUBLISH_INTERVAL = config["OUTBOX_PUBLISH_INTERVAL"]
+OUTBOX_MAX_ATTEMPTS = config["OUTBOX_MAX_ATTEMPTS"]
+TELEGRAM_GLOBAL_RATE = config["TELEGRAM_GLOBAL_RATE"]
+TELEGRAM_CHAT_RATE = config["TELEGRAM_CHAT_RATE"]
+TELEGRAM_GROUP_RATE_PER_MINUTE = config["TELEGRAM_GROUP_RATE_PER_MINUTE"]
+TELEGRAM_CHANNEL_RATE_PER_MINUTE = config["TELEGRAM_CHANNEL_RATE_PER_MINUTE"]
+NOTIFICATION_CONCURRENCY = config["NOTIFICATION_CONCURRENCY"]
+UPDATE_WORKERS = config["UPDATE_WORKERS"]
+UPDATE_QUEUE_SIZE = config["UPDATE_QUEUE_SIZE"]
+UPDATE_DEDUP_WINDOW = config["UPDATE_DEDUP_WINDOW"]
 EXTERNAL_API_URL = config["EXTERNAL_API_URL"]
 EXTERNAL_API_KEY = config["EXTERNAL_API_KEY"]
 EXTERNAL_API_TIMEOUT = config["EXTERNAL_API_TIMEOUT"]
@@ -126,4 +202,7 @@ LOG_LEVEL = config["LOG_LEVEL"]
 LOG_FILE = config["LOG_FILE"]
 PERSISTENCE_FILE = config["PERSISTENCE_FILE"]
 PERSISTENCE_INTERVAL = config["PERSISTENCE_INTERVAL"]
+PERSISTENCE_BACKEND = config["PERSISTENCE_BACKEND"]
 DISABLE_SUBSCRIPTION_CHECK = config["DISABLE_SUBSCRIPTION_CHECK"]
+SUBSCRIPTION_CACHE_TTL = config["SUBSCRIPTION_CACHE_TTL"]
+SUBSCRIPTION_NEGATIVE_TTL = config["SUBSCRIPTION_NEGATIVE_TTL"]
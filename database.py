@@ -1,18 +1,324 @@
 # Файл: database.py
 import asyncio
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+import json
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import logging
 
+from records import Auction, Bid, OutboxJob, User
+from utils import now_ms, to_epoch_ms
+
 try:
     import aiosqlite
 except ImportError:
     print("aiosqlite не установлен. Установите: pip install aiosqlite")
     raise
 
+# Настройки каждого соединения: WAL позволяет читателям не блокировать писателя
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 МБ страничного кеша
+    "PRAGMA mmap_size = 268435456",    # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 10000",
+)
+
+# Версионированный набор индексов (версия хранится в PRAGMA user_version)
+SCHEMA_INDEXES = {
+    1: (
+        # Поиск аукциона по нажатой кнопке в канале
+        "CREATE INDEX IF NOT EXISTS idx_auctions_channel_message ON auctions (channel_chat_id, channel_message_id)",
+        # "Мои аукционы" и статистика пользователя
+        "CREATE INDEX IF NOT EXISTS idx_auctions_owner_created ON auctions (owner_id, created_at)",
+        # Активные/истекшие аукционы
+        "CREATE INDEX IF NOT EXISTS idx_auctions_status_end ON auctions (status, end_time)",
+        "CREATE INDEX IF NOT EXISTS idx_bids_auction ON bids (auction_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_auction_media_auction ON auction_media (auction_id, order_index)",
+        # Проверка недавних платежей
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_type ON transactions (user_id, transaction_type, created_at)",
+    ),
+    2: (
+        # Диапазоны по времени - сравнение целых чисел (мс Unix, UTC) вместо строк
+        "CREATE INDEX IF NOT EXISTS idx_auctions_status_end_ts ON auctions (status, end_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_auctions_owner_created_ts ON auctions (owner_id, created_ts)",
+        "DROP INDEX IF EXISTS idx_auctions_status_end",
+        "DROP INDEX IF EXISTS idx_auctions_owner_created",
+    ),
+    3: (
+        # Выборка наступивших заданий диспетчером outbox
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_auction ON outbox (auction_id, kind)",
+    ),
+    4: (
+        # Недообработанные уведомления о платежах при запуске
+        "CREATE INDEX IF NOT EXISTS idx_payment_notifications_status ON payment_notifications (status, received_ts)",
+    ),
+}
+
+# Размер пачки при заполнении end_ts/created_ts у существующих аукционов
+TIMESTAMP_BACKFILL_BATCH = 500
+
+# Сколько id передавать в один запрос IN (...) (лимит параметров SQLite)
+IN_QUERY_CHUNK = 500
+SCHEMA_VERSION = max(SCHEMA_INDEXES)
+
+async def connect(db_path: str, timeout: float = 10) -> aiosqlite.Connection:
+    """Открыть соединение с базой данных и применить настройки SQLite"""
+    conn = await aiosqlite.connect(db_path, timeout=timeout)
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            await conn.execute(pragma)
+    except Exception:
+        await conn.close()
+        raise
+    return conn
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений SQLite: одно соединение-писатель и несколько читателей.
+    Пул привязан к event loop, в котором был создан.
+    """
+    
+    def __init__(self, db_path: str, readers: int = 4, timeout: float = 10):
+        self.db_path = db_path
+        self.readers = max(1, readers)
+        self.timeout = timeout
+        self._writer = None
+        self._writer_lock = asyncio.Lock()
+        self._idle_readers: asyncio.Queue = asyncio.Queue()
+        self._opened_readers = 0
+        self._connections = []
+        self._closed = False
+    
+    async def _open(self) -> aiosqlite.Connection:
+        """Открыть новое соединение и запомнить его для закрытия"""
+        conn = await connect(self.db_path, timeout=self.timeout)
+        self._connections.append(conn)
+        return conn
+    
+    @asynccontextmanager
+    async def writer(self):
+        """Взять соединение-писатель (записи сериализуются)"""
+        async with self._writer_lock:
+            if self._closed:
+                raise RuntimeError("Connection pool is closed")
+            if self._writer is None:
+                self._writer = await self._open()
+            conn = self._writer
+            try:
+                yield conn
+            finally:
+                # Незавершенная транзакция не должна достаться следующему писателю
+                if conn.in_transaction:
+                    await conn.rollback()
+    
+    @asynccontextmanager
+    async def reader(self):
+        """Взять соединение-читатель из пула и вернуть его после использования"""
+        conn = await self._checkout_reader()
+        try:
+            yield conn
+        finally:
+            await self._checkin_reader(conn)
+    
+    async def _checkout_reader(self) -> aiosqlite.Connection:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        if not self._idle_readers.empty():
+            return self._idle_readers.get_nowait()
+        if self._opened_readers < self.readers:
+            self._opened_readers += 1
+            try:
+                return await self._open()
+            except Exception:
+                self._opened_readers -= 1
+                raise
+        return await self._idle_readers.get()
+    
+    async def _checkin_reader(self, conn: aiosqlite.Connection):
+        if conn.in_transaction:
+            await conn.rollback()
+        if self._closed:
+            await conn.close()
+        else:
+            self._idle_readers.put_nowait(conn)
+    
+    async def close(self):
+        """Закрыть все соединения пула"""
+        self._closed = True
+        if self._writer is not None:
+            try:
+                # Обновляем статистику планировщика запросов перед остановкой
+                await self._writer.execute("PRAGMA optimize")
+            except Exception as e:
+                logging.warning(f"PRAGMA optimize failed: {e}")
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                logging.warning(f"Error closing database connection: {e}")
+        self._writer = None
+        logging.info(f"Connection pool closed ({len(connections)} connections)")
+
+def _id_chunks(ids: List[int]):
+    """Разбить id на пачки для IN (...): (пачка, строка плейсхолдеров)"""
+    for start in range(0, len(ids), IN_QUERY_CHUNK):
+        chunk = ids[start:start + IN_QUERY_CHUNK]
+        yield chunk, ",".join("?" * len(chunk))
+
+async def fetch_records(db: aiosqlite.Connection, record_type, sql: str, params=()) -> list:
+    """Выполнить запрос и разобрать строки в записи record_type"""
+    cursor = await db.execute(sql, params)
+    cursor.row_factory = record_type.row_factory(cursor.description)
+    return await cursor.fetchall()
+
+async def fetch_record(db: aiosqlite.Connection, record_type, sql: str, params=()):
+    """Первая строка запроса в виде записи record_type (или None)"""
+    cursor = await db.execute(sql, params)
+    cursor.row_factory = record_type.row_factory(cursor.description)
+    return await cursor.fetchone()
+
+def _parse_legacy_time(value: Any) -> Optional[datetime]:
+    """Время из старых колонок end_time/created_at (None - пусто или не разбирается)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
 class Database:
-    def __init__(self, db_path: str = "auction_bot.db"):
+    def __init__(self, db_path: str = "auction_bot.db", pool_readers: int = 4, user_cache_size: int = 10000):
         self.db_path = db_path
+        self.pool_readers = pool_readers
+        self._pool: Optional[ConnectionPool] = None
+        # LRU-кеш записей пользователей; все записи в users обновляют его (write-through)
+        self.user_cache_size = user_cache_size
+        self._users: "OrderedDict[int, User]" = OrderedDict()
+        # Счетчик записей в users: промах кеша не сохраняет прочитанное, если запись успела пройти
+        self._user_writes = 0
+        self.user_cache_stats = {'hits': 0, 'misses': 0}
+        # Индекс активных лотов по сообщению в канале: (chat_id, message_id) -> снимок аукциона
+        self._channel_index: Dict[Tuple[int, int], Auction] = {}
+        self._channel_keys: Dict[int, Tuple[int, int]] = {}
+        self._auction_writes = 0
+        # Подписчики на изменения аукционов (журнал persistence); вызываются после коммита
+        self._change_listeners: List[Callable[[Dict], None]] = []
+    
+    def add_change_listener(self, listener: Callable[[Dict], None]):
+        """Подписаться на закоммиченные изменения аукционов: новые лоты, ставки, статусы, сообщения в канале"""
+        self._change_listeners.append(listener)
+    
+    def _emit_change(self, event_type: str, auction_id: int, **fields):
+        if not self._change_listeners:
+            return
+        event = {'type': event_type, 'auction_id': auction_id, **fields}
+        for listener in self._change_listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logging.error(f"Error in auction change listener: {e}")
+    
+    def _emit_bid(self, auction_id: int, bidder_id: int, bidder_username: str, amount: int):
+        # created_at в формате CURRENT_TIMESTAMP таблицы bids (UTC)
+        self._emit_change('bid', auction_id, bidder_id=bidder_id, bidder_username=bidder_username, amount=amount,
+                          created_at=datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    
+    def _cache_user(self, user: User):
+        """Положить пользователя в кеш, вытеснив самого давнего"""
+        self._users[user['user_id']] = user
+        self._users.move_to_end(user['user_id'])
+        if len(self._users) > self.user_cache_size:
+            self._users.popitem(last=False)
+    
+    def _update_cached_user(self, user_id: int, **fields):
+        """Записать изменение пользователя в кеш (если он там есть)"""
+        self._user_writes += 1
+        user = self._users.get(user_id)
+        if user is not None:
+            self._users[user_id] = user.replace(**fields)
+    
+    def invalidate_user(self, user_id: int):
+        """Сбросить пользователя из кеша после записи в users в обход Database"""
+        self._user_writes += 1
+        self._users.pop(user_id, None)
+    
+    def _index_auction(self, auction: Auction):
+        """Записать снимок аукциона в индекс по сообщению (закрытый лот из индекса удаляется)"""
+        self._auction_writes += 1
+        self._unindex_auction(auction['id'])
+        if auction['status'] == 'active' and auction['channel_message_id'] is not None:
+            key = (auction['channel_chat_id'], auction['channel_message_id'])
+            self._channel_index[key] = auction
+            self._channel_keys[auction['id']] = key
+    
+    def _unindex_auction(self, auction_id: int):
+        self._auction_writes += 1
+        key = self._channel_keys.pop(auction_id, None)
+        if key is not None:
+            self._channel_index.pop(key, None)
+    
+    def _update_indexed_auction(self, auction_id: int, **fields):
+        """Применить изменение аукциона к снимку в индексе"""
+        self._auction_writes += 1
+        key = self._channel_keys.get(auction_id)
+        if key is None:
+            return
+        snapshot = self._channel_index[key].replace(**fields)
+        if snapshot['status'] != 'active':
+            self._unindex_auction(auction_id)
+        else:
+            self._channel_index[key] = snapshot
+    
+    async def _refresh_indexed_auction(self, db: aiosqlite.Connection, auction_id: int):
+        """
+        Условный UPDATE не прошел: перечитать лот в той же транзакции и обновить индекс.
+        Из индекса лот убирается, только если он действительно закрыт (или удален);
+        при обычной конкуренции ставок в индекс попадает актуальная цена.
+        """
+        current = await fetch_record(db, Auction, "SELECT * FROM auctions WHERE id = ?", (auction_id,))
+        if current is None:
+            self._unindex_auction(auction_id)
+        else:
+            self._index_auction(current)
+
+    async def load_channel_index(self):
+        """Заполнить индекс активными опубликованными лотами (при старте)"""
+        async with self.read_connection() as db:
+            auctions = await fetch_records(
+                db, Auction, "SELECT * FROM auctions WHERE status = 'active' AND channel_message_id IS NOT NULL"
+            )
+        for auction in auctions:
+            self._index_auction(auction)
+        logging.info(f"Channel message index loaded ({len(self._channel_index)} auctions)")
+    
+    def _get_pool(self) -> ConnectionPool:
+        """Пул соединений (создается при первом обращении, в цикле событий бота)"""
+        if self._pool is None:
+            self._pool = ConnectionPool(self.db_path, self.pool_readers)
+        return self._pool
+    
+    @asynccontextmanager
+    async def write_connection(self):
+        """Соединение для записи из пула"""
+        async with self._get_pool().writer() as db:
+            yield db
+    
+    @asynccontextmanager
+    async def read_connection(self):
+        """Соединение для чтения из пула"""
+        async with self._get_pool().reader() as db:
+            yield db
+    
+    async def close(self):
+        """Закрыть пул соединений при остановке"""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
         
     async def init_db(self):
         """Инициализация базы данных и создание таблиц"""
@@ -31,7 +337,7 @@ class Database:
         
         for attempt in range(max_retries):
             try:
-                async with aiosqlite.connect(self.db_path, timeout=10) as db:
+                async with self.write_connection() as db:
                     # Таблица пользователей
                     await db.execute("""
                         CREATE TABLE IF NOT EXISTS users (
@@ -60,6 +366,8 @@ class Database:
                             channel_message_id INTEGER,
                             channel_chat_id INTEGER,
                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            end_ts INTEGER,      -- окончание, мс Unix (UTC)
+                            created_ts INTEGER,  -- создание, мс Unix (UTC)
                             FOREIGN KEY (owner_id) REFERENCES users (user_id)
                         )
                     """)
@@ -96,7 +404,7 @@ class Database:
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                             user_id INTEGER NOT NULL,
                             amount INTEGER NOT NULL,
-                            transaction_type TEXT NOT NULL, -- purchase, admin_grant, auction_created
+                            transaction_type TEXT NOT NULL, -- purchase, admin_grant, auction_created, auction_refund, yoomoney_payment
                             description TEXT,
                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                             FOREIGN KEY (user_id) REFERENCES users (user_id)
@@ -113,6 +421,43 @@ class Database:
                             processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                         )
                     """)
+                    
+                    # Очередь исходящих публикаций в канал (outbox): задание ставится в той же
+                    # транзакции, что и списание баланса, и выполняется диспетчером (outbox.py)
+                    await db.execute("""
+                        CREATE TABLE IF NOT EXISTS outbox (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            kind TEXT NOT NULL, -- publish_auction, publish_buy_post
+                            auction_id INTEGER,
+                            user_id INTEGER,
+                            payload TEXT NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'pending', -- pending, done, failed
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            next_attempt_ts INTEGER NOT NULL,
+                            last_error TEXT,
+                            result TEXT,
+                            created_ts INTEGER NOT NULL,
+                            updated_ts INTEGER
+                        )
+                    """)
+                    
+                    # Принятые уведомления YooMoney: webhook только сохраняет их,
+                    # зачисление и уведомление пользователя выполняет очередь платежей (payment_queue.py)
+                    await db.execute("""
+                        CREATE TABLE IF NOT EXISTS payment_notifications (
+                            operation_id TEXT PRIMARY KEY,
+                            payload TEXT NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'pending', -- pending, credited, done, rejected
+                            user_id INTEGER,
+                            publications INTEGER,
+                            last_error TEXT,
+                            received_ts INTEGER NOT NULL,
+                            updated_ts INTEGER
+                        )
+                    """)
+                    
+                    await self._migrate_timestamps(db)
+                    await self._apply_schema_indexes(db)
             
                     await db.commit()
                     logging.info("Database initialized successfully")
@@ -128,53 +473,123 @@ class Database:
                     logging.error(f"Failed to initialize database after {max_retries} attempts")
                     raise
 
-    async def get_or_create_user(self, user_id: int, username: str = None, full_name: str = None) -> Dict:
+    async def _migrate_timestamps(self, db: aiosqlite.Connection):
+        """
+        Перевод времени аукционов в целые мс Unix (UTC): добавить колонки end_ts/created_ts
+        и заполнить их небольшими пачками, не блокируя запись надолго.
+        end_time хранился как московское время без пояса, created_at - как UTC (CURRENT_TIMESTAMP).
+        """
+        cursor = await db.execute("PRAGMA table_info(auctions)")
+        columns = {row[1] for row in await cursor.fetchall()}
+        for column in ('end_ts', 'created_ts'):
+            if column not in columns:
+                await db.execute(f"ALTER TABLE auctions ADD COLUMN {column} INTEGER")
+        await db.commit()
+        
+        migrated = 0
+        unparsed = []
+        last_id = 0
+        while True:
+            cursor = await db.execute(
+                """SELECT id, end_time, created_at FROM auctions
+                   WHERE (end_ts IS NULL OR created_ts IS NULL) AND id > ? ORDER BY id LIMIT ?""",
+                (last_id, TIMESTAMP_BACKFILL_BATCH)
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for auction_id, end_time, created_at in rows:
+                end_time = _parse_legacy_time(end_time)
+                created_at = _parse_legacy_time(created_at)
+                if end_time is None:
+                    # Неизвестное окончание не подменяем текущим временем (лот закрылся бы сразу):
+                    # end_ts остается NULL, планировщик такой лот не закрывает, ставки не принимаются
+                    unparsed.append(auction_id)
+                if created_at is not None and created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                end_ts = to_epoch_ms(end_time) if end_time is not None else None
+                updates.append((
+                    end_ts,
+                    round(created_at.timestamp() * 1000) if created_at is not None else end_ts,
+                    auction_id
+                ))
+            await db.executemany("UPDATE auctions SET end_ts = ?, created_ts = ? WHERE id = ?", updates)
+            await db.commit()
+            migrated += len(updates)
+        if migrated:
+            logging.info(f"Auction timestamps migrated to epoch ms: {migrated} rows")
+        if unparsed:
+            logging.warning(f"Auctions with unparseable end_time left without end_ts: {unparsed}")
+
+    async def _apply_schema_indexes(self, db: aiosqlite.Connection):
+        """Создать индексы из SCHEMA_INDEXES, которых еще нет в базе"""
+        cursor = await db.execute("PRAGMA user_version")
+        current_version = (await cursor.fetchone())[0]
+        
+        for version in sorted(SCHEMA_INDEXES):
+            if version <= current_version:
+                continue
+            for statement in SCHEMA_INDEXES[version]:
+                await db.execute(statement)
+            logging.info(f"Schema indexes upgraded to version {version}")
+        
+        if current_version < SCHEMA_VERSION:
+            await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            await db.execute("ANALYZE")
+
+    async def get_or_create_user(self, user_id: int, username: str = None, full_name: str = None) -> User:
         """Получить или создать пользователя"""
         # Импортируем конфигурацию для проверки администраторов
         from config import ADMIN_USER_IDS
         
-        async with aiosqlite.connect(self.db_path) as db:
+        cached = self._users.get(user_id)
+        if cached is not None:
+            self.user_cache_stats['hits'] += 1
+            self._users.move_to_end(user_id)
+            return cached
+        self.user_cache_stats['misses'] += 1
+        
+        writes = self._user_writes
+        async with self.read_connection() as db:
             # Проверяем существование пользователя
-            cursor = await db.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
+            user = await fetch_record(db, User, "SELECT * FROM users WHERE user_id = ?", (user_id,))
+        
+        if user:
+            # Проверяем, является ли пользователь администратором из конфигурации
+            if not user['is_admin'] and user_id in ADMIN_USER_IDS:
+                user = user.replace(is_admin=True)
+            if writes == self._user_writes:
+                self._cache_user(user)
+            return user
+        
+        # Проверяем, является ли пользователь администратором из конфигурации
+        is_admin = user_id in ADMIN_USER_IDS
+        
+        # Создаем нового пользователя
+        async with self.write_connection() as db:
+            await db.execute(
+                "INSERT OR IGNORE INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
+                (user_id, username, full_name, 0, is_admin)
             )
-            user = await cursor.fetchone()
-            
-            if user:
-                # Проверяем, является ли пользователь администратором из конфигурации
-                is_admin = bool(user[5]) or user_id in ADMIN_USER_IDS
-                return {
-                    'user_id': user[0],
-                    'username': user[1],
-                    'full_name': user[2],
-                    'balance': user[3],
-                    'created_at': user[4],
-                    'is_admin': is_admin
-                }
-            else:
-                # Проверяем, является ли пользователь администратором из конфигурации
-                is_admin = user_id in ADMIN_USER_IDS
-                
-                # Создаем нового пользователя
-                await db.execute(
-                    "INSERT INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, username, full_name, 0, is_admin)
-                )
-                await db.commit()
-                
-                return {
-                    'user_id': user_id,
-                    'username': username,
-                    'full_name': full_name,
-                    'balance': 0,
-                    'created_at': datetime.now(),
-                    'is_admin': is_admin
-                }
+            await db.commit()
+        
+        # Параллельный вызов мог уже создать пользователя - в кеш его не кладем, прочитаем при следующем промахе
+        self.invalidate_user(user_id)
+        return User(
+            user_id=user_id,
+            username=username,
+            full_name=full_name,
+            balance=0,
+            created_at=datetime.now(),
+            is_admin=is_admin
+        )
 
     async def update_user_balance(self, user_id: int, amount: int, transaction_type: str, description: str = None) -> bool:
         """Обновить баланс пользователя и записать транзакцию"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.write_connection() as db:
                 # Проверяем, существует ли пользователь
                 cursor = await db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
                 if not await cursor.fetchone():
@@ -185,10 +600,11 @@ class Database:
                     )
                 
                 # Обновляем баланс
-                await db.execute(
-                    "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                cursor = await db.execute(
+                    "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
                     (amount, user_id)
                 )
+                (balance,) = await cursor.fetchone()
                 
                 # Записываем транзакцию
                 await db.execute(
@@ -197,6 +613,7 @@ class Database:
                 )
                 
                 await db.commit()
+                self._update_cached_user(user_id, balance=balance)
                 return True
         except Exception as e:
             logging.error(f"Error updating user balance: {e}")
@@ -205,14 +622,17 @@ class Database:
     async def create_auction(self, owner_id: int, description: str, start_price: int, 
                            blitz_price: int, end_time: datetime, media_files: List[Dict]) -> int:
         """Создать новый аукцион"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.write_connection() as db:
             # Создаем аукцион
-            cursor = await db.execute(
+            auction = await fetch_record(
+                db, Auction,
                 """INSERT INTO auctions (owner_id, description, start_price, blitz_price, 
-                   current_price, end_time) VALUES (?, ?, ?, ?, ?, ?)""",
-                (owner_id, description, start_price, blitz_price, start_price, end_time)
+                   current_price, end_time, end_ts, created_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   RETURNING *""",
+                (owner_id, description, start_price, blitz_price, start_price, end_time,
+                 to_epoch_ms(end_time), now_ms())
             )
-            auction_id = cursor.lastrowid
+            auction_id = auction['id']
             
             # Добавляем медиа файлы
             for i, media in enumerate(media_files):
@@ -222,15 +642,15 @@ class Database:
                 )
             
             await db.commit()
-            return auction_id
+        
+        media = tuple({'file_id': media['file_id'], 'type': media['type']} for media in media_files)
+        self._emit_change('auction', auction_id, auction=auction.replace(media=media).to_dict())
+        return auction_id
 
-    async def get_auction(self, auction_id: int) -> Optional[Dict]:
+    async def get_auction(self, auction_id: int) -> Optional[Auction]:
         """Получить аукцион по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "SELECT * FROM auctions WHERE id = ?", (auction_id,)
-            )
-            auction = await cursor.fetchone()
+        async with self.read_connection() as db:
+            auction = await fetch_record(db, Auction, "SELECT * FROM auctions WHERE id = ?", (auction_id,))
             
             if not auction:
                 return None
@@ -242,301 +662,173 @@ class Database:
             )
             media = await cursor.fetchall()
             
-            # Преобразуем строки дат в datetime объекты
-            end_time = auction[8]
-            if isinstance(end_time, str):
-                try:
-                    end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                except ValueError:
-                    end_time = datetime.now()  # Fallback
-            
-            created_at = auction[12]
-            if isinstance(created_at, str):
-                try:
-                    created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                except ValueError:
-                    created_at = datetime.now()  # Fallback
-            
-            return {
-                'id': auction[0],
-                'owner_id': auction[1],
-                'description': auction[2],
-                'start_price': auction[3],
-                'blitz_price': auction[4],
-                'current_price': auction[5],
-                'current_leader_id': auction[6],
-                'current_leader_username': auction[7],
-                'end_time': end_time,
-                'status': auction[9],
-                'channel_message_id': auction[10],
-                'channel_chat_id': auction[11],
-                'created_at': created_at,
-                'media': [{'file_id': m[0], 'type': m[1]} for m in media]
-            }
-
-    async def get_user_auctions(self, user_id: int, status: str = None) -> List[Dict]:
+            return auction.replace(media=tuple({'file_id': m[0], 'type': m[1]} for m in media))
+
+    async def get_user_auctions(self, user_id: int, status: str = None) -> List[Auction]:
         """Получить аукционы пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read_connection() as db:
             if status == 'active':
                 # Для активных аукционов дополнительно проверяем, что время не истекло
-                cursor = await db.execute(
-                    "SELECT * FROM auctions WHERE owner_id = ? AND status = ? AND end_time > ? ORDER BY created_at DESC",
-                    (user_id, status, datetime.now())
+                auctions = await fetch_records(
+                    db, Auction,
+                    "SELECT * FROM auctions WHERE owner_id = ? AND status = ? AND end_ts > ? ORDER BY created_ts DESC",
+                    (user_id, status, now_ms())
                 )
             elif status:
-                cursor = await db.execute(
-                    "SELECT * FROM auctions WHERE owner_id = ? AND status = ? ORDER BY created_at DESC",
+                auctions = await fetch_records(
+                    db, Auction,
+                    "SELECT * FROM auctions WHERE owner_id = ? AND status = ? ORDER BY created_ts DESC",
                     (user_id, status)
                 )
             else:
-                cursor = await db.execute(
-                    "SELECT * FROM auctions WHERE owner_id = ? ORDER BY created_at DESC",
+                auctions = await fetch_records(
+                    db, Auction,
+                    "SELECT * FROM auctions WHERE owner_id = ? ORDER BY created_ts DESC",
                     (user_id,)
                 )
             
-            auctions = await cursor.fetchall()
-            result = []
-            
-            for auction in auctions:
-                # Получаем медиа для каждого аукциона
-                cursor = await db.execute(
-                    "SELECT file_id, media_type, order_index FROM auction_media WHERE auction_id = ? ORDER BY order_index",
-                    (auction[0],)
-                )
-                media = await cursor.fetchall()
-                
-                # Преобразуем строки дат в datetime объекты
-                end_time = auction[8]
-                if isinstance(end_time, str):
-                    try:
-                        end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                    except ValueError:
-                        end_time = datetime.now()  # Fallback
-                
-                created_at = auction[12]
-                if isinstance(created_at, str):
-                    try:
-                        created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                    except ValueError:
-                        created_at = datetime.now()  # Fallback
-                
-                result.append({
-                    'id': auction[0],
-                    'owner_id': auction[1],
-                    'description': auction[2],
-                    'start_price': auction[3],
-                    'blitz_price': auction[4],
-                    'current_price': auction[5],
-                    'current_leader_id': auction[6],
-                    'current_leader_username': auction[7],
-                    'end_time': end_time,
-                    'status': auction[9],
-                    'channel_message_id': auction[10],
-                    'channel_chat_id': auction[11],
-                    'created_at': created_at,
-                    'media': [{'file_id': m[0], 'type': m[1]} for m in media]
-                })
-            
-            return result
+            # Медиа всех аукционов - одним запросом, а не по запросу на аукцион
+            media = await self._fetch_media(db, [auction['id'] for auction in auctions])
+            return [auction.replace(media=tuple(media[auction['id']])) for auction in auctions]
 
     async def get_truly_active_auctions_count(self, user_id: int = None) -> int:
         """Получить количество действительно активных аукционов (не истекших по времени)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read_connection() as db:
             if user_id:
                 cursor = await db.execute(
-                    "SELECT COUNT(*) FROM auctions WHERE owner_id = ? AND status = 'active' AND end_time > ?",
-                    (user_id, datetime.now())
+                    "SELECT COUNT(*) FROM auctions WHERE owner_id = ? AND status = 'active' AND end_ts > ?",
+                    (user_id, now_ms())
                 )
             else:
                 cursor = await db.execute(
-                    "SELECT COUNT(*) FROM auctions WHERE status = 'active' AND end_time > ?",
-                    (datetime.now(),)
+                    "SELECT COUNT(*) FROM auctions WHERE status = 'active' AND end_ts > ?",
+                    (now_ms(),)
                 )
             result = await cursor.fetchone()
             return result[0] if result else 0
 
     async def update_auction_status(self, auction_id: int, status: str):
         """Обновить статус аукциона"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.write_connection() as db:
             await db.execute(
                 "UPDATE auctions SET status = ? WHERE id = ?",
                 (status, auction_id)
             )
             await db.commit()
+        self._update_indexed_auction(auction_id, status=status)
+        self._emit_change('status', auction_id, status=status)
 
-    async def place_bid(self, auction_id: int, bidder_id: int, bidder_username: str, amount: int) -> bool:
-        """Сделать ставку"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем, что аукцион активен
-            cursor = await db.execute(
-                "SELECT status, current_price, blitz_price FROM auctions WHERE id = ?",
-                (auction_id,)
-            )
-            auction = await cursor.fetchone()
-            
-            if not auction or auction[0] != 'active':
-                return False
-                
-            current_price = auction[1]
-            blitz_price = auction[2]
-            
-            # Проверяем, что ставка больше текущей
-            if amount <= current_price:
-                return False
-                
-            # Проверяем, что не превышаем блиц-цену
-            if blitz_price and amount >= blitz_price:
-                amount = blitz_price
-            
-            # Обновляем аукцион
-            await db.execute(
-                """UPDATE auctions SET current_price = ?, current_leader_id = ?, 
-                   current_leader_username = ? WHERE id = ?""",
-                (amount, bidder_id, bidder_username, auction_id)
-            )
-            
-            # Записываем ставку
-            await db.execute(
-                "INSERT INTO bids (auction_id, bidder_id, bidder_username, amount) VALUES (?, ?, ?, ?)",
-                (auction_id, bidder_id, bidder_username, amount)
-            )
-            
-            await db.commit()
-            return True
+    async def apply_bid_batch(self, auction_id: int, expected_price: int, bids: List[Dict],
+                              current_price: int, leader_id: Optional[int],
+                              leader_username: Optional[str], status: str) -> bool:
+        """
+        Групповой коммит пачки ставок от актора аукциона (bid_engine).
+        Итоговое состояние пишется одним UPDATE, только если цена в базе все еще
+        равна expected_price, а аукцион активен. Возвращает False, если лот изменили в обход актора.
+        """
+        async with self.write_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    """UPDATE auctions SET current_price = ?, current_leader_id = ?,
+                           current_leader_username = ?, status = ?
+                       WHERE id = ? AND status = 'active' AND current_price = ?
+                       RETURNING id""",
+                    (current_price, leader_id, leader_username, status, auction_id, expected_price)
+                )
+                if await cursor.fetchone() is None:
+                    # Лот изменили в обход актора - снимок в индексе тоже устарел
+                    await self._refresh_indexed_auction(db, auction_id)
+                    await db.rollback()
+                    return False
 
-    async def get_expired_auctions(self) -> List[Dict]:
+                if bids:
+                    await db.executemany(
+                        "INSERT INTO bids (auction_id, bidder_id, bidder_username, amount) VALUES (?, ?, ?, ?)",
+                        [(auction_id, bid['bidder_id'], bid['bidder_username'], bid['amount']) for bid in bids]
+                    )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+        self._update_indexed_auction(auction_id, current_price=current_price, current_leader_id=leader_id,
+                                     current_leader_username=leader_username, status=status)
+        for bid in bids:
+            self._emit_bid(auction_id, bid['bidder_id'], bid['bidder_username'], bid['amount'])
+        if status != 'active':
+            self._emit_change('status', auction_id, status=status)
+        return True
+
+    async def get_expired_auctions(self) -> List[Auction]:
         """Получить истекшие аукционы"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "SELECT * FROM auctions WHERE status = 'active' AND end_time < ?",
-                (datetime.now(),)
+        async with self.read_connection() as db:
+            return await fetch_records(
+                db, Auction,
+                "SELECT * FROM auctions WHERE status = 'active' AND end_ts < ?",
+                (now_ms(),)
             )
-            auctions = await cursor.fetchall()
-            
-            result = []
-            for auction in auctions:
-                # Преобразуем строку даты в datetime объект
-                end_time = auction[8]
-                if isinstance(end_time, str):
-                    try:
-                        end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                    except ValueError:
-                        end_time = datetime.now()  # Fallback
-                
-                created_at = auction[12]
-                if isinstance(created_at, str):
-                    try:
-                        created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                    except ValueError:
-                        created_at = datetime.now()  # Fallback
-                
-                result.append({
-                    'id': auction[0],
-                    'owner_id': auction[1],
-                    'description': auction[2],
-                    'start_price': auction[3],
-                    'blitz_price': auction[4],
-                    'current_price': auction[5],
-                    'current_leader_id': auction[6],
-                    'current_leader_username': auction[7],
-                    'end_time': end_time,
-                    'status': auction[9],
-                    'channel_message_id': auction[10],
-                    'channel_chat_id': auction[11],
-                    'created_at': created_at
-                })
-            
-            return result
 
     async def set_auction_channel_info(self, auction_id: int, channel_chat_id: int, channel_message_id: int):
         """Установить информацию о сообщении в канале"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE auctions SET channel_chat_id = ?, channel_message_id = ? WHERE id = ?",
+        async with self.write_connection() as db:
+            auction = await fetch_record(
+                db, Auction,
+                "UPDATE auctions SET channel_chat_id = ?, channel_message_id = ? WHERE id = ? RETURNING *",
                 (channel_chat_id, channel_message_id, auction_id)
             )
             await db.commit()
+        if auction:
+            self._index_auction(auction)
+            self._emit_change('channel_message', auction_id, channel_chat_id=channel_chat_id,
+                              channel_message_id=channel_message_id)
 
     async def update_auction_channel_message(self, auction_id: int, channel_message_id: int, channel_chat_id: int):
         """Обновить информацию о сообщении в канале"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE auctions SET channel_message_id = ?, channel_chat_id = ? WHERE id = ?",
-                (channel_message_id, channel_chat_id, auction_id)
-            )
-            await db.commit()
+        await self.set_auction_channel_info(auction_id, channel_chat_id, channel_message_id)
 
-    async def get_auction_by_channel_message(self, chat_id: int, message_id: int) -> Optional[Dict]:
+    async def get_auction_by_channel_message(self, chat_id: int, message_id: int) -> Optional[Auction]:
         """Получить аукцион по сообщению в канале"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        # Активные лоты отдаются из индекса без обращения к базе
+        snapshot = self._channel_index.get((chat_id, message_id))
+        if snapshot is not None:
+            return snapshot
+        
+        writes = self._auction_writes
+        async with self.read_connection() as db:
+            auction = await fetch_record(
+                db, Auction,
                 "SELECT * FROM auctions WHERE channel_chat_id = ? AND channel_message_id = ?",
                 (chat_id, message_id)
             )
-            auction = await cursor.fetchone()
-            
-            if not auction:
-                return None
-                
-            # Преобразуем строки дат в datetime объекты
-            end_time = auction[8]
-            if isinstance(end_time, str):
-                try:
-                    end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                except ValueError:
-                    end_time = datetime.now()  # Fallback
             
-            created_at = auction[12]
-            if isinstance(created_at, str):
-                try:
-                    created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                except ValueError:
-                    created_at = datetime.now()  # Fallback
-            
-            return {
-                'id': auction[0],
-                'owner_id': auction[1],
-                'description': auction[2],
-                'start_price': auction[3],
-                'blitz_price': auction[4],
-                'current_price': auction[5],
-                'current_leader_id': auction[6],
-                'current_leader_username': auction[7],
-                'end_time': end_time,
-                'status': auction[9],
-                'channel_message_id': auction[10],
-                'channel_chat_id': auction[11],
-                'created_at': created_at
-            }
-
-    async def get_bidding_history(self, auction_id: int) -> List[Dict]:
+        if not auction:
+            return None
+        
+        # Пока шло чтение, лот могли изменить - тогда прочитанный снимок в индекс не кладем
+        if writes == self._auction_writes:
+            self._index_auction(auction)
+        return auction
+
+    async def get_bidding_history(self, auction_id: int) -> List[Bid]:
         """Получить историю ставок для аукциона"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        async with self.read_connection() as db:
+            return await fetch_records(
+                db, Bid,
                 """SELECT bidder_id, bidder_username, amount, created_at FROM bids 
                    WHERE auction_id = ? ORDER BY created_at DESC""",
                 (auction_id,)
             )
-            bids = await cursor.fetchall()
-            
-            return [
-                {
-                    'bidder_id': bid[0],
-                    'bidder_username': bid[1],
-                    'amount': bid[2],
-                    'created_at': bid[3]
-                }
-                for bid in bids
-            ]
 
     async def grant_admin_status(self, user_id: int):
         """Выдать права администратора"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.write_connection() as db:
             await db.execute(
                 "UPDATE users SET is_admin = TRUE WHERE user_id = ?",
                 (user_id,)
             )
             await db.commit()
+        self._update_cached_user(user_id, is_admin=True)
 
     async def get_user_balance(self, user_id: int) -> int:
         """Получить баланс пользователя"""
@@ -545,18 +837,13 @@ class Database:
         if user['is_admin']:
             return 999999  # Неограниченный баланс для админов
         
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "SELECT balance FROM users WHERE user_id = ?",
-                (user_id,)
-            )
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        # Баланс в записи пользователя актуален: все изменения users проходят через кеш
+        return user['balance']
 
     async def update_user_balance_transactional(self, user_id: int, amount: int, transaction_type: str, description: str = None, auction_id: int = None) -> bool:
         """Обновить баланс пользователя с транзакционной безопасностью"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self.write_connection() as db:
                 # Начинаем транзакцию
                 await db.execute("BEGIN TRANSACTION")
                 
@@ -582,10 +869,11 @@ class Database:
                         return False
                     
                     # Обновляем баланс
-                    await db.execute(
-                        "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                    cursor = await db.execute(
+                        "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
                         (amount, user_id)
                     )
+                    (balance,) = await cursor.fetchone()
                     
                     # Записываем транзакцию
                     await db.execute(
@@ -595,7 +883,8 @@ class Database:
                     
                     # Подтверждаем транзакцию
                     await db.execute("COMMIT")
-                    logging.info(f"Успешно обновлен баланс пользователя {user_id} на {amount}. Новый баланс: {current_balance + amount}")
+                    self._update_cached_user(user_id, balance=balance)
+                    logging.info(f"Успешно обновлен баланс пользователя {user_id} на {amount}. Новый баланс: {balance}")
                     return True
                     
                 except Exception as e:
@@ -608,9 +897,300 @@ class Database:
             logging.error(f"Ошибка при обновлении баланса пользователя: {e}")
             return False
 
+    async def rollback_auction_balance(self, auction_id: int, user_id: int) -> bool:
+        """
+        Вернуть публикацию за лот, который не удалось опубликовать в канале.
+        Лот закрывается как 'cancelled' в той же транзакции, поэтому повторный вызов
+        (или вызов для уже опубликованного лота) баланс не меняет и возвращает False.
+        """
+        try:
+            async with self.write_connection() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    cursor = await db.execute(
+                        """UPDATE auctions SET status = 'cancelled'
+                           WHERE id = ? AND owner_id = ? AND status = 'active' AND channel_message_id IS NULL
+                           RETURNING id""",
+                        (auction_id, user_id)
+                    )
+                    if await cursor.fetchone() is None:
+                        await db.rollback()
+                        return False
+                    
+                    cursor = await db.execute(
+                        "UPDATE users SET balance = balance + 1 WHERE user_id = ? RETURNING balance",
+                        (user_id,)
+                    )
+                    row = await cursor.fetchone()
+                    await db.execute(
+                        "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
+                        (user_id, 1, "auction_refund", f"Возврат публикации за аукцион #{auction_id}")
+                    )
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+        except Exception as e:
+            logging.error(f"Error rolling back balance for auction {auction_id}: {e}")
+            return False
+        
+        if row is not None:
+            self._update_cached_user(user_id, balance=row[0])
+        self._update_indexed_auction(auction_id, status='cancelled')
+        self._emit_change('status', auction_id, status='cancelled')
+        logging.info(f"Публикация за аукцион #{auction_id} возвращена пользователю {user_id}")
+        return True
+
+    async def enqueue_auction_publish(self, auction_id: int, user_id: int, charge: bool = True) -> Optional[int]:
+        """
+        Списать публикацию и поставить лот в очередь публикации одной транзакцией.
+        Возвращает id задания; None - лот уже опубликован или в очереди либо не хватает публикаций.
+        """
+        balance = None
+        async with self.write_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    """SELECT 1 FROM auctions
+                       WHERE id = ? AND owner_id = ? AND status = 'active' AND channel_message_id IS NULL
+                         AND NOT EXISTS (SELECT 1 FROM outbox WHERE auction_id = auctions.id
+                                         AND kind = 'publish_auction' AND status != 'failed')""",
+                    (auction_id, user_id)
+                )
+                if await cursor.fetchone() is None:
+                    await db.rollback()
+                    return None
+                
+                if charge:
+                    cursor = await db.execute(
+                        "UPDATE users SET balance = balance - 1 WHERE user_id = ? AND balance >= 1 RETURNING balance",
+                        (user_id,)
+                    )
+                    row = await cursor.fetchone()
+                    if row is None:
+                        await db.rollback()
+                        return None
+                    balance = row[0]
+                    await db.execute(
+                        "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
+                        (user_id, -1, "auction_created", "Создание аукциона")
+                    )
+                
+                job_id = await self._insert_outbox(db, 'publish_auction', {'charged': charge}, auction_id, user_id)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        
+        if balance is not None:
+            self._update_cached_user(user_id, balance=balance)
+        return job_id
+
+    async def enqueue_outbox(self, kind: str, payload: Dict, auction_id: int = None, user_id: int = None) -> int:
+        """Поставить задание в outbox"""
+        async with self.write_connection() as db:
+            job_id = await self._insert_outbox(db, kind, payload, auction_id, user_id)
+            await db.commit()
+        return job_id
+
+    @staticmethod
+    async def _insert_outbox(db: aiosqlite.Connection, kind: str, payload: Dict,
+                             auction_id: Optional[int], user_id: Optional[int]) -> int:
+        timestamp = now_ms()
+        cursor = await db.execute(
+            """INSERT INTO outbox (kind, auction_id, user_id, payload, next_attempt_ts, created_ts)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (kind, auction_id, user_id, json.dumps(payload, ensure_ascii=False), timestamp, timestamp)
+        )
+        return cursor.lastrowid
+
+    async def get_due_outbox(self, limit: int = 20) -> List[OutboxJob]:
+        """Задания outbox, время которых наступило (в порядке постановки)"""
+        async with self.read_connection() as db:
+            return await fetch_records(
+                db, OutboxJob,
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_ts <= ? ORDER BY id LIMIT ?",
+                (now_ms(), limit)
+            )
+
+    async def get_next_outbox_ts(self) -> Optional[int]:
+        """Время (мс Unix) ближайшего отложенного задания outbox"""
+        async with self.read_connection() as db:
+            cursor = await db.execute("SELECT MIN(next_attempt_ts) FROM outbox WHERE status = 'pending'")
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def complete_outbox(self, job_id: int, result: Optional[Dict] = None):
+        """
+        Отметить задание выполненным и сохранить id сообщений. Для публикации лота
+        сообщение в канале записывается в аукцион той же транзакцией.
+        """
+        result = result or {}
+        auction = None
+        async with self.write_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    "UPDATE outbox SET status = 'done', result = ?, updated_ts = ? WHERE id = ? RETURNING kind, auction_id",
+                    (json.dumps(result), now_ms(), job_id)
+                )
+                row = await cursor.fetchone()
+                if row is not None and row[0] == 'publish_auction' and result.get('channel_message_id'):
+                    auction = await fetch_record(
+                        db, Auction,
+                        "UPDATE auctions SET channel_chat_id = ?, channel_message_id = ? WHERE id = ? RETURNING *",
+                        (result['channel_chat_id'], result['channel_message_id'], row[1])
+                    )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        if auction:
+            self._index_auction(auction)
+            self._emit_change('channel_message', auction['id'], channel_chat_id=auction['channel_chat_id'],
+                              channel_message_id=auction['channel_message_id'])
+
+    async def save_outbox_progress(self, job_id: int, result: Dict):
+        """Сохранить уже отправленные заданием сообщения: повтор задания их не дублирует"""
+        async with self.write_connection() as db:
+            await db.execute(
+                "UPDATE outbox SET result = ?, updated_ts = ? WHERE id = ? AND status = 'pending'",
+                (json.dumps(result), now_ms(), job_id)
+            )
+            await db.commit()
+
+    async def retry_outbox(self, job_id: int, delay: float, error: str, count_attempt: bool = True):
+        """Отложить задание на delay секунд"""
+        async with self.write_connection() as db:
+            await db.execute(
+                """UPDATE outbox SET attempts = attempts + ?, next_attempt_ts = ?, last_error = ?, updated_ts = ?
+                   WHERE id = ?""",
+                (1 if count_attempt else 0, now_ms() + int(delay * 1000), error, now_ms(), job_id)
+            )
+            await db.commit()
+
+    async def fail_outbox(self, job_id: int, error: str):
+        """Отметить задание окончательно невыполненным"""
+        async with self.write_connection() as db:
+            await db.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ?, updated_ts = ? WHERE id = ?",
+                (error, now_ms(), job_id)
+            )
+            await db.commit()
+
+    async def get_outbox_stats(self) -> Dict[str, int]:
+        """Число заданий outbox по статусам"""
+        async with self.read_connection() as db:
+            cursor = await db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+            return dict(await cursor.fetchall())
+
+    async def record_payment_notification(self, operation_id: str, payload: Dict) -> bool:
+        """Сохранить уведомление о платеже. False - уведомление с этим operation_id уже принято"""
+        async with self.write_connection() as db:
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO payment_notifications (operation_id, payload, received_ts) VALUES (?, ?, ?)",
+                (operation_id, json.dumps(payload, ensure_ascii=False), now_ms())
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def get_payment_notification(self, operation_id: str) -> Optional[Dict]:
+        """Уведомление о платеже с разобранными данными формы"""
+        async with self.read_connection() as db:
+            cursor = await db.execute(
+                "SELECT operation_id, payload, status, user_id, publications FROM payment_notifications WHERE operation_id = ?",
+                (operation_id,)
+            )
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return {'operation_id': row[0], 'payload': json.loads(row[1]), 'status': row[2],
+                'user_id': row[3], 'publications': row[4]}
+
+    async def get_unfinished_payment_notifications(self) -> List[str]:
+        """operation_id уведомлений, которые еще не зачислены или пользователь не уведомлен"""
+        async with self.read_connection() as db:
+            cursor = await db.execute(
+                """SELECT operation_id FROM payment_notifications
+                   WHERE status IN ('pending', 'credited') ORDER BY received_ts"""
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def credit_payment(self, operation_id: str, user_id: int, amount: float,
+                             publications: int, description: str) -> Optional[int]:
+        """
+        Зачислить публикации по платежу одной транзакцией: запись в processed_payments,
+        баланс, транзакция и статус уведомления 'credited'. Возвращает новый баланс;
+        None - платеж с этим operation_id уже был зачислен (баланс не меняется).
+        """
+        async with self.write_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    "INSERT OR IGNORE INTO processed_payments (operation_id, user_id, amount, publications) VALUES (?, ?, ?, ?)",
+                    (operation_id, user_id, amount, publications)
+                )
+                if cursor.rowcount == 0:
+                    balance = None
+                else:
+                    await db.execute(
+                        "INSERT OR IGNORE INTO users (user_id, username, full_name, balance, is_admin) VALUES (?, ?, ?, ?, ?)",
+                        (user_id, None, None, 0, False)
+                    )
+                    cursor = await db.execute(
+                        "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
+                        (publications, user_id)
+                    )
+                    balance = (await cursor.fetchone())[0]
+                    await db.execute(
+                        "INSERT INTO transactions (user_id, amount, transaction_type, description) VALUES (?, ?, ?, ?)",
+                        (user_id, publications, "yoomoney_payment", description)
+                    )
+                await db.execute(
+                    """UPDATE payment_notifications SET status = 'credited', user_id = ?, publications = ?, updated_ts = ?
+                       WHERE operation_id = ? AND status = 'pending'""",
+                    (user_id, publications, now_ms(), operation_id)
+                )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        if balance is not None:
+            self._update_cached_user(user_id, balance=balance)
+        return balance
+
+    async def finish_payment_notification(self, operation_id: str, status: str = 'done', error: Optional[str] = None):
+        """Отметить уведомление о платеже обработанным (done) или отклоненным (rejected)"""
+        async with self.write_connection() as db:
+            await db.execute(
+                "UPDATE payment_notifications SET status = ?, last_error = ?, updated_ts = ? WHERE operation_id = ?",
+                (status, error, now_ms(), operation_id)
+            )
+            await db.commit()
+
+    async def get_processed_payments(self, limit: int = 10) -> List[tuple]:
+        """Последние зачисленные платежи: (operation_id, user_id, amount, publications, processed_at)"""
+        async with self.read_connection() as db:
+            cursor = await db.execute(
+                """SELECT operation_id, user_id, amount, publications, processed_at
+                   FROM processed_payments ORDER BY processed_at DESC LIMIT ?""",
+                (limit,)
+            )
+            return await cursor.fetchall()
+
+    async def get_processed_payment(self, operation_id: str) -> Optional[tuple]:
+        """Зачисленный платеж по operation_id (None - платеж не зачислялся)"""
+        async with self.read_connection() as db:
+            cursor = await db.execute(
+                """SELECT operation_id, user_id, amount, publications, processed_at
+                   FROM processed_payments WHERE operation_id = ?""",
+                (operation_id,)
+            )
+            return await cursor.fetchone()
+
     async def has_recent_payment(self, user_id: int, minutes: int = 10) -> bool:
         """Проверить, был ли недавний платеж пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read_connection() as db:
             cursor = await db.execute(
                 """SELECT COUNT(*) FROM transactions 
                    WHERE user_id = ? AND transaction_type = 'purchase' 
@@ -624,63 +1204,164 @@ class Database:
 
     async def get_total_auctions(self) -> int:
         """Получить общее количество аукционов"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read_connection() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM auctions")
             result = await cursor.fetchone()
             return result[0] if result else 0
 
-    async def get_active_auctions(self) -> List[Dict]:
+    async def get_active_auctions(self) -> List[Auction]:
         """Получить все активные аукционы"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read_connection() as db:
+            return await fetch_records(
+                db, Auction,
+                "SELECT * FROM auctions WHERE status = 'active' AND end_ts > ?",
+                (now_ms(),)
+            )
+
+    async def get_active_deadlines(self) -> List[Tuple[int, int]]:
+        """Дедлайны (мс Unix) всех активных аукционов, включая уже просроченные (для планировщика)"""
+        async with self.read_connection() as db:
+            cursor = await db.execute("SELECT id, end_ts FROM auctions WHERE status = 'active' AND end_ts IS NOT NULL")
+            return [tuple(row) for row in await cursor.fetchall()]
+
+    async def finalize_auctions(self, auction_ids: List[int]) -> List[Auction]:
+        """
+        Завершить пачку аукционов с наступившим дедлайном: с лидером - 'sold',
+        без ставок - 'expired'. Возвращает только реально закрытые этим вызовом аукционы.
+        """
+        if not auction_ids:
+            return []
+        auctions = []
+        async with self.write_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                # Все пачки - одной транзакцией
+                for chunk, placeholders in _id_chunks(list(auction_ids)):
+                    auctions.extend(await fetch_records(
+                        db, Auction,
+                        f"""UPDATE auctions SET
+                                status = CASE WHEN current_leader_id IS NULL THEN 'expired' ELSE 'sold' END
+                            WHERE id IN ({placeholders}) AND status = 'active'
+                            RETURNING *""",
+                        chunk
+                    ))
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        for auction in auctions:
+            self._unindex_auction(auction['id'])
+            self._emit_change('status', auction['id'], status=auction['status'])
+        return auctions
+
+    async def get_auction_statuses(self, auction_ids: List[int]) -> Dict[int, str]:
+        """Статусы нескольких аукционов (отсутствующих в базе в результате нет)"""
+        statuses = {}
+        async with self.read_connection() as db:
+            for chunk, placeholders in _id_chunks(list(auction_ids)):
+                cursor = await db.execute(f"SELECT id, status FROM auctions WHERE id IN ({placeholders})", chunk)
+                statuses.update(await cursor.fetchall())
+        return statuses
+
+    async def restore_bids(self, auction_bids: Dict[int, List[Dict]]) -> int:
+        """
+        Идемпотентно дописать ставки из снимка (старые первыми): ставки, которых нет в базе
+        (ключ - участник, сумма, время), вставляются одним executemany в одной транзакции.
+        Цена активного лота поднимается до последней восстановленной ставки, если она выше.
+        Возвращает число вставленных ставок.
+        """
+        auction_ids = list(auction_bids)
+        async with self.write_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                existing = set()
+                known_ids = set()
+                for chunk, placeholders in _id_chunks(auction_ids):
+                    cursor = await db.execute(f"SELECT id FROM auctions WHERE id IN ({placeholders})", chunk)
+                    known_ids.update(row[0] for row in await cursor.fetchall())
+                    cursor = await db.execute(
+                        f"SELECT auction_id, bidder_id, amount, created_at FROM bids WHERE auction_id IN ({placeholders})",
+                        chunk
+                    )
+                    existing.update(map(tuple, await cursor.fetchall()))
+                
+                missing = []
+                leaders = {}
+                for auction_id in auction_ids:
+                    if auction_id not in known_ids:
+                        continue
+                    for bid in auction_bids[auction_id]:
+                        key = (auction_id, bid['bidder_id'], bid['amount'], bid['created_at'])
+                        if key in existing:
+                            continue
+                        existing.add(key)
+                        missing.append(key[:2] + (bid['bidder_username'],) + key[2:])
+                        leaders[auction_id] = bid
+                
+                if missing:
+                    await db.executemany(
+                        "INSERT INTO bids (auction_id, bidder_id, bidder_username, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+                        missing
+                    )
+                    await db.executemany(
+                        """UPDATE auctions SET current_price = ?, current_leader_id = ?, current_leader_username = ?
+                           WHERE id = ? AND status = 'active' AND current_price < ?""",
+                        [(bid['amount'], bid['bidder_id'], bid['bidder_username'], auction_id, bid['amount'])
+                         for auction_id, bid in leaders.items()]
+                    )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        
+        # Снимки лотов с восстановленными ставками в индексе могли устареть
+        for auction_id in leaders:
+            self._unindex_auction(auction_id)
+        return len(missing)
+
+    async def get_media_for_auctions(self, auction_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Медиа файлы нескольких аукционов одним запросом"""
+        async with self.read_connection() as db:
+            return await self._fetch_media(db, auction_ids)
+
+    async def get_bids_for_auctions(self, auction_ids: List[int]) -> Dict[int, List[Bid]]:
+        """История ставок нескольких аукционов одним запросом (новые ставки первыми)"""
+        bids = {auction_id: [] for auction_id in auction_ids}
+        async with self.read_connection() as db:
+            for chunk, placeholders in _id_chunks(list(bids)):
+                cursor = await db.execute(
+                    f"""SELECT auction_id, bidder_id, bidder_username, amount, created_at FROM bids
+                        WHERE auction_id IN ({placeholders}) ORDER BY auction_id, created_at DESC""",
+                    chunk
+                )
+                for auction_id, bidder_id, bidder_username, amount, created_at in await cursor.fetchall():
+                    bids[auction_id].append(Bid(
+                        bidder_id=bidder_id, bidder_username=bidder_username, amount=amount, created_at=created_at
+                    ))
+        return bids
+
+    async def _fetch_media(self, db: aiosqlite.Connection, auction_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Медиа файлы аукционов на переданном соединении: запрос на каждые IN_QUERY_CHUNK id"""
+        media = {auction_id: [] for auction_id in auction_ids}
+        for chunk, placeholders in _id_chunks(list(media)):
             cursor = await db.execute(
-                "SELECT * FROM auctions WHERE status = 'active' AND end_time > ?",
-                (datetime.now(),)
+                f"""SELECT auction_id, file_id, media_type FROM auction_media
+                    WHERE auction_id IN ({placeholders}) ORDER BY auction_id, order_index""",
+                chunk
             )
-            auctions = await cursor.fetchall()
-            return [self._format_auction(auction) for auction in auctions]
+            for auction_id, file_id, media_type in await cursor.fetchall():
+                media[auction_id].append({'file_id': file_id, 'type': media_type})
+        return media
 
     async def get_total_users(self) -> int:
         """Получить общее количество пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read_connection() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM users")
             result = await cursor.fetchone()
             return result[0] if result else 0
 
-    async def get_all_users(self) -> List[Dict]:
+    async def get_all_users(self) -> List[User]:
         """Получить всех пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT * FROM users ORDER BY created_at DESC")
-            users = await cursor.fetchall()
-            return [
-                {
-                    'user_id': user[0],
-                    'username': user[1],
-                    'full_name': user[2],
-                    'balance': user[3],
-                    'created_at': user[4],
-                    'is_admin': bool(user[5])
-                }
-                for user in users
-            ]
-
-    def _format_auction(self, auction) -> Dict:
-        """Форматирует аукцион в словарь"""
-        from datetime import datetime
-        end_time = datetime.fromisoformat(auction[6]) if auction[6] else None
-        created_at = datetime.fromisoformat(auction[12]) if auction[12] else None
-        
-        return {
-            'id': auction[0],
-            'owner_id': auction[1],
-            'description': auction[2],
-            'start_price': auction[3],
-            'blitz_price': auction[4],
-            'current_price': auction[5],
-            'current_leader_id': auction[7],
-            'current_leader_username': auction[8],
-            'end_time': end_time,
-            'status': auction[9],
-            'channel_message_id': auction[10],
-            'channel_chat_id': auction[11],
-            'created_at': created_at
-        }
\ No newline at end of file
+        async with self.read_connection() as db:
+            return await fetch_records(db, User, "SELECT * FROM users ORDER BY created_at DESC")
+
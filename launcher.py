@@ -74,45 +74,10 @@ def start_webhook_server():
     """Запускает webhook сервер для Railway"""
     print("🌐 Запуск webhook сервера...")
     try:
-        # Инициализируем бота при запуске
-        print("🤖 Инициализация бота...")
-        import asyncio
-        import threading
-        
-        def init_bot_async():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                from bot import init_webhook_bot
-                loop.run_until_complete(init_webhook_bot())
-                print("✅ Бот инициализирован")
-            except Exception as e:
-                print(f"❌ Ошибка инициализации бота: {e}")
-            finally:
-                loop.close()
-        
-        # Запускаем инициализацию бота в отдельном потоке
-        bot_thread = threading.Thread(target=init_bot_async, daemon=True)
-        bot_thread.start()
-        
-        from bot import app
-        port = int(os.environ.get("PORT", 8080))
-        print(f"🌐 Запуск сервера на порту {port}")
-        # Используем gunicorn для production
-        import gunicorn.app.wsgiapp as wsgi
-        sys.argv = ['gunicorn', '--bind', f'0.0.0.0:{port}', '--workers', '1', '--timeout', '120', 'bot:app']
-        wsgi.run()
-    except ImportError as e:
-        # Если gunicorn не установлен, используем Flask
-        print(f"⚠️ Gunicorn не найден: {e}")
-        print("⚠️ Используем Flask (не рекомендуется для production)")
-        try:
-            from bot import app
-            port = int(os.environ.get("PORT", 8080))
-            app.run(host="0.0.0.0", port=port, debug=False)
-        except Exception as flask_error:
-            print(f"❌ Ошибка запуска Flask: {flask_error}")
-            sys.exit(1)
+        # Quart-приложение под hypercorn: бот инициализируется в before_serving того же цикла событий
+        from bot import run_bot_with_webhook
+        print(f"🌐 Запуск сервера на порту {int(os.environ.get('PORT', 8080))}")
+        run_bot_with_webhook()
     except Exception as e:
         print(f"❌ Ошибка запуска webhook сервера: {e}")
         sys.exit(1)
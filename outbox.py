@@ -0,0 +1,139 @@
+# Файл: outbox.py
+# Диспетчер исходящих публикаций в канал: задания из таблицы outbox, темп канала, повторы с backoff
+
+import asyncio
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from utils import now_ms
+
+
+class OutboxDispatcher:
+    """
+    Выбирает из outbox наступившие задания и выполняет их по одному, выдерживая
+    interval секунд между отправками в канал. 429 (retry_after) приостанавливает
+    все публикации на указанное время, 5xx и сетевые ошибки повторяются с
+    экспоненциальной задержкой, остальные ошибки (нет прав, неверный запрос) окончательны.
+    """
+
+    def __init__(self, db, interval: float = 3.0, max_attempts: int = 5,
+                 base_delay: float = 5.0, max_delay: float = 600.0, batch_size: int = 20):
+        self.db = db
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        # kind -> корутина(job), возвращающая результат (id сообщений)
+        self.handlers: Dict[str, Callable[[Dict], Awaitable[Any]]] = {}
+        # kind -> корутина(job, error), вызывается после окончательной ошибки
+        self.failure_handlers: Dict[str, Callable[[Dict, Exception], Awaitable]] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        self.stats = {'done': 0, 'retried': 0, 'failed': 0, 'flood_waits': 0}
+
+    def register(self, kind: str, handler: Callable[[Dict], Awaitable[Any]],
+                 on_failure: Optional[Callable[[Dict, Exception], Awaitable]] = None):
+        """Зарегистрировать обработчик заданий вида kind"""
+        self.handlers[kind] = handler
+        if on_failure is not None:
+            self.failure_handlers[kind] = on_failure
+
+    def wake(self):
+        """Разбудить диспетчер после постановки задания"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self):
+        """Запустить диспетчер в текущем цикле событий (задания, оставшиеся с прошлого запуска, тоже выполнятся)"""
+        self.loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+        logging.info("Outbox dispatcher started")
+
+    async def stop(self):
+        """Остановить диспетчер; невыполненные задания остаются в outbox до следующего запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logging.info(f"Outbox dispatcher stopped: {self.stats}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                jobs = await self.db.get_due_outbox(self.batch_size)
+                for job in jobs:
+                    pause = self._paused_until - loop.time()
+                    if pause > 0:
+                        await asyncio.sleep(pause)
+                    await self._dispatch(job)
+                    await asyncio.sleep(self.interval)
+                if jobs:
+                    continue
+                next_ts = await self.db.get_next_outbox_ts()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"❌ Ошибка диспетчера outbox: {e}")
+                next_ts = None
+
+            # Спим до ближайшего отложенного задания или до постановки нового
+            timeout = 30.0 if next_ts is None else min(max((next_ts - now_ms()) / 1000, 0), 30.0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self, job: Dict):
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            logging.error(f"No outbox handler for job #{job['id']} ({job['kind']})")
+            await self.db.fail_outbox(job['id'], f"unknown kind {job['kind']}")
+            return
+
+        try:
+            result = await handler(job)
+        except TelegramRetryAfter as e:
+            # Flood control касается всего канала: откладываем и это задание, и следующие
+            self.stats['flood_waits'] += 1
+            self._paused_until = asyncio.get_running_loop().time() + e.retry_after
+            logging.warning(f"Flood control on outbox job #{job['id']}, retry in {e.retry_after}s")
+            await self.db.retry_outbox(job['id'], e.retry_after, str(e), count_attempt=False)
+        except (TelegramServerError, TelegramNetworkError) as e:
+            await self._retry_or_fail(job, e)
+        except Exception as e:
+            await self._fail(job, e)
+        else:
+            self.stats['done'] += 1
+            await self.db.complete_outbox(job['id'], result)
+
+    async def _retry_or_fail(self, job: Dict, error: Exception):
+        attempts = job['attempts'] + 1
+        if attempts >= self.max_attempts:
+            await self._fail(job, error)
+            return
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay) * random.uniform(0.8, 1.2)
+        self.stats['retried'] += 1
+        logging.warning(f"Outbox job #{job['id']} failed ({error}), attempt {attempts}, retry in {delay:.0f}s")
+        await self.db.retry_outbox(job['id'], delay, str(error))
+
+    async def _fail(self, job: Dict, error: Exception):
+        self.stats['failed'] += 1
+        logging.error(f"❌ Задание outbox #{job['id']} ({job['kind']}) не выполнено: {error}")
+        await self.db.fail_outbox(job['id'], str(error))
+        on_failure = self.failure_handlers.get(job['kind'])
+        if on_failure is not None:
+            try:
+                await on_failure(job, error)
+            except Exception as e:
+                logging.error(f"Error in outbox failure handler for job #{job['id']}: {e}")
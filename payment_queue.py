@@ -0,0 +1,129 @@
+# Файл: payment_queue.py
+# Очередь платежей YooMoney: зачисление публикаций и уведомление пользователя вне webhook
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Типы уведомлений YooMoney о входящем платеже
+INCOMING_NOTIFICATION_TYPES = ('card-incoming', 'p2p-incoming')
+
+# Кому зачислять платеж без метки user_<id> (тестовые уведомления YooMoney)
+DEFAULT_PAYMENT_USER_ID = 476589798
+
+
+def payment_user_id(data: Dict[str, Any]) -> int:
+    """Пользователь из метки платежа (формат: user_123456789)"""
+    label = data.get('label') or ''
+    if label.startswith('user_'):
+        try:
+            return int(label.replace('user_', ''))
+        except ValueError:
+            pass
+    return DEFAULT_PAYMENT_USER_ID
+
+
+def publications_for_amount(withdraw_amount: float) -> int:
+    """Число публикаций по тарифу. Сумма без комиссии YooMoney (0% - 8%), поэтому диапазоны расширены"""
+    if 46 <= withdraw_amount <= 54:  # Тариф 50₽
+        return 1
+    if 184 <= withdraw_amount <= 216:  # Тариф 200₽
+        return 5
+    if 322 <= withdraw_amount <= 378:  # Тариф 350₽
+        return 10
+    if 552 <= withdraw_amount <= 648:  # Тариф 600₽
+        return 20
+    return 0
+
+
+class PaymentQueue:
+    """
+    Обрабатывает сохраненные уведомления о платежах в основном цикле событий:
+    зачисляет публикации (Database.credit_payment) и уведомляет пользователя.
+    Статус уведомления в базе позволяет продолжить обработку после перезапуска,
+    не зачисляя платеж повторно.
+    """
+
+    def __init__(self, db, notify: Callable[[int, float, int, int], Awaitable[Any]], retry_delay: float = 30.0):
+        self.db = db
+        # notify(user_id, amount, publications, new_balance)
+        self.notify = notify
+        self.retry_delay = retry_delay
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'credited': 0, 'duplicates': 0, 'rejected': 0, 'errors': 0}
+
+    def submit(self, operation_id: str):
+        """Поставить сохраненное уведомление в очередь обработки"""
+        self._queue.put_nowait(operation_id)
+
+    async def start(self):
+        """Запустить обработчик и вернуть в очередь уведомления, не обработанные до перезапуска"""
+        self.loop = asyncio.get_running_loop()
+        unfinished = await self.db.get_unfinished_payment_notifications()
+        for operation_id in unfinished:
+            self.submit(operation_id)
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Payment queue started, unfinished payments: {len(unfinished)}")
+
+    async def stop(self):
+        """Остановить обработчик; необработанные уведомления остаются в базе до следующего запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logging.info(f"Payment queue stopped: {self.stats}")
+
+    async def _run(self):
+        while True:
+            operation_id = await self._queue.get()
+            try:
+                await self._process(operation_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Например, база занята: повторим позже, статус в базе не изменился
+                self.stats['errors'] += 1
+                logging.error(f"❌ Ошибка обработки платежа {operation_id}: {e}")
+                self.loop.call_later(self.retry_delay, self.submit, operation_id)
+
+    async def _process(self, operation_id: str):
+        notification = await self.db.get_payment_notification(operation_id)
+        if notification is None or notification['status'] not in ('pending', 'credited'):
+            return
+
+        data = notification['payload']
+        user_id = payment_user_id(data)
+        amount = float(data.get('amount', '0'))
+        # Тариф определяется по сумме без комиссии
+        withdraw_amount = float(data.get('withdraw_amount') or amount)
+        publications = publications_for_amount(withdraw_amount)
+        if publications == 0:
+            self.stats['rejected'] += 1
+            logging.warning(f"⚠️ Сумма {withdraw_amount}₽ не соответствует тарифам, платеж {operation_id} не зачислен")
+            await self.db.finish_payment_notification(operation_id, 'rejected', f"amount {withdraw_amount} matches no plan")
+            return
+
+        if notification['status'] == 'pending':
+            description = f"Пополнение: {amount}₽ → {publications} публикаций"
+            if data.get('test_notification') == 'true':
+                description = f"Тестовое пополнение: {amount}₽ → {publications} публикаций"
+            new_balance = await self.db.credit_payment(operation_id, user_id, amount, publications, description)
+            if new_balance is None:
+                # Платеж с этим operation_id уже есть в processed_payments
+                self.stats['duplicates'] += 1
+                logging.warning(f"Платеж {operation_id} уже зачислен, пропускаем")
+                await self.db.finish_payment_notification(operation_id, 'done', 'already credited')
+                return
+            self.stats['credited'] += 1
+            logging.info(f"✅ Начислено {publications} публикаций пользователю {user_id} за {amount}₽")
+        else:
+            # Зачислено до перезапуска, уведомление не успели отправить
+            new_balance = await self.db.get_user_balance(user_id)
+
+        await self.notify(user_id, amount, publications, new_balance)
+        await self.db.finish_payment_notification(operation_id, 'done')
@@ -2,23 +2,143 @@
 import asyncio
 import json
 import logging
-import signal
-import sys
 from datetime import datetime
 from typing import Dict, List, Optional
-from pathlib import Path
+
+from snapshot_backends import JsonFileBackend, SnapshotBackend
+from utils import now_ms
+
+
+def apply_change(auctions: Dict[int, Dict], bids: Dict[int, tuple], event: Dict):
+    """
+    Применить событие журнала к состоянию активных лотов. Записи не изменяются на месте,
+    а заменяются новыми: снимок для компакции - это копия двух словарей, а не всех лотов.
+    """
+    auction_id = event['auction_id']
+    event_type = event['type']
+    if event_type == 'auction':
+        auctions[auction_id] = dict(event['auction'], media=list(event['auction'].get('media') or ()))
+        bids.setdefault(auction_id, ())
+        return
+
+    auction = auctions.get(auction_id)
+    if auction is None:
+        return
+    if event_type == 'bid':
+        bid = {key: event[key] for key in ('bidder_id', 'bidder_username', 'amount', 'created_at')}
+        bids[auction_id] = bids.get(auction_id, ()) + (bid,)
+        auctions[auction_id] = dict(auction, current_price=event['amount'], current_leader_id=event['bidder_id'],
+                                    current_leader_username=event['bidder_username'])
+    elif event_type == 'status':
+        if event['status'] != 'active':
+            # В снимке хранятся только активные лоты
+            auctions.pop(auction_id, None)
+            bids.pop(auction_id, None)
+    elif event_type == 'channel_message':
+        auctions[auction_id] = dict(auction, channel_chat_id=event['channel_chat_id'],
+                                    channel_message_id=event['channel_message_id'])
+
+
+class ChangeJournal:
+    """
+    Журнал изменений аукционов (только дозапись). События копятся в памяти,
+    фоновая задача дописывает их в хранилище пачками: одна запись и один fsync на пачку.
+    """
+
+    def __init__(self, backend: SnapshotBackend, batch_window: float = 0.05):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.seq = 0
+        self._buffer: List[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._io_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'events': 0, 'batches': 0}
+
+    def start(self, seq: int = 0):
+        """Запустить фоновую запись; нумерация продолжается с seq"""
+        self.seq = max(self.seq, seq)
+        self._task = asyncio.create_task(self._run())
+
+    def append(self, event: Dict) -> int:
+        """Добавить событие в буфер записи, вернуть его номер"""
+        self.seq += 1
+        line = json.dumps({'seq': self.seq, 'ts': now_ms(), **event}, ensure_ascii=False, default=str)
+        self._buffer.append((self.seq, line))
+        self.stats['events'] += 1
+        self._wakeup.set()
+        return self.seq
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Окно группировки: события за это время уходят на диск одним fsync
+            await asyncio.sleep(self.batch_window)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error writing auction journal: {e}")
+
+    async def flush(self):
+        """Дописать накопленные события на диск"""
+        async with self._io_lock:
+            self._wakeup.clear()
+            entries, self._buffer = self._buffer, []
+            if not entries:
+                return
+            try:
+                await asyncio.to_thread(self.backend.append_journal, entries)
+            except Exception:
+                # Вернем события в начало буфера, чтобы не потерять их до следующей попытки
+                self._buffer[:0] = entries
+                raise
+            self.stats['batches'] += 1
+
+    async def trim(self, seq: int):
+        """Удалить из файла события, уже вошедшие в снимок (номер не больше seq)"""
+        await self.flush()
+        async with self._io_lock:
+            await asyncio.to_thread(self.backend.trim_journal, seq)
+
+    async def stop(self):
+        """Дописать буфер и остановить фоновую запись"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
 
 class AuctionPersistence:
     """
-    Класс для сохранения и восстановления состояния аукционов
+    Класс для сохранения и восстановления состояния аукционов.
+    Изменения (новые лоты, ставки, статусы, сообщения в канале) приходят из Database
+    и пишутся в журнал; периодическая компакция сворачивает их в снимок.
+    Где лежат снимок и журнал, решает хранилище (snapshot_backends): файл, таблицы SQLite или нигде.
     """
     
-    def __init__(self, db, persistence_file: str = "auction_state.json"):
+    def __init__(self, db, persistence_file: str = "auction_state.json", save_interval: int = 300,
+                 compact_after: int = 10000, backend: Optional[SnapshotBackend] = None):
         self.db = db
-        self.persistence_file = Path(persistence_file)
+        self.backend = backend or JsonFileBackend(persistence_file)
+        self.save_interval = save_interval
+        # Компакция вне расписания, если с прошлого снимка накопилось столько событий
+        self.compact_after = compact_after
+        self.journal = ChangeJournal(self.backend)
         self.running = False
         self.save_task = None
         self.auction_timer = None  # Ссылка на таймер аукционов
+        # Состояние активных лотов в памяти: id -> аукцион, id -> ставки (старые первыми)
+        self._auctions: Dict[int, Dict] = {}
+        self._bids: Dict[int, tuple] = {}
+        self._snapshot_seq = 0
+        self._save_lock = asyncio.Lock()
+        self._compaction_task: Optional[asyncio.Task] = None
+        self._listening = False
+        self.loop = None
         
     def set_auction_timer(self, auction_timer):
         """Установить ссылку на таймер аукционов"""
@@ -30,15 +150,30 @@ class AuctionPersistence:
             return
             
         self.running = True
+        self.loop = asyncio.get_running_loop()
         
-        # Восстанавливаем состояние при запуске
+        if not self.backend.enabled:
+            logging.info("Auction persistence disabled: state is kept in the database only")
+            return
+        
+        # Восстанавливаем состояние при запуске (снимок + события журнала после него)
         await self.restore_state()
         
-        # Запускаем периодическое сохранение
+        # Дальше состояние ведется в памяти по событиям базы
+        if not self._listening:
+            self.db.add_change_listener(self._on_change)
+            self._listening = True
+        await self._load_state()
+        self.journal.start(self._snapshot_seq)
+        
+        # Свежий снимок: журнал начинается с чистого листа
+        await self.save_state()
+        
+        # Запускаем периодическую компакцию
         self.save_task = asyncio.create_task(self._periodic_save())
         
-        # Регистрируем обработчики сигналов
-        self._register_signal_handlers()
+        # Сигналы остановки обрабатывает сервер (hypercorn) или main() в режиме polling:
+        # они вызывают on_shutdown, который дописывает ставки и сохраняет состояние
         
         logging.info("Auction persistence system started")
     
@@ -46,42 +181,55 @@ class AuctionPersistence:
         """Остановить систему персистентности"""
         self.running = False
         
-        if self.save_task:
-            self.save_task.cancel()
-            try:
-                await self.save_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self.save_task, self._compaction_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         # Сохраняем состояние при остановке
-        await self.save_state()
+        if self.backend.enabled:
+            await self.save_state()
+            await self.journal.stop()
         
         logging.info("Auction persistence system stopped")
     
-    def _register_signal_handlers(self):
-        """Регистрируем обработчики сигналов для корректного завершения"""
-        def signal_handler(signum, frame):
-            logging.info(f"Received signal {signum}, saving state...")
-            asyncio.create_task(self.save_state())
-            sys.exit(0)
-        
+    def _on_change(self, event: Dict):
+        """Событие базы: обновить состояние в памяти и записать в журнал"""
         try:
-            # Проверяем, что мы в главном потоке
-            import threading
-            if threading.current_thread() is threading.main_thread():
-                signal.signal(signal.SIGINT, signal_handler)
-                signal.signal(signal.SIGTERM, signal_handler)
-            else:
-                logging.warning("Cannot register signal handlers in non-main thread")
-        except Exception as e:
-            logging.warning(f"Cannot register signal handlers: {e}")
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not self.loop:
+            # Запись из другого потока/цикла - применяем в цикле persistence
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self._on_change, event)
+            return
+        
+        apply_change(self._auctions, self._bids, event)
+        seq = self.journal.append(event)
+        if (self.running and seq - self._snapshot_seq >= self.compact_after
+                and (self._compaction_task is None or self._compaction_task.done())):
+            self._compaction_task = asyncio.create_task(self.save_state())
+    
+    async def _load_state(self):
+        """Загрузить активные лоты и их ставки из базы в память (один раз при старте)"""
+        active_auctions = await self._get_active_auctions()
+        auction_bids = await self._get_auction_bids([auction['id'] for auction in active_auctions])
+        self._auctions = {auction['id']: auction for auction in active_auctions}
+        self._bids = {
+            auction_id: tuple(reversed(auction_bids.get(auction_id, [])))
+            for auction_id in self._auctions
+        }
     
     async def _periodic_save(self):
-        """Периодическое сохранение состояния каждые 5 минут"""
+        """Периодическая компакция журнала в снимок (только если были изменения)"""
         while self.running:
             try:
-                await asyncio.sleep(300)  # 5 минут
-                if self.running:
+                await asyncio.sleep(self.save_interval)
+                if self.running and self.journal.seq != self._snapshot_seq:
                     await self.save_state()
                     logging.debug("Periodic state save completed")
             except asyncio.CancelledError:
@@ -90,86 +238,109 @@ class AuctionPersistence:
                 logging.error(f"Error in periodic save: {e}")
     
     async def save_state(self):
-        """Сохранить текущее состояние аукционов"""
-        try:
-            # Получаем все активные аукционы
-            active_auctions = await self._get_active_auctions()
-            
-            # Получаем все ставки для активных аукционов
-            auction_bids = {}
-            for auction in active_auctions:
-                auction_id = auction['id']
-                bids = await self._get_auction_bids(auction_id)
-                auction_bids[auction_id] = bids
-            
-            # Формируем данные для сохранения
-            state_data = {
-                'timestamp': datetime.now().isoformat(),
-                'version': '1.0',
-                'active_auctions': active_auctions,
-                'auction_bids': auction_bids,
-                'total_active_auctions': len(active_auctions),
-                'system_info': {
-                    'persistence_running': self.running,
-                    'save_interval': 300,  # 5 минут
-                    'last_save_successful': True
-                },
-                'channel_messages': {
-                    'total_messages': len([a for a in active_auctions if a.get('channel_message_id')]),
-                    'messages_with_channel_info': len([a for a in active_auctions if a.get('channel_chat_id') and a.get('channel_message_id')])
-                }
-            }
-            
-            # Сохраняем в файл
-            with open(self.persistence_file, 'w', encoding='utf-8') as f:
-                json.dump(state_data, f, ensure_ascii=False, indent=2, default=str)
-            
-            logging.info(f"State saved: {len(active_auctions)} active auctions")
+        """Компакция: записать снимок состояния из памяти и обрезать журнал"""
+        if not self.backend.enabled:
             return True
-            
-        except Exception as e:
-            logging.error(f"Error saving state: {e}")
-            return False
+        async with self._save_lock:
+            try:
+                # Копия словарей, а не лотов: записи в них неизменяемы (см. apply_change)
+                seq = self.journal.seq
+                auctions = list(self._auctions.values())
+                bids = dict(self._bids)
+                
+                await asyncio.to_thread(self._write_snapshot, seq, auctions, bids)
+                self._snapshot_seq = seq
+                await self.journal.trim(seq)
+                
+                logging.info(f"State saved: {len(auctions)} active auctions (journal seq {seq})")
+                return True
+                
+            except Exception as e:
+                logging.error(f"Error saving state: {e}")
+                return False
+    
+    def _write_snapshot(self, seq: int, active_auctions: List[Dict], bids: Dict[int, tuple]):
+        """Сериализовать и атомарно записать снимок (в фоновом потоке)"""
+        header = {
+            'timestamp': datetime.now().isoformat(),
+            'version': '1.0',
+            'journal_seq': seq,
+            'total_active_auctions': len(active_auctions),
+            'system_info': {
+                'persistence_running': self.running,
+                'save_interval': self.save_interval,
+                'last_save_successful': True
+            },
+            'channel_messages': {
+                'total_messages': len([a for a in active_auctions if a.get('channel_message_id')]),
+                'messages_with_channel_info': len([a for a in active_auctions if a.get('channel_chat_id') and a.get('channel_message_id')])
+            }
+        }
+        # Новые ставки первыми, как в истории ставок
+        records = ((auction, list(bids.get(auction['id'], ())[::-1])) for auction in active_auctions)
+        self.backend.write_snapshot(header, records)
+    
+    def _load_snapshot(self):
+        """Прочитать снимок и доиграть события журнала после него (None - снимка нет)"""
+        snapshot = self.backend.read_snapshot()
+        if snapshot is None:
+            return None
+        state_data, records = snapshot
+        if state_data.get('version') != '1.0':
+            return state_data, {}, {}, []
+        
+        auctions = {}
+        bids = {}
+        for auction, auction_bids in records:
+            auctions[auction['id']] = auction
+            bids[auction['id']] = tuple(reversed(auction_bids))
+        
+        events = self.backend.read_journal(after_seq=state_data.get('journal_seq', 0))
+        for event in events:
+            apply_change(auctions, bids, event)
+        return state_data, auctions, bids, events
     
     async def restore_state(self):
-        """Восстановить состояние аукционов из файла"""
+        """Восстановить состояние аукционов из снимка"""
         try:
-            if not self.persistence_file.exists():
-                logging.info("No persistence file found, starting fresh")
+            # Читаем снимок и журнал в фоновом потоке, не останавливая цикл событий
+            snapshot = await asyncio.to_thread(self._load_snapshot)
+            if snapshot is None:
+                logging.info("No persistence snapshot found, starting fresh")
                 return True
-            
-            # Читаем файл состояния
-            with open(self.persistence_file, 'r', encoding='utf-8') as f:
-                state_data = json.load(f)
+            state_data, auctions, bids, events = snapshot
             
             # Проверяем версию
             if state_data.get('version') != '1.0':
                 logging.warning(f"Unknown persistence version: {state_data.get('version')}")
                 return False
             
+            self._snapshot_seq = state_data.get('journal_seq', 0)
+            if events:
+                self.journal.seq = events[-1]['seq']
+                logging.info(f"Replayed {len(events)} journal events after snapshot")
+            
             # Восстанавливаем аукционы
             restored_count = 0
-            active_auctions = state_data.get('active_auctions', [])
+            active_auctions = list(auctions.values())
+            # Статусы всех лотов снимка - пачками, а не запросом на лот
+            statuses = await self.db.get_auction_statuses([auction['id'] for auction in active_auctions])
             
             for auction_data in active_auctions:
                 try:
-                    # Проверяем, что аукцион все еще активен по времени
-                    end_time_str = auction_data.get('end_time')
-                    if isinstance(end_time_str, str):
-                        end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00'))
-                    else:
-                        end_time = datetime.now()
+                    # Проверяем, что аукцион все еще активен по времени (без end_ts лот считаем истекшим)
+                    end_ts = auction_data.get('end_ts')
                     
                     # Если время истекло, пропускаем
-                    if end_time <= datetime.now():
+                    if end_ts is None or end_ts <= now_ms():
                         logging.info(f"Auction {auction_data.get('id')} expired, skipping restoration")
                         continue
                     
                     # Проверяем, существует ли аукцион в базе данных
-                    existing_auction = await self.db.get_auction(auction_data.get('id'))
-                    if existing_auction:
+                    status = statuses.get(auction_data.get('id'))
+                    if status:
                         # Обновляем статус на активный, если он был изменен
-                        if existing_auction['status'] != 'active':
+                        if status != 'active':
                             await self.db.update_auction_status(auction_data.get('id'), 'active')
                             logging.info(f"Restored auction {auction_data.get('id')} status to active")
                         restored_count += 1
@@ -179,44 +350,12 @@ class AuctionPersistence:
                 except Exception as e:
                     logging.error(f"Error restoring auction {auction_data.get('id', 'unknown')}: {e}")
             
-            # Восстанавливаем ставки
-            auction_bids = state_data.get('auction_bids', {})
-            restored_bids = 0
-            
-            for auction_id, bids in auction_bids.items():
-                try:
-                    # Проверяем, что аукцион существует
-                    auction = await self.db.get_auction(int(auction_id))
-                    if not auction:
-                        continue
-                    
-                    # Восстанавливаем ставки (если они не существуют)
-                    for bid in bids:
-                        try:
-                            # Проверяем, существует ли ставка
-                            existing_bids = await self.db.get_bidding_history(int(auction_id))
-                            bid_exists = any(
-                                existing_bid['amount'] == bid['amount'] and 
-                                existing_bid['bidder_id'] == bid['bidder_id'] and
-                                existing_bid['created_at'] == bid['created_at']
-                                for existing_bid in existing_bids
-                            )
-                            
-                            if not bid_exists:
-                                # Восстанавливаем ставку
-                                await self.db.place_bid(
-                                    int(auction_id),
-                                    bid['bidder_id'],
-                                    bid['bidder_username'],
-                                    bid['amount']
-                                )
-                                restored_bids += 1
-                                
-                        except Exception as e:
-                            logging.error(f"Error restoring bid for auction {auction_id}: {e}")
-                            
-                except Exception as e:
-                    logging.error(f"Error restoring bids for auction {auction_id}: {e}")
+            # Восстанавливаем недостающие ставки одной транзакцией (повторный запуск ничего не меняет)
+            try:
+                restored_bids = await self.db.restore_bids(bids)
+            except Exception as e:
+                restored_bids = 0
+                logging.error(f"Error restoring bids: {e}")
             
             # Восстанавливаем сообщения в канале для активных аукционов
             await self._restore_channel_messages(active_auctions)
@@ -237,13 +376,8 @@ class AuctionPersistence:
         try:
             for auction_data in active_auctions:
                 # Проверяем, что аукцион все еще активен по времени
-                end_time_str = auction_data.get('end_time')
-                if isinstance(end_time_str, str):
-                    end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00'))
-                else:
-                    end_time = datetime.now()
-                
-                if end_time <= datetime.now():
+                end_ts = auction_data.get('end_ts')
+                if end_ts is None or end_ts <= now_ms():
                     continue
                 
                 # Проверяем, есть ли информация о сообщении в канале
@@ -295,90 +429,36 @@ class AuctionPersistence:
     async def _get_active_auctions(self) -> List[Dict]:
         """Получить все активные аукционы"""
         try:
-            import aiosqlite
-            async with aiosqlite.connect(self.db.db_path) as db_conn:
-                cursor = await db_conn.execute(
-                    "SELECT * FROM auctions WHERE status = 'active' AND end_time > ?",
-                    (datetime.now(),)
-                )
-                auctions = await cursor.fetchall()
-                
-                result = []
-                for auction in auctions:
-                    # Получаем медиа файлы
-                    cursor = await db_conn.execute(
-                        "SELECT file_id, media_type, order_index FROM auction_media WHERE auction_id = ? ORDER BY order_index",
-                        (auction[0],)
-                    )
-                    media = await cursor.fetchall()
-                    
-                    # Преобразуем строки дат в datetime объекты
-                    end_time = auction[8]
-                    if isinstance(end_time, str):
-                        try:
-                            end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                        except ValueError:
-                            end_time = datetime.now()
-                    
-                    created_at = auction[12]
-                    if isinstance(created_at, str):
-                        try:
-                            created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                        except ValueError:
-                            created_at = datetime.now()
-                    
-                    result.append({
-                        'id': auction[0],
-                        'owner_id': auction[1],
-                        'description': auction[2],
-                        'start_price': auction[3],
-                        'blitz_price': auction[4],
-                        'current_price': auction[5],
-                        'current_leader_id': auction[6],
-                        'current_leader_username': auction[7],
-                        'end_time': end_time,
-                        'status': auction[9],
-                        'channel_message_id': auction[10],
-                        'channel_chat_id': auction[11],
-                        'created_at': created_at,
-                        'media': [{'file_id': m[0], 'type': m[1]} for m in media]
-                    })
-                
-                return result
+            auctions = await self.db.get_active_auctions()
+            media = await self.db.get_media_for_auctions([auction['id'] for auction in auctions])
+            # В файл состояния пишутся обычные словари
+            return [dict(auction, media=media[auction['id']]) for auction in auctions]
                 
         except Exception as e:
             logging.error(f"Error getting active auctions: {e}")
             return []
     
-    async def _get_auction_bids(self, auction_id: int) -> List[Dict]:
-        """Получить все ставки для аукциона"""
+    async def _get_auction_bids(self, auction_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Получить все ставки для аукционов"""
         try:
-            return await self.db.get_bidding_history(auction_id)
+            bids = await self.db.get_bids_for_auctions(auction_ids)
+            return {auction_id: [bid.to_dict() for bid in auction_bids] for auction_id, auction_bids in bids.items()}
         except Exception as e:
-            logging.error(f"Error getting bids for auction {auction_id}: {e}")
-            return []
+            logging.error(f"Error getting bids for auctions: {e}")
+            return {}
     
     async def force_save(self):
         """Принудительно сохранить состояние"""
         return await self.save_state()
     
     def get_persistence_info(self) -> Dict:
-        """Получить информацию о файле персистентности"""
+        """Получить информацию о снимке персистентности"""
         try:
-            if not self.persistence_file.exists():
-                return {
-                    'exists': False,
-                    'size': 0,
-                    'last_modified': None
-                }
-            
-            stat = self.persistence_file.stat()
-            return {
-                'exists': True,
-                'size': stat.st_size,
-                'last_modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                'path': str(self.persistence_file.absolute())
-            }
+            return dict(
+                self.backend.info(),
+                backend=self.backend.name,
+                journal_events=self.journal.seq - self._snapshot_seq
+            )
         except Exception as e:
             logging.error(f"Error getting persistence info: {e}")
             return {'error': str(e)}
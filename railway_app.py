@@ -11,10 +11,10 @@ from pathlib import Path
 # Добавляем текущую директорию в путь для импортов
 sys.path.append(str(Path(__file__).parent))
 
-# Импортируем Flask приложение из bot.py
-from bot import app
+# Импортируем запуск webhook сервера из bot.py
+from bot import run_bot_with_webhook
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     print(f"🚀 Запуск приложения на порту {port}")
-    app.run(host="0.0.0.0", port=port, debug=False)
+    run_bot_with_webhook()
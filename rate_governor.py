@@ -0,0 +1,268 @@
+# Файл: rate_governor.py
+# Общий ограничитель запросов к Telegram: token bucket на чат и глобальный, приоритетные полосы
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (CHANNEL_USERNAME, TELEGRAM_CHANNEL_RATE_PER_MINUTE, TELEGRAM_CHAT_RATE,
+                    TELEGRAM_GLOBAL_RATE, TELEGRAM_GROUP_RATE_PER_MINUTE)
+
+# Полосы приоритета: чем меньше число, тем раньше запрос получает глобальный токен
+LANE_INTERACTIVE = 0   # ответы на нажатия и действия пользователя (подтверждение ставки)
+LANE_CHANNEL = 1       # посты и правки постов в канале
+LANE_NOTIFICATION = 2  # уведомления, которые пользователь не ждет прямо сейчас
+LANE_NAMES = {LANE_INTERACTIVE: 'interactive', LANE_CHANNEL: 'channel', LANE_NOTIFICATION: 'notification'}
+
+# Методы, которые расходуют лимиты на сообщения (getUpdates, getChatMember и т.п. не ограничиваются)
+GOVERNED_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward', 'Delete', 'Answer')
+
+# Полоса, заданная вызывающим кодом (см. telegram_lane)
+_current_lane: ContextVar[Optional[int]] = ContextVar('telegram_lane', default=None)
+
+
+@contextmanager
+def telegram_lane(lane: int):
+    """Отправлять запросы к Telegram внутри блока в полосе lane"""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity. Токены можно брать в долг"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def reserve(self, now: float) -> float:
+        """Занять токен (при нехватке - в долг). Возвращает, сколько ждать до его наступления"""
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+
+class RateGovernor:
+    """
+    Один на процесс ограничитель отправки. Запрос сначала ждет токен своего чата
+    (личный чат - chat_rate в секунду, группа - group_rate, канал бота - channel_rate),
+    затем глобальный токен (global_rate в секунду). Глобальные токены выдаются по полосам:
+    интерактивные ответы раньше правок канала, правки раньше уведомлений.
+    Чат, заданный как @username, и его числовой id делят одно ведро (см. register_channel, learn_chat_id).
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 20.0, channel_rate: Optional[float] = None,
+                 max_chats: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.channel_rate = group_rate if channel_rate is None else channel_rate
+        self.max_chats = max_chats
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1.0), clock())
+        self.chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        # '@username' -> числовой id чата; ключи каналов бота (лимит channel_rate)
+        self._aliases: Dict[str, int] = {}
+        self._channels: set = set()
+        # Ожидающие глобального токена: (полоса, порядковый номер, future)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        self.stats = {'requests': 0, 'delayed': 0, 'flood_waits': 0,
+                      'lanes': {name: 0 for name in LANE_NAMES.values()}}
+
+    @staticmethod
+    def is_group(chat_id: Any) -> bool:
+        """Группы и каналы имеют отрицательный id или задаются как @username"""
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def _chat_key(self, chat_id: Any) -> Any:
+        """Один ключ ведра для '@Name', '@name', '-100...' и числового id чата"""
+        if isinstance(chat_id, str):
+            if chat_id.lstrip('-').isdigit():
+                return int(chat_id)
+            chat_id = chat_id.lower()
+            return self._aliases.get(chat_id, chat_id)
+        return chat_id
+
+    def register_channel(self, username: str, chat_id: Optional[int] = None):
+        """Канал бота: посты и правки в нем идут по лимиту channel_rate, с id или без"""
+        key = self._chat_key(username)
+        self._channels.add(key)
+        bucket = self.chats.get(key)
+        if bucket is not None:
+            bucket.rate = self.channel_rate
+        if chat_id is not None:
+            self.learn_chat_id(username, chat_id)
+
+    def learn_chat_id(self, username: str, chat_id: int):
+        """Запомнить числовой id чата @username; ведро, набранное по имени, переходит к id"""
+        if not isinstance(username, str) or username.lstrip('-').isdigit():
+            return
+        name = username.lower()
+        if self._aliases.get(name) == chat_id:
+            return
+        self._aliases[name] = chat_id
+        bucket = self.chats.pop(name, None)
+        if bucket is not None and chat_id not in self.chats:
+            self.chats[chat_id] = bucket
+        if name in self._channels:
+            self._channels.add(chat_id)
+            if chat_id in self.chats:
+                self.chats[chat_id].rate = self.channel_rate
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        chat_id = self._chat_key(chat_id)
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if chat_id in self._channels:
+                bucket = TokenBucket(self.channel_rate, self.group_burst, self.clock())
+            elif self.is_group(chat_id):
+                bucket = TokenBucket(self.group_rate, self.group_burst, self.clock())
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, self.clock())
+            self.chats[chat_id] = bucket
+            if len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: Any = None, lane: int = LANE_INTERACTIVE):
+        """Дождаться права отправить один запрос в чат chat_id (None - только глобальный лимит)"""
+        self.stats['requests'] += 1
+        lane_name = LANE_NAMES.get(lane, str(lane))
+        self.stats['lanes'][lane_name] = self.stats['lanes'].get(lane_name, 0) + 1
+        delayed = False
+
+        if chat_id is not None:
+            # Внутри чата очередь по порядку: токен резервируется сразу, ждем его наступления
+            wait = self._chat_bucket(chat_id).reserve(self.clock())
+            if wait > 0:
+                delayed = True
+                await asyncio.sleep(wait)
+
+        if not self._waiters and self.global_bucket.delay(self.clock()) <= 0:
+            self.global_bucket.take(self.clock())
+        else:
+            delayed = True
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (lane, next(self._seq), future))
+            if self._pump_task is None or self._pump_task.done():
+                self._pump_task = asyncio.create_task(self._pump())
+            await future
+
+        if delayed:
+            self.stats['delayed'] += 1
+
+    async def _pump(self):
+        """Раздает глобальные токены ожидающим в порядке полос"""
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # Ожидающий отменен (например, по таймауту обработчика)
+                heapq.heappop(self._waiters)
+                continue
+            wait = self.global_bucket.delay(self.clock())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self.global_bucket.take(self.clock())
+            heapq.heappop(self._waiters)[2].set_result(None)
+
+    def penalize(self, chat_id: Any, retry_after: float):
+        """Telegram ответил 429: не отправлять в этот чат (или никуда) retry_after секунд"""
+        self.stats['flood_waits'] += 1
+        bucket = self.global_bucket if chat_id is None else self._chat_bucket(chat_id)
+        bucket.blocked_until = max(bucket.blocked_until, self.clock() + retry_after)
+
+    def info(self) -> dict:
+        return dict(self.stats, waiting=len(self._waiters), chats=len(self.chats))
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждый отправляющий запрос проходит через RateGovernor"""
+
+    def __init__(self, governor: RateGovernor):
+        self.governor = governor
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = type(method).__name__
+        if not name.startswith(GOVERNED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        if name.startswith('Answer'):
+            # Ответ на нажатие кнопки (в т.ч. "ставка принята") ждет пользователь - всегда первым
+            lane = LANE_INTERACTIVE
+        else:
+            lane = _current_lane.get()
+            if lane is None:
+                lane = LANE_CHANNEL if chat_id is not None and RateGovernor.is_group(chat_id) else LANE_INTERACTIVE
+
+        await self.governor.acquire(chat_id, lane)
+        try:
+            result = await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            logging.warning(f"Flood control on {name} to {chat_id}, retry in {e.retry_after}s")
+            self.governor.penalize(chat_id, e.retry_after)
+            raise
+        if isinstance(chat_id, str):
+            # Отправка по @username: ответ содержит числовой id, под которым чат правится дальше
+            message = result[0] if isinstance(result, list) and result else result
+            chat = getattr(message, 'chat', None)
+            if chat is not None:
+                self.governor.learn_chat_id(chat_id, chat.id)
+        return result
+
+
+# Общий ограничитель процесса: его middleware ставится на всех ботов, которые отправляют сообщения
+governor = RateGovernor(
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    group_rate=TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+    channel_rate=TELEGRAM_CHANNEL_RATE_PER_MINUTE / 60
+)
+governor.register_channel(CHANNEL_USERNAME)
+
+
+def install_rate_governor(bot: Bot) -> Bot:
+    """Подключить общий ограничитель к сессии бота (повторный вызов ничего не делает)"""
+    if not any(isinstance(middleware, RateLimitMiddleware) for middleware in bot.session.middleware):
+        bot.session.middleware(RateLimitMiddleware(governor))
+    return bot
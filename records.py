@@ -0,0 +1,169 @@
+# Файл: records.py
+# Неизменяемые записи строк базы данных (аукцион, ставка, пользователь, задание outbox) и их декодер
+
+import json
+from collections.abc import Mapping
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils import from_epoch_ms
+
+
+@lru_cache(maxsize=4096)
+def _parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def parse_timestamp(value: Any) -> Any:
+    """Строка времени SQLite -> datetime (одинаковые строки разбираются один раз)"""
+    if not isinstance(value, str):
+        return value
+    try:
+        return _parse_timestamp(value)
+    except ValueError:
+        return datetime.now()  # Fallback
+
+
+@lru_cache(maxsize=4096)
+def epoch_ms_to_time(value: Optional[int]) -> Optional[datetime]:
+    """Миллисекунды Unix из базы -> московское время для отображения и сравнения с now()"""
+    return None if value is None else from_epoch_ms(value)
+
+
+class Record(Mapping):
+    """
+    Неизменяемая запись со слотами. Читается как словарь (record['id'], record.get(...),
+    dict(record)), изменяется только через replace(), которая возвращает новую запись.
+    """
+    __slots__ = ()
+    # Значения полей, которых нет в выборке
+    DEFAULTS: Dict[str, Any] = {}
+    # Преобразование значений колонок при декодировании строки
+    CONVERTERS: Dict[str, Callable[[Any], Any]] = {}
+    # Поля, которые берутся из другой колонки, если она есть в выборке: поле -> (колонка, преобразование)
+    DERIVED: Dict[str, Tuple[str, Callable[[Any], Any]]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Прямые сеттеры слотов: запись заполняется в обход запрещающего __setattr__
+        cls._setters = tuple(cls.__dict__[name].__set__ for name in cls.__slots__)
+
+    def __init__(self, **fields):
+        for name, setter in zip(self.__slots__, self._setters):
+            setter(self, fields[name] if name in fields else self.DEFAULTS[name])
+
+    @classmethod
+    def _from_values(cls, values) -> "Record":
+        record = object.__new__(cls)
+        for setter, value in zip(cls._setters, values):
+            setter(record, value)
+        return record
+
+    @classmethod
+    def row_factory(cls, description) -> Callable[[Any, tuple], "Record"]:
+        """Фабрика строк sqlite3 для выборки с колонками description (cursor.description)"""
+        decode = _decoder(cls, description)
+        return lambda cursor, row: decode(row)
+
+    def replace(self, **changes) -> "Record":
+        """Копия записи с измененными полями"""
+        return self._from_values([
+            changes[name] if name in changes else getattr(self, name) for name in self.__slots__
+        ])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Auction(Record):
+    __slots__ = (
+        'id', 'owner_id', 'description', 'start_price', 'blitz_price', 'current_price',
+        'current_leader_id', 'current_leader_username', 'end_time', 'status',
+        'channel_message_id', 'channel_chat_id', 'created_at', 'end_ts', 'created_ts', 'media',
+    )
+    DEFAULTS = {'end_ts': None, 'created_ts': None, 'media': ()}
+    # Строки времени разбираются, только если в выборке нет колонок end_ts/created_ts
+    CONVERTERS = {'end_time': parse_timestamp, 'created_at': parse_timestamp}
+    DERIVED = {'end_time': ('end_ts', epoch_ms_to_time), 'created_at': ('created_ts', epoch_ms_to_time)}
+
+
+class Bid(Record):
+    __slots__ = ('bidder_id', 'bidder_username', 'amount', 'created_at')
+
+
+class User(Record):
+    __slots__ = ('user_id', 'username', 'full_name', 'balance', 'created_at', 'is_admin')
+    CONVERTERS = {'is_admin': bool}
+
+
+def _json_or_none(value: Optional[str]) -> Any:
+    return None if value is None else json.loads(value)
+
+
+class OutboxJob(Record):
+    __slots__ = (
+        'id', 'kind', 'auction_id', 'user_id', 'payload', 'status', 'attempts',
+        'next_attempt_ts', 'last_error', 'result', 'created_ts', 'updated_ts',
+    )
+    CONVERTERS = {'payload': _json_or_none, 'result': _json_or_none}
+
+
+# Декодеры строк по (тип записи, набор колонок): сопоставление колонок и полей
+# строится один раз на форму запроса, дальше строка раскладывается по готовому плану
+_decoders: Dict[Tuple[type, Tuple[str, ...]], Callable[[tuple], Record]] = {}
+
+
+def _decoder(record_type, description) -> Callable[[tuple], Record]:
+    columns = tuple(column[0] for column in description)
+    key = (record_type, columns)
+    decoder = _decoders.get(key)
+    if decoder is not None:
+        return decoder
+
+    positions = {name: index for index, name in enumerate(columns)}
+    plan = []
+    for name in record_type.__slots__:
+        derived = record_type.DERIVED.get(name)
+        if derived is not None and positions.get(derived[0]) is not None:
+            plan.append((positions[derived[0]], derived[1], None))
+            continue
+        index: Optional[int] = positions.get(name)
+        if index is None:
+            if name not in record_type.DEFAULTS:
+                raise KeyError(f"{record_type.__name__}: column '{name}' is missing in query")
+            plan.append((None, None, record_type.DEFAULTS[name]))
+        else:
+            plan.append((index, record_type.CONVERTERS.get(name), None))
+    plan = tuple(plan)
+    make = record_type._from_values
+
+    def decoder(row: tuple) -> Record:
+        return make([
+            default if index is None else (convert(row[index]) if convert else row[index])
+            for index, convert, default in plan
+        ])
+
+    _decoders[key] = decoder
+    return decoder
@@ -5,11 +5,13 @@ import asyncio
 import aiosqlite
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, List, Optional
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from database import Database
 from config import ADMIN_USER_IDS, DATABASE_PATH, CHANNEL_USERNAME_LINK
+from rate_governor import install_rate_governor, telegram_lane, LANE_NOTIFICATION
 
 class BalanceManager:
     def __init__(self, db_path: str = "auction_bot.db"):
@@ -99,9 +101,48 @@ class BalanceManager:
             return False
 
 class NotificationManager:
-    def __init__(self, bot_token: str):
-        self.bot_token = bot_token
-        self.bot = Bot(token=bot_token)
+    """
+    Уведомления пользователям через общий бот приложения: одна сессия aiohttp на все
+    отправки, запросы идут в полосе уведомлений общего ограничителя запросов.
+    """
+    
+    def __init__(self, bot: Bot, concurrency: int = 10):
+        self.bot = install_rate_governor(bot)
+        self.bot_token = bot.token
+        # Сколько уведомлений send_many отправляет одновременно (темп задает ограничитель)
+        self.semaphore = asyncio.Semaphore(concurrency)
+    
+    async def _send(self, user_id: int, message: str, **kwargs):
+        """Отправить уведомление в полосе уведомлений (после ответов на ставки и правок канала)"""
+        kwargs.setdefault('parse_mode', "HTML")
+        with telegram_lane(LANE_NOTIFICATION):
+            await self.bot.send_message(chat_id=user_id, text=message, **kwargs)
+    
+    async def send_many(self, user_ids: Iterable[int], message: str, **kwargs) -> Dict[int, Optional[str]]:
+        """
+        Разослать одно сообщение многим пользователям. Возвращает результат по каждому
+        получателю: None - доставлено, иначе текст ошибки. При flood control отправка
+        получателю повторяется один раз после retry_after.
+        """
+        async def deliver(user_id: int) -> Optional[str]:
+            async with self.semaphore:
+                for attempt in range(2):
+                    try:
+                        await self._send(user_id, message, **kwargs)
+                        return None
+                    except TelegramRetryAfter as e:
+                        if attempt:
+                            return str(e)
+                        await asyncio.sleep(e.retry_after)
+                    except Exception as e:
+                        return str(e)
+        
+        recipients = list(dict.fromkeys(user_ids))
+        results = await asyncio.gather(*(deliver(user_id) for user_id in recipients))
+        report = dict(zip(recipients, results))
+        failed = sum(1 for error in results if error is not None)
+        logging.info(f"📨 Рассылка: доставлено {len(recipients) - failed}, ошибок {failed}")
+        return report
     
     async def send_balance_notification(self, user_id: int, amount: float, publications: int, new_balance: int) -> bool:
         """
@@ -114,11 +155,7 @@ class NotificationManager:
             message += f"💎 Новый баланс: {new_balance} публикаций\n\n"
             message += f"🎉 Теперь вы можете создавать аукционы!"
             
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode="HTML"
-            )
+            await self._send(user_id, message)
             
             logging.info(f"✅ Уведомление о пополнении баланса отправлено пользователю {user_id}")
             return True
@@ -138,11 +175,7 @@ class NotificationManager:
             message += f"📋 Аукцион готов к публикации в канале.\n"
             message += f"💡 Нажмите кнопку 'Опубликовать' для размещения в канале."
             
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode="HTML"
-            )
+            await self._send(user_id, message)
             
             logging.info(f"✅ Уведомление о создании аукциона отправлено пользователю {user_id}")
             return True
@@ -151,7 +184,8 @@ class NotificationManager:
             logging.error(f"❌ Ошибка отправки уведомления о создании аукциона пользователю {user_id}: {e}")
             return False
     
-    async def send_auction_published_notification(self, user_id: int, auction_description: str, auction_id: int, channel_link: str = None) -> bool:
+    async def send_auction_published_notification(self, user_id: int, auction_description: str, auction_id: int, channel_link: str = None,
+                                                  remaining_balance: Optional[int] = None) -> bool:
         """
         Отправляет уведомление о публикации аукциона
         """
@@ -166,12 +200,10 @@ class NotificationManager:
                 message += f"📺 Аукцион размещен в канале\n\n"
             
             message += f"💡 Теперь пользователи могут делать ставки!"
+            if remaining_balance is not None:
+                message += f"\n💎 Осталось публикаций: {remaining_balance}"
             
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode="HTML"
-            )
+            await self._send(user_id, message)
             
             logging.info(f"✅ Уведомление о публикации аукциона отправлено пользователю {user_id}")
             return True
@@ -181,8 +213,9 @@ class NotificationManager:
             return False
 
 class AdminPanel:
-    def __init__(self):
-        self.db = Database(DATABASE_PATH)
+    def __init__(self, db: Optional[Database] = None):
+        # Общий экземпляр Database бота, чтобы кеш пользователей был один
+        self.db = db or Database(DATABASE_PATH)
         
     async def init_db(self):
         """Инициализация базы данных"""
@@ -259,17 +292,28 @@ class AdminPanel:
             logging.error(f"Error granting admin status: {e}")
             return False
 
-# Функции для обратной совместимости
-def init_notifications(bot_token: str) -> NotificationManager:
-    """Инициализировать менеджер уведомлений"""
-    return NotificationManager(bot_token)
+# Общий менеджер уведомлений приложения (создается в init_notifications)
+_notification_manager: Optional[NotificationManager] = None
 
+def init_notifications(bot: Bot, concurrency: int = 10) -> NotificationManager:
+    """Инициализировать общий менеджер уведомлений на сессии бота приложения"""
+    global _notification_manager
+    _notification_manager = NotificationManager(bot, concurrency)
+    return _notification_manager
+
+def get_notification_manager(bot: Bot) -> NotificationManager:
+    """Общий менеджер уведомлений (создается на переданном боте, если еще не инициализирован)"""
+    if _notification_manager is None:
+        return init_notifications(bot)
+    return _notification_manager
+
+# Функции для обратной совместимости
 async def send_auction_created_notification(bot, user_id: int, auction_description: str, auction_id: int) -> bool:
     """Отправить уведомление о создании аукциона"""
-    notification_manager = NotificationManager(bot.token)
-    return await notification_manager.send_auction_created_notification(user_id, auction_description, auction_id)
+    return await get_notification_manager(bot).send_auction_created_notification(user_id, auction_description, auction_id)
 
-async def send_auction_published_notification(bot, user_id: int, auction_description: str, auction_id: int, channel_link: str = None) -> bool:
+async def send_auction_published_notification(bot, user_id: int, auction_description: str, auction_id: int, channel_link: str = None,
+                                              remaining_balance: Optional[int] = None) -> bool:
     """Отправить уведомление о публикации аукциона"""
-    notification_manager = NotificationManager(bot.token)
-    return await notification_manager.send_auction_published_notification(user_id, auction_description, auction_id, channel_link)
+    return await get_notification_manager(bot).send_auction_published_notification(
+        user_id, auction_description, auction_id, channel_link, remaining_balance)
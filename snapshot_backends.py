@@ -0,0 +1,351 @@
+# Файл: snapshot_backends.py
+# Хранилища снимка состояния аукционов и журнала изменений для AuctionPersistence
+
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def _fsync_write(path: Path, data: str, mode: str = 'a'):
+    """Записать данные в файл и дождаться их попадания на диск"""
+    with open(path, mode, encoding='utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _atomic_write(path: Path, write: Callable[[BinaryIO], None]):
+    """
+    Атомарно заменить файл: запись во временный файл, fsync и os.replace.
+    Сбой посреди записи оставляет прежний файл целым.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        # Переименование тоже должно дойти до диска
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass  # Каталоги не открываются (Windows)
+
+
+def _replace_file(path: Path, data: str):
+    """Атомарно заменить файл текстом"""
+    _atomic_write(path, lambda f: f.write(data.encode('utf-8')))
+
+
+def snapshot_format(path: Path) -> str:
+    """
+    Формат снимка по расширению PERSISTENCE_FILE:
+    .json - один JSON документ, .jsonl - JSON lines (заголовок, затем строка на лот),
+    .jsonl.gz - те же JSON lines в gzip.
+    """
+    name = Path(path).name.lower()
+    if name.endswith('.jsonl.gz'):
+        return 'jsonl.gz'
+    if name.endswith('.jsonl'):
+        return 'jsonl'
+    return 'json'
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def write_snapshot(path: Path, header: Dict, records: Iterable[Tuple[Dict, List[Dict]]]):
+    """Записать снимок: заголовок и пары (аукцион, ставки новые первыми)"""
+    snapshot_type = snapshot_format(path)
+
+    def write(f: BinaryIO):
+        if snapshot_type == 'json':
+            # Документ собирается по лоту: между лотами поток отпускает GIL и не тормозит цикл событий
+            auction_bids = []
+            f.write(_dumps(header)[:-1].encode('utf-8') + b',"active_auctions":[')
+            for index, (auction, bids) in enumerate(records):
+                f.write((',' if index else '').encode('utf-8') + _dumps(auction).encode('utf-8'))
+                auction_bids.append(_dumps(str(auction['id'])) + ':' + _dumps(bids))
+            f.write(b'],"auction_bids":{')
+            for index, entry in enumerate(auction_bids):
+                f.write(((',' if index else '') + entry).encode('utf-8'))
+            f.write(b'}}')
+            return
+
+        out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0) if snapshot_type == 'jsonl.gz' else f
+        text = io.TextIOWrapper(out, encoding='utf-8')
+        text.write(_dumps(header) + "\n")
+        for auction, bids in records:
+            text.write(_dumps({'auction': auction, 'bids': bids}) + "\n")
+        text.flush()
+        text.detach()
+        if out is not f:
+            out.close()  # Дописывает хвост gzip, сам файл не закрывает
+
+    _atomic_write(Path(path), write)
+
+
+def read_snapshot(path: Path) -> Tuple[Dict, Iterator[Tuple[Dict, List[Dict]]]]:
+    """Прочитать снимок: заголовок и поток пар (аукцион, ставки новые первыми)"""
+    records = _iter_snapshot(Path(path))
+    return next(records), records
+
+
+def _iter_snapshot(path: Path):
+    snapshot_type = snapshot_format(path)
+    if snapshot_type == 'json':
+        with open(path, 'r', encoding='utf-8') as f:
+            state_data = json.load(f)
+        active_auctions = state_data.pop('active_auctions', [])
+        auction_bids = state_data.pop('auction_bids', {})
+        yield state_data
+        for auction in active_auctions:
+            yield auction, auction_bids.get(str(auction['id']), [])
+        return
+
+    opener = gzip.open if snapshot_type == 'jsonl.gz' else open
+    # Декодирование построчно: в памяти не бывает всего документа целиком
+    with opener(path, 'rt', encoding='utf-8') as f:
+        yield json.loads(f.readline())
+        for line in f:
+            record = json.loads(line)
+            yield record['auction'], record['bids']
+
+
+class SnapshotBackend:
+    """
+    Хранилище снимка и журнала. Методы синхронные: AuctionPersistence вызывает их
+    в фоновом потоке. Журнал передается готовыми строками JSON с номерами событий.
+    """
+    name = 'base'
+    # False - персистентность не нужна (состояние целиком в базе)
+    enabled = True
+
+    def read_snapshot(self) -> Optional[Tuple[Dict, Iterator[Tuple[Dict, List[Dict]]]]]:
+        """Заголовок и поток пар (аукцион, ставки новые первыми); None - снимка нет"""
+        raise NotImplementedError
+
+    def write_snapshot(self, header: Dict, records: Iterable[Tuple[Dict, List[Dict]]]):
+        raise NotImplementedError
+
+    def append_journal(self, entries: List[Tuple[int, str]]):
+        """Дописать пачку событий (номер, JSON) и дождаться их сохранности"""
+        raise NotImplementedError
+
+    def read_journal(self, after_seq: int = 0) -> List[Dict]:
+        """События журнала с номером больше after_seq"""
+        raise NotImplementedError
+
+    def trim_journal(self, seq: int):
+        """Удалить события, уже вошедшие в снимок (номер не больше seq)"""
+        raise NotImplementedError
+
+    def info(self) -> Dict:
+        """Сведения о снимке для админки: exists, size, last_modified, path"""
+        raise NotImplementedError
+
+
+class JsonFileBackend(SnapshotBackend):
+    """Снимок в файле (формат по расширению, см. snapshot_format) и журнал в файле <снимок>.journal"""
+    name = 'json'
+
+    def __init__(self, persistence_file: str = "auction_state.json"):
+        self.path = Path(persistence_file)
+        self.journal_path = self.path.with_name(self.path.name + '.journal')
+
+    def read_snapshot(self):
+        if not self.path.exists():
+            return None
+        return read_snapshot(self.path)
+
+    def write_snapshot(self, header, records):
+        write_snapshot(self.path, header, records)
+
+    def append_journal(self, entries):
+        _fsync_write(self.journal_path, "".join(line + "\n" for _, line in entries))
+
+    def read_journal(self, after_seq: int = 0) -> List[Dict]:
+        events = []
+        if not self.journal_path.exists():
+            return events
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Оборванная при сбое последняя строка
+                    logging.warning(f"Skipping damaged journal line in {self.journal_path}")
+                    continue
+                if event.get('seq', 0) > after_seq:
+                    events.append(event)
+        return events
+
+    def trim_journal(self, seq: int):
+        events = self.read_journal(after_seq=seq)
+        _replace_file(self.journal_path, "".join(_dumps(event) + "\n" for event in events))
+
+    def info(self) -> Dict:
+        journal_size = self.journal_path.stat().st_size if self.journal_path.exists() else 0
+        if not self.path.exists():
+            return {'exists': False, 'size': 0, 'last_modified': None, 'journal_size': journal_size}
+        stat = self.path.stat()
+        return {
+            'exists': True,
+            'size': stat.st_size,
+            'last_modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'path': str(self.path.absolute()),
+            'journal_size': journal_size,
+        }
+
+
+class SqliteBackend(SnapshotBackend):
+    """
+    Снимок и журнал в служебных таблицах той же базы SQLite. Запись снимка - одна
+    транзакция, поэтому он всегда целый; журнал надежен настолько же, насколько база.
+    """
+    name = 'sqlite'
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS persistence_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS persistence_snapshot (auction_id INTEGER PRIMARY KEY, data TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS persistence_journal (seq INTEGER PRIMARY KEY, data TEXT NOT NULL)",
+    )
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # Отдельное соединение на операцию: вызовы идут из разных потоков
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        if not self._schema_ready:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    def read_snapshot(self):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM persistence_meta WHERE key = 'header'").fetchone()
+        if row is None:
+            conn.close()
+            return None
+        return json.loads(row[0]), self._iter_records(conn)
+
+    @staticmethod
+    def _iter_records(conn: sqlite3.Connection):
+        try:
+            for (data,) in conn.execute("SELECT data FROM persistence_snapshot ORDER BY auction_id"):
+                record = json.loads(data)
+                yield record['auction'], record['bids']
+        finally:
+            conn.close()
+
+    def write_snapshot(self, header, records):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM persistence_snapshot")
+                conn.executemany(
+                    "INSERT INTO persistence_snapshot (auction_id, data) VALUES (?, ?)",
+                    ((auction['id'], _dumps({'auction': auction, 'bids': bids})) for auction, bids in records)
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO persistence_meta (key, value) VALUES ('header', ?)",
+                    (_dumps(dict(header, saved_at=datetime.now().isoformat())),)
+                )
+        finally:
+            conn.close()
+
+    def append_journal(self, entries):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO persistence_journal (seq, data) VALUES (?, ?)", entries)
+        finally:
+            conn.close()
+
+    def read_journal(self, after_seq: int = 0) -> List[Dict]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT data FROM persistence_journal WHERE seq > ? ORDER BY seq", (after_seq,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [json.loads(data) for (data,) in rows]
+
+    def trim_journal(self, seq: int):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM persistence_journal WHERE seq <= ?", (seq,))
+        finally:
+            conn.close()
+
+    def info(self) -> Dict:
+        conn = self._connect()
+        try:
+            header = conn.execute("SELECT value FROM persistence_meta WHERE key = 'header'").fetchone()
+            size = conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM persistence_snapshot").fetchone()[0]
+            journal_size = conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM persistence_journal").fetchone()[0]
+        finally:
+            conn.close()
+        if header is None:
+            return {'exists': False, 'size': 0, 'last_modified': None, 'journal_size': journal_size}
+        return {
+            'exists': True,
+            'size': size,
+            'last_modified': json.loads(header[0]).get('saved_at'),
+            'path': f"{Path(self.db_path).absolute()} (persistence_snapshot)",
+            'journal_size': journal_size,
+        }
+
+
+class NullBackend(SnapshotBackend):
+    """Без снимка и журнала: база (SQLite в режиме WAL) сама хранит состояние аукционов"""
+    name = 'none'
+    enabled = False
+
+    def read_snapshot(self):
+        return None
+
+    def write_snapshot(self, header, records):
+        pass
+
+    def append_journal(self, entries):
+        pass
+
+    def read_journal(self, after_seq: int = 0) -> List[Dict]:
+        return []
+
+    def trim_journal(self, seq: int):
+        pass
+
+    def info(self) -> Dict:
+        return {'exists': False, 'size': 0, 'last_modified': None, 'path': 'disabled (database only)'}
+
+
+def create_backend(kind: str, persistence_file: str = "auction_state.json",
+                   db_path: str = "auction_bot.db") -> SnapshotBackend:
+    """Хранилище по имени из PERSISTENCE_BACKEND: json, sqlite или none"""
+    kind = (kind or 'json').lower()
+    if kind == 'json':
+        return JsonFileBackend(persistence_file)
+    if kind == 'sqlite':
+        return SqliteBackend(db_path)
+    if kind == 'none':
+        return NullBackend()
+    raise ValueError(f"Unknown persistence backend: {kind}")
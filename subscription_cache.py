@@ -0,0 +1,95 @@
+# Файл: subscription_cache.py
+# Кеш статуса подписки на канал: раздельные TTL, single-flight и инвалидация по chat_member
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Tuple
+
+
+class SubscriptionCache:
+    """
+    Кеш результата get_chat_member по пользователю. Подписка кешируется на positive_ttl,
+    отсутствие подписки - на negative_ttl (обычно короче: пользователь может подписаться
+    сразу после отказа). Одновременные запросы одного пользователя делят один запрос к API.
+    """
+
+    def __init__(self, fetch: Callable[[int], Awaitable[bool]], positive_ttl: float = 300,
+                 negative_ttl: float = 30, maxsize: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.fetch = fetch
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'invalidations': 0}
+
+    async def get(self, user_id: int) -> bool:
+        """Подписан ли пользователь (из кеша или одним запросом к Telegram)"""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] > self.clock():
+            self._stats['hits'] += 1
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+        inflight = self._inflight.get(user_id)
+        if inflight is not None:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(inflight)
+
+        self._stats['misses'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            is_subscribed = await self.fetch(user_id)
+        except BaseException as e:
+            # Ошибки не кешируем: следующий запрос снова сходит в API
+            if self._inflight.get(user_id) is future:
+                del self._inflight[user_id]
+            if not future.done():
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                    future.exception()  # помечаем как полученное, если ждущих нет
+                else:
+                    future.cancel()
+            raise
+
+        if self._inflight.get(user_id) is future:
+            del self._inflight[user_id]
+            self._store(user_id, is_subscribed)
+        # Иначе пока шел запрос пришел chat_member: его статус новее и уже записан
+        if not future.done():
+            future.set_result(is_subscribed)
+        return is_subscribed
+
+    def set(self, user_id: int, is_subscribed: bool):
+        """Записать известный статус (из обновления chat_member)"""
+        self._stats['invalidations'] += 1
+        inflight = self._inflight.pop(user_id, None)
+        if inflight is not None and not inflight.done():
+            inflight.set_result(is_subscribed)
+        self._store(user_id, is_subscribed)
+
+    def invalidate(self, user_id: int):
+        """Забыть статус пользователя"""
+        self._stats['invalidations'] += 1
+        self._entries.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+
+    def _store(self, user_id: int, is_subscribed: bool):
+        ttl = self.positive_ttl if is_subscribed else self.negative_ttl
+        self._entries[user_id] = (is_subscribed, self.clock() + ttl)
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Доля попаданий и число сэкономленных запросов к Telegram"""
+        stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['size'] = len(self._entries)
+        stats['saved_round_trips'] = stats['hits'] + stats['coalesced']
+        stats['hit_rate'] = round(stats['saved_round_trips'] / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,239 @@
+# Файл: update_queue.py
+# Очередь входящих обновлений Telegram и пул обработчиков в общем цикле событий
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+# Поля обновления, в которых лежит событие с отправителем
+EVENT_KINDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request', 'channel_post', 'edited_channel_post',
+)
+
+
+def update_key(update: Union[dict, Update]) -> Any:
+    """Ключ упорядочивания: id отправителя (или чата), иначе само обновление"""
+    if isinstance(update, dict):
+        for kind in EVENT_KINDS:
+            event = update.get(kind)
+            if event:
+                sender = event.get('from') or event.get('user') or event.get('chat')
+                if sender:
+                    return sender['id']
+                break
+        return ('update', update.get('update_id'))
+
+    for kind in EVENT_KINDS:
+        event = getattr(update, kind, None)
+        if event is not None:
+            sender = getattr(event, 'from_user', None) or getattr(event, 'user', None) or getattr(event, 'chat', None)
+            if sender is not None:
+                return sender.id
+            break
+    return ('update', update.update_id)
+
+
+class UpdateDeduplicator:
+    """Окно последних update_id фиксированного размера: кольцевой буфер + множество"""
+
+    def __init__(self, size: int = 10000):
+        self.size = max(1, size)
+        self._ring: List[Optional[int]] = [None] * self.size
+        self._pos = 0
+        self._seen = set()
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._seen
+
+    def add(self, update_id: int):
+        """Запомнить update_id, вытеснив самый старый из окна"""
+        oldest = self._ring[self._pos]
+        if oldest is not None:
+            self._seen.discard(oldest)
+        self._ring[self._pos] = update_id
+        self._seen.add(update_id)
+        self._pos = (self._pos + 1) % self.size
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь обновлений с пулом воркеров. Обновления одного пользователя
+    обрабатываются строго по очереди (шаги FSM не перемешиваются), разных - параллельно.
+    При переполнении webhook отклоняет обновление (submit), а polling ждет места (put).
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, workers: int = 8, maxsize: int = 1000,
+                 dedup_window: int = 10000):
+        self.bot = bot
+        self.dp = dp
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        # Очередь обновлений каждого ключа; ключ присутствует, пока у него есть работа
+        self._pending: Dict[Any, Deque[Tuple[float, Union[dict, Update]]]] = {}
+        # Ключи, готовые к обработке (каждый не более одного раза)
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._size = 0
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: List[asyncio.Task] = []
+        # Повторные доставки webhook (тот же update_id) отбрасываются до разбора модели
+        self._seen = UpdateDeduplicator(dedup_window)
+        self._shedding = False
+        self._stats = {
+            'received': 0, 'processed': 0, 'dropped': 0, 'duplicates': 0, 'errors': 0,
+            'max_depth': 0, 'total_wait': 0.0, 'max_wait': 0.0,
+        }
+
+    def start(self):
+        """Запустить воркеры в текущем цикле событий"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Update queue started ({self.workers} workers, max {self.maxsize} updates)")
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict:
+        """Метрики очереди: глубина, ожидание в очереди (мс) и счетчики"""
+        stats = dict(self._stats)
+        processed = stats.pop('processed')
+        total_wait = stats.pop('total_wait')
+        stats['processed'] = processed
+        stats['depth'] = self._size
+        stats['avg_wait_ms'] = round(total_wait / processed * 1000, 2) if processed else 0.0
+        stats['max_wait_ms'] = round(stats['max_wait'] * 1000, 2)
+        del stats['max_wait']
+        return stats
+
+    def submit(self, update: Union[dict, Update]) -> bool:
+        """
+        Поставить обновление без ожидания. False - очередь переполнена, обновление сброшено.
+        Повтор уже принятого обновления подтверждается (True), но не обрабатывается.
+        """
+        self._stats['received'] += 1
+        if self._is_duplicate(update):
+            return True
+        if self._size >= self.maxsize:
+            self._stats['dropped'] += 1
+            if not self._shedding:
+                # Логируем только начало сброса, иначе при всплеске лог станет узким местом
+                self._shedding = True
+                logging.warning(f"Update queue is full ({self._size}), shedding updates")
+            return False
+        if self._shedding:
+            self._shedding = False
+            logging.info(f"Update queue recovered, dropped {self._stats['dropped']} updates so far")
+        self._enqueue(update)
+        return True
+
+    async def put(self, update: Union[dict, Update]):
+        """Поставить обновление, дождавшись места в очереди (backpressure для polling)"""
+        self._stats['received'] += 1
+        if self._is_duplicate(update):
+            return
+        while self._size >= self.maxsize:
+            self._not_full.clear()
+            await self._not_full.wait()
+        self._enqueue(update)
+
+    def _is_duplicate(self, update: Union[dict, Update]) -> bool:
+        update_id = update.get('update_id') if isinstance(update, dict) else update.update_id
+        if update_id is not None and update_id in self._seen:
+            self._stats['duplicates'] += 1
+            return True
+        return False
+
+    def _enqueue(self, update: Union[dict, Update]):
+        # В окно попадают только принятые обновления: сброшенное при переполнении Telegram доставит снова
+        update_id = update.get('update_id') if isinstance(update, dict) else update.update_id
+        if update_id is not None:
+            self._seen.add(update_id)
+        key = update_key(update)
+        item = (asyncio.get_running_loop().time(), update)
+        queue = self._pending.get(key)
+        if queue is None:
+            self._pending[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            # Ключ уже в работе или в ожидании - воркер заберет обновление следом
+            queue.append(item)
+        self._size += 1
+        self._idle.clear()
+        if self._size > self._stats['max_depth']:
+            self._stats['max_depth'] = self._size
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            enqueued_at, update = queue.popleft()
+
+            wait = loop.time() - enqueued_at
+            self._stats['total_wait'] += wait
+            if wait > self._stats['max_wait']:
+                self._stats['max_wait'] = wait
+
+            try:
+                if isinstance(update, dict):
+                    await self.dp.feed_raw_update(self.bot, update)
+                else:
+                    await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logging.error(f"❌ Ошибка обработки обновления Telegram: {e}")
+            finally:
+                self._stats['processed'] += 1
+                self._size -= 1
+                self._not_full.set()
+                if self._size == 0:
+                    self._idle.set()
+                if queue:
+                    # Следующее обновление того же пользователя - в конец очереди готовых ключей
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+
+    async def poll(self, polling_timeout: int = 30):
+        """Long polling: обновления идут в ту же очередь, что и в webhook режиме"""
+        allowed_updates = self.dp.resolve_used_update_types()
+        request_timeout = int(self.bot.session.timeout + polling_timeout)
+        offset = None
+        delay = 1
+        while True:
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset,
+                    timeout=polling_timeout,
+                    allowed_updates=allowed_updates,
+                    request_timeout=request_timeout
+                )
+            except Exception as e:
+                logging.error(f"Failed to fetch updates: {e}, retry in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            delay = 1
+            for update in updates:
+                await self.put(update)
+                offset = update.update_id + 1
+
+    async def stop(self, timeout: Optional[float] = 10):
+        """Дождаться обработки очереди (не дольше timeout) и остановить воркеры"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Update queue stopped with {self._size} unprocessed updates")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logging.info(f"Update queue stopped: {self.stats()}")
@@ -1,6 +1,7 @@
 # Файл: utils.py
 # Утилиты для работы с временем и общие функции
 
+import time
 import pytz
 from datetime import datetime, timedelta
 from typing import Optional
@@ -17,6 +18,24 @@ def get_moscow_time_naive() -> datetime:
     """Получить текущее время в московском часовом поясе без информации о часовом поясе"""
     return get_moscow_time().replace(tzinfo=None)
 
+def moscow_timestamp(dt: datetime) -> float:
+    """Перевести время в Unix timestamp (время без часового пояса считается московским)"""
+    if dt.tzinfo is None:
+        dt = MOSCOW_TZ.localize(dt)
+    return dt.timestamp()
+
+def now_ms() -> int:
+    """Текущее время в миллисекундах Unix (UTC)"""
+    return int(time.time() * 1000)
+
+def to_epoch_ms(dt: datetime) -> int:
+    """Время -> миллисекунды Unix (время без часового пояса считается московским)"""
+    return round(moscow_timestamp(dt) * 1000)
+
+def from_epoch_ms(ms: int) -> datetime:
+    """Миллисекунды Unix -> московское время без информации о часовом поясе"""
+    return datetime.fromtimestamp(ms / 1000, MOSCOW_TZ).replace(tzinfo=None)
+
 def format_moscow_time(dt: datetime, format_str: str = "%d.%m.%Y %H:%M") -> str:
     """Форматировать время в московском часовом поясе"""
     if dt.tzinfo is None: